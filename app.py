@@ -1,20 +1,136 @@
 import pandas as pd
 import numpy as np
-from flask import Flask, render_template, request, jsonify
-import joblib
+from flask import Flask, render_template, request, jsonify, g, Response, has_request_context, url_for
 import math
 from datetime import datetime
 import json
 import os
-import requests
 from typing import Dict, List, Any
 import traceback
+import logging
+import random
+import threading
+import time
+from features import (
+    DAY_NAMES, parse_datetimes, time_features, duration_features, pairwise_duration_features, destination_features,
+    destination_default, FeatureLayout, booster_categories, xgb_fast_predict, lgb_fast_predict,
+    DURATION_FEATURE_NAMES, DESTINATION_FEATURE_NAMES
+)
+from destination_table import DestinationTable
+from batching import MicroBatcher, render_metrics as render_batcher_metrics
+from metrics import Registry, StageTimer
+from cached_response import CachedJSONResponse, CachedBinaryResponse
+from demand_tiles import DemandTiles, TILES_FILE
+from serving import InferencePool
+from traffic_log import TrafficRecorder
+from model_store import LazyModels, file_stamp, SOURCE_FILES, NATIVE_DIR, read_manifest, load_duration_model, duration_missing, load_destination_model, load_cluster_index, load_tree_arrays
+from routing import RoutingClient, RouteNotFound, RouterBusy, RoutingError, OSRM_URL, render_metrics as render_route_metrics
+from model_bundles import (
+    ModelReloader, BUNDLES_DIR, read_current, bundle_path, verify_bundle, cluster_names, validate_canary,
+    render_metrics as render_model_metrics
+)
+from prediction_cache import PredictionCache, make_backend, render_metrics as render_prediction_cache_metrics
+from gazetteer import (
+    Gazetteer, PlaceSearch, ReverseGeocoder, UpstreamError, GAZETTEER_FILE, NOMINATIM_URL, NOMINATIM_REVERSE_URL,
+    render_metrics as render_search_metrics, render_reverse_metrics
+)
+from live_stats import LiveClusterStats, SNAPSHOT_FILE, blend_cluster_stats, trip_filter, render_metrics as render_live_metrics
+from static_assets import StaticAssets
 
 app = Flask(__name__)
 
+# --- LOGGING & METRICS ---
+# LOG_LEVEL=DEBUG enables per-request detail for a LOG_SAMPLE_RATE fraction of requests
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 0.01))
+# TRAFFIC_LOG=path appends every /api/* request as JSONL for `loadtest.py run --traffic`
+TRAFFIC_LOG = os.environ.get('TRAFFIC_LOG')
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger('nyc_taxi')
+
+metrics = Registry()
+traffic_recorder = TrafficRecorder(TRAFFIC_LOG) if TRAFFIC_LOG else None
+REQUESTS_TOTAL = metrics.counter('taxi_requests_total', 'HTTP requests by endpoint and status', ['endpoint', 'status'])
+REQUEST_SECONDS = metrics.histogram('taxi_request_duration_seconds', 'End-to-end request latency', ['endpoint'])
+STAGE_SECONDS = metrics.histogram('taxi_stage_duration_seconds', 'Latency of each prediction stage', ['endpoint', 'stage'])
+
 # --- LOAD MODELS ---
-MODEL_PATH = 'models/'
-models = {}
+MODEL_PATH = os.environ.get('MODEL_PATH', 'models/')
+
+# MODEL_FORMAT: 'auto' prefers the native export in models/native/ (see model_store.py),
+# 'native' requires it, 'joblib' always unpickles.
+# MODEL_LOADING: 'eager' loads every model at import, 'parallel' does so in threads,
+# 'lazy' loads each model group on first use
+MODEL_FORMAT = os.environ.get('MODEL_FORMAT', 'auto')
+# MODEL_EVALUATOR: 'booster' predicts with XGBoost/LightGBM, 'arrays' walks the flattened
+# node arrays from the native export in NumPy (see tree_arrays.py) and never imports them
+MODEL_EVALUATOR = os.environ.get('MODEL_EVALUATOR', 'booster')
+MODEL_LOADING = os.environ.get('MODEL_LOADING', 'eager')
+MODEL_WARMUP = os.environ.get('MODEL_WARMUP', '1') == '1'
+
+# Versioned bundles (see model_bundles.py): models load from the version named in
+# MODEL_BUNDLES_DIR/CURRENT when it exists, and a new version is hot-swapped in when
+# CURRENT changes (checked every MODEL_RELOAD_INTERVAL seconds, 0 disables).
+# MODEL_CANARY_MAX_DRIFT bounds how far canary durations may move between versions
+MODEL_BUNDLES_DIR = os.environ.get('MODEL_BUNDLES_DIR', MODEL_PATH + BUNDLES_DIR)
+MODEL_RELOAD_INTERVAL = float(os.environ.get('MODEL_RELOAD_INTERVAL', 5))
+MODEL_CANARY_MAX_DRIFT = float(os.environ.get('MODEL_CANARY_MAX_DRIFT', 0.5))
+
+# Threads that split large batch predictions; gunicorn.conf.py sets this per worker
+INFERENCE_THREADS = int(os.environ.get('INFERENCE_THREADS', os.cpu_count() or 1))
+inference = InferencePool(INFERENCE_THREADS)
+
+# 'table' serves destination queries from the precomputed probability table
+# (see destination_table.py), 'live' always calls LightGBM
+DESTINATION_MODE = os.environ.get('DESTINATION_MODE', 'table')
+
+# Micro-batching: coalesce concurrent single-trip predictions into one booster call
+MICROBATCH = os.environ.get('MICROBATCH', '0') == '1'
+MICROBATCH_MAX_SIZE = int(os.environ.get('MICROBATCH_MAX_SIZE', 64))
+MICROBATCH_MAX_WAIT_MS = float(os.environ.get('MICROBATCH_MAX_WAIT_MS', 2.0))
+
+# Duration prediction cache keyed on trip inputs snapped to a PREDICTION_CACHE_GRID_M grid.
+# PREDICTION_CACHE_BACKEND: '' (per-process only), 'local' (in-process stand-in) or redis://host:port/db
+PREDICTION_CACHE = os.environ.get('PREDICTION_CACHE', '0') == '1'
+PREDICTION_CACHE_GRID_M = float(os.environ.get('PREDICTION_CACHE_GRID_M', 50))
+PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', 65536))
+PREDICTION_CACHE_BACKEND = os.environ.get('PREDICTION_CACHE_BACKEND', '')
+
+# Duration matrix: largest origins x destinations request, and pairs per booster call
+# (bounds the feature block at DURATION_MATRIX_CHUNK x features x 8 bytes)
+DURATION_MATRIX_MAX_CELLS = int(os.environ.get('DURATION_MATRIX_MAX_CELLS', 250000))
+DURATION_MATRIX_CHUNK = int(os.environ.get('DURATION_MATRIX_CHUNK', 65536))
+
+# Departure sweep: longest window in slots, and slots per streamed (SSE) event
+DEPARTURE_SWEEP_MAX_SLOTS = int(os.environ.get('DEPARTURE_SWEEP_MAX_SLOTS', 4032))
+DEPARTURE_SWEEP_EVENT_SLOTS = int(os.environ.get('DEPARTURE_SWEEP_EVENT_SLOTS', 96))
+
+# Place search: bundled gazetteer first, Nominatim only for queries it cannot answer.
+# SEARCH_UPSTREAM_URL= (empty) keeps /api/search fully offline
+GAZETTEER_PATH = os.environ.get('GAZETTEER_PATH', GAZETTEER_FILE)
+SEARCH_UPSTREAM_URL = os.environ.get('SEARCH_UPSTREAM_URL', NOMINATIM_URL)
+SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE', 4096))
+
+# Reverse geocoding for map clicks: nearest gazetteer place, cached per REVERSE_GRID_M cell.
+# Clicks farther than REVERSE_MAX_DISTANCE_M from every place go to REVERSE_UPSTREAM_URL (empty: none)
+REVERSE_UPSTREAM_URL = os.environ.get('REVERSE_UPSTREAM_URL', NOMINATIM_REVERSE_URL)
+REVERSE_GRID_M = float(os.environ.get('REVERSE_GRID_M', 25))
+REVERSE_CACHE_SIZE = int(os.environ.get('REVERSE_CACHE_SIZE', 16384))
+REVERSE_MAX_DISTANCE_M = float(os.environ.get('REVERSE_MAX_DISTANCE_M', 2000))
+
+# Routing: OSRM server, route cache and the cap on concurrent upstream calls
+ROUTE_UPSTREAM_URL = os.environ.get('ROUTE_UPSTREAM_URL', OSRM_URL)
+ROUTE_CACHE_SIZE = int(os.environ.get('ROUTE_CACHE_SIZE', 2048))
+ROUTE_CACHE_TTL = float(os.environ.get('ROUTE_CACHE_TTL', 3600))
+ROUTE_MAX_CONCURRENCY = int(os.environ.get('ROUTE_MAX_CONCURRENCY', 8))
+ROUTE_TIMEOUT = float(os.environ.get('ROUTE_TIMEOUT', 5.0))
+
+# Live cluster stats (see live_stats.py): trips posted to /api/trips/completed update per-zone
+# aggregates, served by /api/cluster_stats for zones with at least LIVE_STATS_MIN_TRIPS trips.
+# Written to LIVE_STATS_SNAPSHOT every LIVE_STATS_SNAPSHOT_INTERVAL seconds (empty: memory only)
+LIVE_STATS_SNAPSHOT = os.environ.get('LIVE_STATS_SNAPSHOT', SNAPSHOT_FILE)
+LIVE_STATS_SNAPSHOT_INTERVAL = float(os.environ.get('LIVE_STATS_SNAPSHOT_INTERVAL', 60))
+LIVE_STATS_MIN_TRIPS = int(os.environ.get('LIVE_STATS_MIN_TRIPS', 50))
 
 # NYC Cluster names for 10 clusters
 CLUSTER_NAMES = {
@@ -80,62 +196,271 @@ CLUSTER_NAMES = {
     }
 }
 
-def load_models():
-    """Load all ML models and cluster data"""
-    try:
-        print("Loading models from:", MODEL_PATH)
-        
-        # Model 1: Duration Prediction
+def warm_up(predict, layout, features):
+    """Run one synthetic row so the booster's lazy initialization happens at load time"""
+    predict(layout.fill({k: np.atleast_1d(v) for k, v in features.items()}))
+
+def load_duration_group(model_path, manifest, warm=MODEL_WARMUP):
+    """XGBoost duration model, its feature layout and predict function"""
+    if MODEL_EVALUATOR == 'arrays':
+        print("  Loading duration tree arrays...")
+        model, feat_duration = load_tree_arrays(model_path, manifest, 'duration')
+        predict = model.predict
+    else:
         print("  Loading XGBoost duration model...")
-        models['xgb_duration'] = joblib.load(MODEL_PATH + 'xgb_problem1_final.pkl')
-        models['feat_duration'] = joblib.load(MODEL_PATH + 'features_problem1_final.pkl')
-        print(f"    Duration features: {len(models['feat_duration'])}")
-        
-        # Model 2: Destination Prediction
+        model, feat_duration = load_duration_model(model_path, manifest)
+        predict = xgb_fast_predict(model, missing=duration_missing(manifest))
+    entries = {
+        'xgb_duration': model,
+        'feat_duration': feat_duration,
+        'duration_layout': FeatureLayout(feat_duration, DURATION_FEATURE_NAMES),
+        'duration_predict': predict
+    }
+    print(f"    Duration features: {len(feat_duration)}")
+    if entries['duration_layout'].missing:
+        print(f"    WARNING: Missing features for duration model: {entries['duration_layout'].missing}")
+    if warm:
+        warm_up(entries['duration_predict'], entries['duration_layout'],
+                duration_features(40.758, -73.9855, 40.7484, -73.9857, 8, 1, 0, 1, 0, 0))
+    if MICROBATCH:
+        entries['duration_batcher'] = MicroBatcher(
+            entries['duration_predict'], 'duration',
+            max_batch_size=MICROBATCH_MAX_SIZE, max_wait_ms=MICROBATCH_MAX_WAIT_MS
+        )
+    return entries
+
+def load_destination_group(model_path, manifest, warm=MODEL_WARMUP):
+    """LightGBM destination model, its feature layout and predict function"""
+    if MODEL_EVALUATOR == 'arrays':
+        print("  Loading destination tree arrays...")
+        booster, feat_dest = load_tree_arrays(model_path, manifest, 'destination')
+        predict = booster.predict
+    else:
         print("  Loading LightGBM destination model...")
-        models['lgb_dest'] = joblib.load(MODEL_PATH + 'lgbm_destination_prediction.pkl')
-        models['feat_dest'] = joblib.load(MODEL_PATH + 'features_problem2_final.pkl')
-        print(f"    Destination features: {len(models['feat_dest'])}")
-        
-        # K-Means Clustering Model
-        print("  Loading K-Means clustering model...")
-        models['kmeans'] = joblib.load(MODEL_PATH + 'kmeans_pickup.pkl')
-        print(f"    K-Means n_clusters: {models['kmeans'].n_clusters}")
-        
-        # Load cluster centroids
-        print("  Loading cluster centroids...")
-        with open(MODEL_PATH + 'cluster_centroids.json', 'r') as f:
-            cluster_data = json.load(f)
-        
-        # Process centroids
-        models['cluster_centroids'] = []
-        for i, centroid in enumerate(cluster_data['pickup_clusters']):
-            if i < len(CLUSTER_NAMES):
-                models['cluster_centroids'].append({
-                    'id': i,
-                    'coordinates': centroid,
-                    'name': CLUSTER_NAMES[i]['name'],
-                    'type': CLUSTER_NAMES[i]['type'],
-                    'color': CLUSTER_NAMES[i]['color'],
-                    'description': CLUSTER_NAMES[i]['description']
-                })
-            else:
-                print(f"WARNING: Skipping centroid {i} - no cluster name mapping")
+        booster, feat_dest = load_destination_model(model_path, manifest)
+        predict = lgb_fast_predict(booster)
+    entries = {
+        'lgb_dest': booster,
+        'feat_dest': feat_dest,
+        'dest_layout': FeatureLayout(
+            feat_dest, DESTINATION_FEATURE_NAMES, default=destination_default,
+            categories=booster_categories(booster, feat_dest)
+        ),
+        'dest_predict': predict
+    }
+    print(f"    Destination features: {len(feat_dest)}")
+    if entries['dest_layout'].missing:
+        print(f"    Destination features filled with defaults: {entries['dest_layout'].missing}")
+    if warm:
+        warm_up(entries['dest_predict'], entries['dest_layout'], destination_features(0, 1, 8, 1, 0))
+    if MICROBATCH:
+        entries['dest_batcher'] = MicroBatcher(
+            entries['dest_predict'], 'dest',
+            max_batch_size=MICROBATCH_MAX_SIZE, max_wait_ms=MICROBATCH_MAX_WAIT_MS
+        )
+    return entries
+
+def load_dest_table_group(model_path):
+    table = DestinationTable.load(model_path)
+    print(f"    Destination table: {'Loaded' if table is not None else 'Not found, using live model'}")
+    return {'dest_table': table}
+
+def load_cluster_group(model_path, manifest, warm=MODEL_WARMUP):
+    """Cluster assignment index and centroid metadata"""
+    print("  Loading K-Means cluster index...")
+    cluster_index = load_cluster_index(model_path, manifest)
+    print(f"    K-Means n_clusters: {len(cluster_index.centroids)}")
+    if warm:
+        cluster_index.assign(40.758, -73.9855)
+    
+    # Load cluster centroids, and the names shipped with a bundle (built-in names otherwise)
+    with open(model_path + 'cluster_centroids.json', 'r') as f:
+        cluster_data = json.load(f)
+    names = cluster_names(model_path, CLUSTER_NAMES)
+    
+    # Process centroids
+    cluster_centroids = []
+    for i, centroid in enumerate(cluster_data['pickup_clusters']):
+        if i in names:
+            cluster_centroids.append({
+                'id': i,
+                'coordinates': centroid,
+                'name': names[i]['name'],
+                'type': names[i]['type'],
+                'color': names[i]['color'],
+                'description': names[i]['description']
+            })
+        else:
+            print(f"WARNING: Skipping centroid {i} - no cluster name mapping")
+    print(f"    Cluster centroids loaded: {len(cluster_centroids)} zones")
+    return {'cluster_index': cluster_index, 'cluster_centroids': cluster_centroids}
+
+def load_models(model_path=MODEL_PATH, version='unversioned', loading=MODEL_LOADING, warm=MODEL_WARMUP):
+    """Register the model groups for one model directory and load them according to `loading`"""
+    try:
+        started = time.perf_counter()
+        models = LazyModels(version=version, model_path=model_path)
+        manifest = read_manifest(model_path) if MODEL_FORMAT != 'joblib' else None
+        if (MODEL_FORMAT == 'native' or MODEL_EVALUATOR == 'arrays') and manifest is None:
+            raise FileNotFoundError(f"No usable native export in {model_path}native/; run 'python model_store.py export'")
+        print(f"Loading models {version} from: {model_path} ({'native' if manifest else 'joblib'} format, {loading})")
         
-        print(f"\nAll models loaded successfully")
-        print(f"Cluster centroids loaded: {len(models['cluster_centroids'])} zones")
+        batcher = ['duration_batcher'] if MICROBATCH else []
+        models.register('duration', ['xgb_duration', 'feat_duration', 'duration_layout', 'duration_predict'] + batcher,
+                        lambda: load_duration_group(model_path, manifest, warm))
+        batcher = ['dest_batcher'] if MICROBATCH else []
+        models.register('destination', ['lgb_dest', 'feat_dest', 'dest_layout', 'dest_predict'] + batcher,
+                        lambda: load_destination_group(model_path, manifest, warm))
+        if DESTINATION_MODE == 'table':
+            models.register('dest_table', ['dest_table'], lambda: load_dest_table_group(model_path))
+        models.register('clusters', ['cluster_index', 'cluster_centroids'],
+                        lambda: load_cluster_group(model_path, manifest, warm))
         
-        # Verify feature compatibility
-        print("\nFeature Verification:")
-        print(f"  Duration model expects {len(models['feat_duration'])} features")
-        print(f"  Destination model expects {len(models['feat_dest'])} features")
+        if loading == 'lazy':
+            print("  Models load on first use")
+            return models
+        models.load_all(parallel=loading == 'parallel')
+        print(f"\nAll models loaded in {time.perf_counter() - started:.2f}s "
+              f"({', '.join(f'{k} {v:.2f}s' for k, v in models.load_seconds.items())})")
+        return models
         
     except Exception as e:
         print(f"Error loading models: {e}")
         traceback.print_exc()
         raise e
 
-load_models()
+def startup_models():
+    """The bundle named in CURRENT when there is one, else the flat MODEL_PATH directory"""
+    version = read_current(MODEL_BUNDLES_DIR)
+    if version is None:
+        return load_models()
+    verify_bundle(MODEL_BUNDLES_DIR, version)
+    return load_models(bundle_path(MODEL_BUNDLES_DIR, version), version)
+
+models = startup_models()
+metrics.add_collector(lambda: render_batcher_metrics(
+    [models[k] for k in ['duration_batcher', 'dest_batcher'] if k in models]
+))
+
+def reset_after_fork():
+    """Restart per-process threads in a worker forked from a preloaded master (see gunicorn.conf.py)"""
+    for key in ['duration_batcher', 'dest_batcher']:
+        if key in models:
+            models[key].restart()
+
+os.register_at_fork(after_in_child=reset_after_fork)
+
+gazetteer = Gazetteer.from_csv(GAZETTEER_PATH)
+place_search = PlaceSearch(gazetteer, upstream_url=SEARCH_UPSTREAM_URL or None, cache_size=SEARCH_CACHE_SIZE)
+metrics.add_collector(lambda: render_search_metrics(place_search))
+reverse_geocoder = ReverseGeocoder(gazetteer, upstream_url=REVERSE_UPSTREAM_URL or None, grid_m=REVERSE_GRID_M,
+                                   cache_size=REVERSE_CACHE_SIZE, max_distance_m=REVERSE_MAX_DISTANCE_M)
+metrics.add_collector(lambda: render_reverse_metrics(reverse_geocoder))
+
+router = RoutingClient(ROUTE_UPSTREAM_URL, cache_size=ROUTE_CACHE_SIZE, ttl=ROUTE_CACHE_TTL,
+                       max_concurrent=ROUTE_MAX_CONCURRENCY, timeout=ROUTE_TIMEOUT)
+metrics.add_collector(lambda: render_route_metrics(router))
+
+# Created before gunicorn forks, so every worker shares the same aggregates
+live_stats = LiveClusterStats(len(CLUSTER_NAMES), snapshot_path=LIVE_STATS_SNAPSHOT or None,
+                              snapshot_interval=LIVE_STATS_SNAPSHOT_INTERVAL)
+metrics.add_collector(lambda: render_live_metrics(live_stats))
+
+def duration_cache_namespace(models):
+    """Identifies the duration model on disk, so shared cache entries never outlive it"""
+    for path in [models.model_path + SOURCE_FILES['duration'], models.model_path + NATIVE_DIR + 'duration.ubj']:
+        if os.path.exists(path):
+            return f"duration:{models.version}:{file_stamp(path)['mtime_ns']}"
+    return f'duration:{models.version}'
+
+duration_cache = None
+if PREDICTION_CACHE:
+    duration_cache = PredictionCache(grid_m=PREDICTION_CACHE_GRID_M, size=PREDICTION_CACHE_SIZE,
+                                     backend=make_backend(PREDICTION_CACHE_BACKEND),
+                                     namespace=duration_cache_namespace(models))
+    metrics.add_collector(lambda: render_prediction_cache_metrics(duration_cache) if duration_cache else [])
+
+# --- HOT RELOAD ---
+def pinned_models():
+    """The model set the current request started with; a hot swap never changes it mid-request"""
+    if has_request_context() and 'models' in g:
+        return g.models
+    return models
+
+def score_canary(models):
+    """Durations, destination probabilities and clusters for a fixed set of trips"""
+    from serving import sample_trips
+    batch = parse_trip_batch({'trips': sample_trips(64, seed=7)})
+    n = len(batch['pickup_lat'])
+    clusters = models['cluster_index'].predict(np.column_stack([
+        np.concatenate([batch['pickup_lat'], batch['dropoff_lat']]),
+        np.concatenate([batch['pickup_lon'], batch['dropoff_lon']])
+    ]))
+    features = duration_features(batch['pickup_lat'], batch['pickup_lon'], batch['dropoff_lat'], batch['dropoff_lon'],
+                                 batch['hour'], batch['month'], batch['weekday'], batch['passengers'],
+                                 clusters[:n], clusters[n:])
+    log_dur = np.asarray(models['duration_predict'](models['duration_layout'].fill(features)))
+    features = destination_features(clusters[:n], batch['passengers'], batch['hour'], batch['month'], batch['weekday'])
+    probabilities = np.asarray(models['dest_predict'](models['dest_layout'].fill(features))).reshape(n, -1)
+    return {
+        'duration_minutes': np.maximum(1, np.round(np.expm1(log_dur), 0)),
+        'probabilities': probabilities,
+        'clusters': clusters
+    }
+
+def swap_models(new_models):
+    """Make new_models the active set; requests already running keep the old one"""
+    global models
+    old_models, models = models, new_models
+    for response in [clusters_response, cluster_stats_response, demand_tiles_index, *demand_tiles_months.values()]:
+        response.invalidate()
+    if duration_cache is not None:
+        duration_cache.namespace = duration_cache_namespace(new_models)
+        duration_cache.clear()
+    # Give requests pinned to the old set time to finish before stopping its batcher threads
+    def retire():
+        for key in ['duration_batcher', 'dest_batcher']:
+            if key in old_models:
+                old_models[key].stop()
+    timer = threading.Timer(30, retire)
+    timer.daemon = True
+    timer.start()
+
+reloader = ModelReloader(
+    MODEL_BUNDLES_DIR,
+    load=lambda version, path: load_models(path, version, loading='eager', warm=True),
+    validate=lambda new_models: validate_canary(score_canary(new_models), score_canary(models), MODEL_CANARY_MAX_DRIFT),
+    swap=swap_models,
+    active_version=models.version,
+    interval=MODEL_RELOAD_INTERVAL
+)
+metrics.add_collector(lambda: render_model_metrics(reloader))
+
+def log_sampled(msg, *args):
+    """Debug log for the sampled subset of requests"""
+    if getattr(g, 'log_sample', False):
+        logger.debug(msg, *args)
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.models = models
+    # Started on the first request of each process, so a pre-fork master never watches
+    reloader.start()
+    live_stats.start()
+    g.log_sample = logger.isEnabledFor(logging.DEBUG) and random.random() < LOG_SAMPLE_RATE
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or 'unknown'
+    if endpoint not in ('static', 'hashed_asset'):
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, endpoint)
+        REQUESTS_TOTAL.inc(endpoint, str(response.status_code))
+    if traffic_recorder is not None and request.path.startswith('/api/'):
+        traffic_recorder.record(request)
+    if 'models' in g:
+        response.headers['X-Model-Version'] = g.models.version
+    return response
 
 # --- MATH FUNCTIONS ---
 def calculate_haversine(lat1, lon1, lat2, lon2):
@@ -157,6 +482,14 @@ def calculate_bearing(lat1, lon1, lat2, lon2):
     brng = math.degrees(math.atan2(y, x))
     return (brng + 360) % 360
 
+def predict_row(kind, row):
+    """Predict a single feature row, coalesced with concurrent requests when micro-batching is on"""
+    models = pinned_models()
+    batcher = models.get(f'{kind}_batcher')
+    if batcher is not None:
+        return batcher.submit(row)
+    return models[f'{kind}_predict'](row)[0]
+
 def get_confidence_label(probability):
     """Get confidence label based on probability"""
     if probability >= 0.8:
@@ -168,6 +501,24 @@ def get_confidence_label(probability):
     else:
         return "Low"
 
+# --- STATIC ASSETS ---
+# Content-hashed, precompressed copies from `python static_assets.py build`; without a
+# build, templates link the plain /static/ files
+static_assets = StaticAssets(app.static_folder)
+
+def asset_url(filename):
+    """Fingerprinted URL for a static file when it has been built, the plain static URL otherwise"""
+    hashed = static_assets.url_path(filename)
+    if hashed is None:
+        return url_for('static', filename=filename)
+    return url_for('hashed_asset', path=hashed)
+
+app.jinja_env.globals['asset_url'] = asset_url
+
+@app.route('/assets/<path:path>')
+def hashed_asset(path):
+    return static_assets.respond(request, path)
+
 # --- ROUTES ---
 @app.route('/')
 def home():
@@ -188,60 +539,151 @@ def cluster_visualization():
     return render_template('cluster_visualization.html')
 
 # --- API ENDPOINTS ---
+def build_clusters_payload():
+    """Cluster information for map visualization"""
+    clusters = []
+    for cluster in models['cluster_centroids']:
+        clusters.append({
+            'id': cluster['id'],
+            'center': cluster['coordinates'],
+            'name': cluster['name'],
+            'type': cluster['type'],
+            'color': cluster['color'],
+            'radius': 1.5,
+            'description': cluster['description']
+        })
+    return {'status': 'success', 'clusters': clusters}
+
+def cluster_stats_path():
+    """The active model version's file first, then the working directory"""
+    stats_path = pinned_models().model_path + 'cluster_stats.json'
+    if not os.path.exists(stats_path):
+        stats_path = 'cluster_stats.json'
+    return stats_path
+
+def build_cluster_stats_payload():
+    """Cluster statistics from the JSON file, blended with the live aggregates for zones with enough live trips"""
+    try:
+        with open(cluster_stats_path(), 'r') as f:
+            stats_data = json.load(f)
+        
+        # Convert keys to integers for consistency
+        stats_dict = {int(k): v for k, v in stats_data.items()}
+    
+    except Exception as e:
+        logger.warning("Error loading cluster stats: %s", e)
+        # Return empty stats if file not found
+        stats_dict = {}
+    stats_dict = blend_cluster_stats(stats_dict, live_stats.cluster_stats(LIVE_STATS_MIN_TRIPS))
+    return {'status': 'success', 'stats': stats_dict}
+
+# Encoded once and served from memory: the zones are static between deploys, and the stats
+# body is rebuilt only when the file changes or trips arrive (checked at most once a second)
+clusters_response = CachedJSONResponse(build_clusters_payload)
+cluster_stats_response = CachedJSONResponse(build_cluster_stats_payload, watch_path=cluster_stats_path,
+                                             version=lambda: (pinned_models().version, live_stats.version()))
+
 @app.route('/api/clusters', methods=['GET'])
 def get_clusters():
     """Return cluster information for map visualization"""
     try:
-        clusters = []
-        for cluster in models['cluster_centroids']:
-            clusters.append({
-                'id': cluster['id'],
-                'center': cluster['coordinates'],
-                'name': cluster['name'],
-                'type': cluster['type'],
-                'color': cluster['color'],
-                'radius': 1.5,
-                'description': cluster['description']
-            })
-        
-        return jsonify({'status': 'success', 'clusters': clusters})
+        return clusters_response.respond(request)
     
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 400
 
 @app.route('/api/cluster_stats', methods=['GET'])
 def get_cluster_stats():
-    """Return cluster statistics from JSON file"""
+    """Return cluster statistics, blending live trips into the JSON file's figures"""
+    return cluster_stats_response.respond(request)
+
+# Fields every completed trip must carry; passengers defaults to 1 as in the batch endpoints
+COMPLETED_TRIP_FIELDS = ['pickup_lat', 'pickup_lon', 'dropoff_lat', 'dropoff_lon', 'datetime', 'trip_duration']
+
+def completed_trip_minutes(trips):
+    """Each trip's duration in minutes, after checking every trip has the fields ingestion needs"""
+    minutes = np.empty(len(trips))
+    for i, trip in enumerate(trips):
+        if not isinstance(trip, dict):
+            raise ValueError(f"Trip {i} must be an object")
+        missing = [field for field in COMPLETED_TRIP_FIELDS if trip.get(field) is None]
+        if missing:
+            raise ValueError(f"Trip {i} is missing {', '.join(repr(field) for field in missing)}")
+        try:
+            minutes[i] = float(trip['trip_duration']) / 60
+        except (TypeError, ValueError):
+            raise ValueError(f"Trip {i}: 'trip_duration' must be a number of seconds")
+    return minutes
+
+@app.route('/api/trips/completed', methods=['POST'])
+def ingest_completed_trips():
+    """Add completed trips (one trip object or {'trips': [...]}) to the live cluster stats"""
+    models = pinned_models()
     try:
-        # Try to load from models directory first
-        stats_path = 'cluster_stats.json'
-        if not os.path.exists(stats_path):
-            stats_path = MODEL_PATH + 'cluster_stats.json'
-        
-        with open(stats_path, 'r') as f:
-            stats_data = json.load(f)
-        
-        # Convert keys to integers for consistency
-        stats_dict = {int(k): v for k, v in stats_data.items()}
-        
-        return jsonify({'status': 'success', 'stats': stats_dict})
-    
+        data = request.json
+        if isinstance(data, dict) and 'trips' not in data:
+            data = {'trips': [data]}
+        minutes = completed_trip_minutes(trip_list(data))
+        batch = parse_trip_batch(data)
+        valid, speed = trip_filter(batch['pickup_lat'], batch['pickup_lon'], batch['dropoff_lat'], batch['dropoff_lon'],
+                                   minutes, batch['passengers'])
+        clusters = models['cluster_index'].predict(np.column_stack([batch['pickup_lat'], batch['pickup_lon']]))
+        accepted = live_stats.add_many(clusters, batch['hour'], minutes, speed, batch['passengers'], valid)
+        return jsonify({'status': 'success', 'accepted': accepted, 'rejected': len(minutes) - accepted})
+
     except Exception as e:
-        print(f"Error loading cluster stats: {e}")
-        # Return empty stats if file not found
-        return jsonify({'status': 'success', 'stats': {}})
+        logger.error("Error in ingest_completed_trips: %s", e)
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+def load_demand_tiles():
+    """Tiles of the active model version, checked against that version's destination model"""
+    model_path = pinned_models().model_path
+    tiles = DemandTiles.load(model_path)
+    if tiles is None:
+        raise FileNotFoundError(f"No demand tiles in {model_path}; run 'python demand_tiles.py build'")
+    return tiles
+
+def demand_tiles_path():
+    return pinned_models().model_path + TILES_FILE
+
+# Precomputed by demand_tiles.py: an index plus one binary body per month, rebuilt when the
+# file or the model version changes
+demand_tiles_index = CachedJSONResponse(lambda: load_demand_tiles().index(), watch_path=demand_tiles_path,
+                                        version=lambda: pinned_models().version)
+demand_tiles_months = {
+    month: CachedBinaryResponse(lambda month=month: load_demand_tiles().month_bytes(month),
+                                watch_path=demand_tiles_path, version=lambda: pinned_models().version,
+                                cache_control='public, max-age=300')
+    for month in range(1, 13)
+}
+
+@app.route('/api/demand_tiles', methods=['GET'])
+def get_demand_tiles_index():
+    """Layout of the hour-of-week destination demand tiles"""
+    try:
+        return demand_tiles_index.respond(request)
+    except FileNotFoundError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 404
+
+@app.route('/api/demand_tiles/<int:month>', methods=['GET'])
+def get_demand_tiles(month):
+    """168 hour-of-week demand frames for one month as uint8 arrays"""
+    if month not in demand_tiles_months:
+        return jsonify({'status': 'error', 'message': 'Month must be 1-12'}), 404
+    try:
+        return demand_tiles_months[month].respond(request)
+    except FileNotFoundError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 404
 
 @app.route('/api/predict_duration', methods=['POST'])
 def predict_duration():
     """Predict travel duration between two points"""
+    models = pinned_models()
     try:
+        timer = StageTimer(STAGE_SECONDS, 'predict_duration')
         data = request.json
-        print(f"Received duration prediction request: {data}")
-        
-        # FIX: Debug waktu
-        dt = datetime.strptime(data['datetime'], '%Y-%m-%dT%H:%M')
-        print(f"Parsed datetime: {dt}")
-        print(f"Hour: {dt.hour}, Minute: {dt.minute}, Day: {dt.weekday()}")
+        timer.mark('json_parse')
+        log_sampled("Received duration prediction request: %s", data)
         
         # Validate input
         p_lat = float(data.get('pickup_lat', 0))
@@ -254,6 +696,12 @@ def predict_duration():
             return jsonify({'status': 'error', 'message': 'Invalid pickup coordinates'}), 400
         
         dt = datetime.strptime(data['datetime'], '%Y-%m-%dT%H:%M')
+        timer.mark('datetime_parse')
+        
+        # K-Means Clustering
+        p_cluster = models['cluster_index'].assign(p_lat, p_lon)
+        d_cluster = models['cluster_index'].assign(d_lat, d_lon)
+        timer.mark('cluster_assignment')
         
         # Feature Engineering
         dist_km = calculate_haversine(p_lat, p_lon, d_lat, d_lon)
@@ -273,10 +721,6 @@ def predict_duration():
         m_sin = np.sin(2 * np.pi * month / 12)
         m_cos = np.cos(2 * np.pi * month / 12)
         
-        # K-Means Clustering
-        p_cluster = int(models['kmeans'].predict([[p_lat, p_lon]])[0])
-        d_cluster = int(models['kmeans'].predict([[d_lat, d_lon]])[0])
-        
         # Prepare input for Model
         input_data = {
             'distance_km': dist_km,
@@ -301,24 +745,17 @@ def predict_duration():
             'month_cos': m_cos
         }
         
-        # Create DataFrame
-        df_in = pd.DataFrame([input_data])
+        # Fill the precompiled feature row (model column order, defaults applied)
+        row = models['duration_layout'].fill_row(input_data)
+        timer.mark('feature_engineering')
         
-        # Select only features needed by the model
-        available_features = [c for c in models['feat_duration'] if c in df_in.columns]
-        missing_features = [c for c in models['feat_duration'] if c not in df_in.columns]
-        
-        if missing_features:
-            print(f"WARNING: Missing features for duration model: {missing_features}")
-            # Add missing features with default values
-            for feat in missing_features:
-                df_in[feat] = 0
-        
-        # Ensure correct column order
-        df_in = df_in[models['feat_duration']]
-        
-        # Predict Duration
-        log_dur = models['xgb_duration'].predict(df_in)[0]
+        # Predict Duration, reusing the result for a recent trip between the same grid cells
+        if duration_cache is not None:
+            key = duration_cache.key(p_lat, p_lon, d_lat, d_lon, hour, day, month, passengers)
+            log_dur = duration_cache.get_or_compute(key, lambda: float(predict_row('duration', row)))
+        else:
+            log_dur = predict_row('duration', row)
+        timer.mark('model_predict')
         duration_minutes = max(1, round(np.expm1(log_dur), 0))
         
         # Get cluster info
@@ -327,6 +764,7 @@ def predict_duration():
         
         response = {
             'status': 'success',
+            'model_version': models.version,
             'duration_minutes': int(duration_minutes),
             'distance_km': round(dist_km, 2),
             'pickup_cluster': p_cluster,
@@ -339,26 +777,30 @@ def predict_duration():
             'dropoff_coords': [d_lat, d_lon],
             'time_info': {
                 'hour': hour,
-                'day': ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'][day],
+                'day': DAY_NAMES[day],
                 'is_rush_hour': bool(is_rush),
                 'is_weekend': bool(is_weekend)
             }
         }
         
-        print(f"Duration prediction successful: {response['duration_minutes']} minutes")
-        return jsonify(response)
+        log_sampled("Duration prediction successful: %s minutes", response['duration_minutes'])
+        body = jsonify(response)
+        timer.mark('response_serialization')
+        return body
         
     except Exception as e:
-        print(f"Error in predict_duration: {e}")
-        traceback.print_exc()
+        logger.exception("Error in predict_duration: %s", e)
         return jsonify({'status': 'error', 'message': str(e)}), 400
 
 @app.route('/api/predict_destination', methods=['POST'])
 def predict_destination():
     """Predict top 3 destination clusters based on pickup location"""
+    models = pinned_models()
     try:
+        timer = StageTimer(STAGE_SECONDS, 'predict_destination')
         data = request.json
-        print(f"Received destination prediction request: {data}")
+        timer.mark('json_parse')
+        log_sampled("Received destination prediction request: %s", data)
         
         # Validate input
         p_lat = float(data.get('pickup_lat', 40.7580))
@@ -366,6 +808,11 @@ def predict_destination():
         passengers = int(data.get('passengers', 1))
         
         dt = datetime.strptime(data['datetime'], '%Y-%m-%dT%H:%M')
+        timer.mark('datetime_parse')
+        
+        # K-Means Clustering
+        p_cluster = models['cluster_index'].assign(p_lat, p_lon)
+        timer.mark('cluster_assignment')
         
         # Feature Engineering
         hour = dt.hour
@@ -380,87 +827,69 @@ def predict_destination():
         h_cos = np.cos(2 * np.pi * hour / 24)
         m_sin = np.sin(2 * np.pi * month / 12)
         m_cos = np.cos(2 * np.pi * month / 12)
+        timer.mark('feature_engineering')
         
-        # K-Means Clustering
-        p_cluster = int(models['kmeans'].predict([[p_lat, p_lon]])[0])
-        
-        # PERBAIKAN: Gunakan hanya fitur yang dibutuhkan model
-        input_data = {
-            'pickup_cluster': p_cluster,
-            'passenger_count': passengers,
-            'hour': hour,
-            'day_of_week': day_of_week,
-            'month': month,
-            'is_weekend': is_weekend,
-            'is_rush_hour': is_rush,
-            'hour_sin': h_sin,
-            'hour_cos': h_cos,
-            'month_sin': m_sin,
-            'month_cos': m_cos
-        }
-        
-        print(f"Input features: {input_data}")
-        
-        # Create DataFrame
-        df_in = pd.DataFrame([input_data])
-        
-        # Ambil fitur yang dibutuhkan model
-        expected_features = models['feat_dest']
-        print(f"Expected features ({len(expected_features)}): {expected_features}")
-        
-        # Tambahkan fitur yang hilang
-        missing_features = [f for f in expected_features if f not in df_in.columns]
-        if missing_features:
-            print(f"⚠️  Adding missing features: {missing_features}")
-            for feat in missing_features:
-                if 'day_of_week_idx' in feat:
-                    df_in[feat] = day_of_week
-                elif 'day' in feat:
-                    df_in[feat] = day_of_week
-                elif 'sin' in feat or 'cos' in feat:
-                    df_in[feat] = 0.0
-                else:
-                    df_in[feat] = 0
+        # Precomputed probability table: O(1) lookup, no LightGBM call
+        table = models.get('dest_table')
+        cached = table.lookup(p_cluster, passengers, hour, day, month) if table is not None else None
+        if cached is not None:
+            probabilities, top_3_indices = cached
+        else:
+            # PERBAIKAN: Gunakan hanya fitur yang dibutuhkan model
+            input_data = {
+                'pickup_cluster': p_cluster,
+                'passenger_count': passengers,
+                'hour': hour,
+                'day_of_week': day_of_week,
+                'day_of_week_idx': day_of_week,
+                'month': month,
+                'is_weekend': is_weekend,
+                'is_rush_hour': is_rush,
+                'hour_sin': h_sin,
+                'hour_cos': h_cos,
+                'month_sin': m_sin,
+                'month_cos': m_cos
+            }
         
-        # Pastikan urutan kolom sesuai dengan training
-        df_in = df_in[expected_features]
+            log_sampled("Input features: %s", input_data)
         
-        print(f"✅ Final dataframe shape: {df_in.shape}")
+            # Fill the precompiled feature row (training column order, defaults applied)
+            row = models['dest_layout'].fill_row(input_data)
         
-        # --- PREDIKSI ---
-        try:
-            # LightGBM predict
-            probabilities = models['lgb_dest'].predict(df_in)
+            # --- PREDIKSI ---
+            try:
+                # LightGBM predict
+                probabilities = predict_row('dest', row)
             
-            # Jika output 2D, ambil baris pertama
-            if len(probabilities.shape) == 2:
-                probabilities = probabilities[0]
+                # Jika output 2D, ambil baris pertama
+                if len(probabilities.shape) == 2:
+                    probabilities = probabilities[0]
             
-            # Pastikan probabilities valid
-            if np.sum(probabilities) == 0:
-                print("⚠️  All probabilities zero, using fallback")
-                probabilities = np.ones(len(models['cluster_centroids'])) / len(models['cluster_centroids'])
+                # Pastikan probabilities valid
+                if np.sum(probabilities) == 0:
+                    logger.warning("All probabilities zero, using fallback")
+                    probabilities = np.ones(len(models['cluster_centroids'])) / len(models['cluster_centroids'])
             
-        except Exception as e:
-            print(f"LightGBM prediction error: {e}")
+            except Exception as e:
+                logger.error("LightGBM prediction error: %s", e)
             
-            # Fallback: probabilities berdasarkan cluster pickup
-            probabilities = np.zeros(len(models['cluster_centroids']))
-            probabilities[p_cluster] = 0.4  # 40% untuk cluster pickup
+                # Fallback: probabilities berdasarkan cluster pickup
+                probabilities = np.zeros(len(models['cluster_centroids']))
+                probabilities[p_cluster] = 0.4  # 40% untuk cluster pickup
             
-            # Beri probabilitas ke cluster lain
-            for i in range(len(probabilities)):
-                if i != p_cluster:
-                    probabilities[i] = np.random.rand() * 0.1
+                # Beri probabilitas ke cluster lain
+                for i in range(len(probabilities)):
+                    if i != p_cluster:
+                        probabilities[i] = np.random.rand() * 0.1
             
-            # Normalisasi
-            probabilities = probabilities / probabilities.sum()
+                # Normalisasi
+                probabilities = probabilities / probabilities.sum()
         
-        # Get top 3 predictions
-        top_3_indices = np.argsort(probabilities)[-3:][::-1]
+            # Get top 3 predictions
+            top_3_indices = np.argsort(probabilities)[-3:][::-1]
         
-        print(f"Top 3 indices: {top_3_indices}")
-        print(f"Top 3 probabilities: {[probabilities[i] for i in top_3_indices]}")
+        timer.mark('model_predict')
+        log_sampled("Top 3 indices: %s, probabilities: %s", top_3_indices, [probabilities[i] for i in top_3_indices])
         
         top_3_predictions = []
         for idx in top_3_indices:
@@ -468,7 +897,7 @@ def predict_destination():
                 prob = float(probabilities[idx])
                 cluster_info = models['cluster_centroids'][idx]
                 
-                description = CLUSTER_NAMES.get(idx, {}).get('description', 'No description available')
+                description = cluster_info.get('description', 'No description available')
                 
                 top_3_predictions.append({
                     'cluster': int(idx),
@@ -486,22 +915,24 @@ def predict_destination():
         
         response = {
             'status': 'success',
+            'model_version': models.version,
             'pickup_cluster': p_cluster,
             'pickup_cluster_name': pickup_cluster_info['name'],
             'pickup_cluster_color': pickup_cluster_info['color'],
             'pickup_coords': [p_lat, p_lon],
             'hour': hour,
-            'day_of_week': ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'][day],
+            'day_of_week': DAY_NAMES[day],
             'top_predictions': top_3_predictions
         }
         
-        print(f"Destination prediction successful!")
-        print(f"   Pickup: Zone {p_cluster} ({pickup_cluster_info['name']})")
+        log_sampled("Destination prediction successful, pickup zone %s (%s)", p_cluster, pickup_cluster_info['name'])
         
-        return jsonify(response)
+        body = jsonify(response)
+        timer.mark('response_serialization')
+        return body
         
     except Exception as e:
-        print(f"❌ Critical Error in predict_destination: {e}")
+        logger.exception("Critical Error in predict_destination: %s", e)
         
         # Fallback response sederhana
         return jsonify({
@@ -509,6 +940,324 @@ def predict_destination():
             'message': str(e)
         }), 500
 
+# --- BATCH API ENDPOINTS ---
+MAX_BATCH_SIZE = 10000
+
+def trip_list(data):
+    """The request's 'trips' list, checked for size"""
+    trips = data.get('trips') if isinstance(data, dict) else None
+    if not isinstance(trips, list) or not trips:
+        raise ValueError("'trips' must be a non-empty list")
+    if len(trips) > MAX_BATCH_SIZE:
+        raise ValueError(f"Batch too large: {len(trips)} trips (max {MAX_BATCH_SIZE})")
+    return trips
+
+def parse_trip_batch(data, with_dropoff=True):
+    """Convert a list of trip dicts into column arrays"""
+    trips = trip_list(data)
+
+    batch = {
+        'pickup_lat': np.array([float(t.get('pickup_lat', 0)) for t in trips]),
+        'pickup_lon': np.array([float(t.get('pickup_lon', 0)) for t in trips]),
+        'passengers': np.array([int(t.get('passengers', 1)) for t in trips]),
+    }
+    if with_dropoff:
+        batch['dropoff_lat'] = np.array([float(t.get('dropoff_lat', 0)) for t in trips])
+        batch['dropoff_lon'] = np.array([float(t.get('dropoff_lon', 0)) for t in trips])
+    batch['hour'], batch['month'], batch['weekday'] = parse_datetimes([t['datetime'] for t in trips])
+
+    invalid = ~((np.abs(batch['pickup_lat']) <= 90) & (np.abs(batch['pickup_lon']) <= 180))
+    if invalid.any():
+        raise ValueError(f"Invalid pickup coordinates at trip {int(np.argmax(invalid))}")
+    return batch
+
+@app.route('/api/predict_duration/batch', methods=['POST'])
+def predict_duration_batch():
+    """Predict travel duration for many trips in one vectorized pass"""
+    models = pinned_models()
+    try:
+        timer = StageTimer(STAGE_SECONDS, 'predict_duration_batch')
+        data = request.json
+        timer.mark('json_parse')
+        batch = parse_trip_batch(data)
+        n = len(batch['pickup_lat'])
+        timer.mark('datetime_parse')
+
+        # One K-Means call for all pickup and dropoff points
+        points = np.column_stack([
+            np.concatenate([batch['pickup_lat'], batch['dropoff_lat']]),
+            np.concatenate([batch['pickup_lon'], batch['dropoff_lon']])
+        ])
+        clusters = models['cluster_index'].predict(points)
+        p_cluster, d_cluster = clusters[:n], clusters[n:]
+        timer.mark('cluster_assignment')
+
+        features = duration_features(
+            batch['pickup_lat'], batch['pickup_lon'], batch['dropoff_lat'], batch['dropoff_lon'],
+            batch['hour'], batch['month'], batch['weekday'], batch['passengers'], p_cluster, d_cluster
+        )
+        block = models['duration_layout'].fill(features)
+        timer.mark('feature_engineering')
+
+        log_dur = inference.predict(models['duration_predict'], block)
+        timer.mark('model_predict')
+        duration_minutes = np.maximum(1, np.round(np.expm1(log_dur), 0)).astype(int)
+        distance_km = np.round(features['distance_km'], 2)
+
+        predictions = [
+            {
+                'duration_minutes': int(duration_minutes[i]),
+                'distance_km': float(distance_km[i]),
+                'pickup_cluster': int(p_cluster[i]),
+                'dropoff_cluster': int(d_cluster[i])
+            }
+            for i in range(n)
+        ]
+        body = jsonify({'status': 'success', 'model_version': models.version, 'count': n, 'predictions': predictions})
+        timer.mark('response_serialization')
+        return body
+
+    except Exception as e:
+        logger.error("Error in predict_duration_batch: %s", e)
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+@app.route('/api/predict_destination/batch', methods=['POST'])
+def predict_destination_batch():
+    """Predict top 3 destination clusters for many pickups in one vectorized pass"""
+    models = pinned_models()
+    try:
+        timer = StageTimer(STAGE_SECONDS, 'predict_destination_batch')
+        data = request.json
+        timer.mark('json_parse')
+        batch = parse_trip_batch(data, with_dropoff=False)
+        n = len(batch['pickup_lat'])
+        timer.mark('datetime_parse')
+
+        points = np.column_stack([batch['pickup_lat'], batch['pickup_lon']])
+        p_cluster = models['cluster_index'].predict(points)
+        timer.mark('cluster_assignment')
+
+        table = models.get('dest_table')
+        cached = table.lookup_batch(
+            p_cluster, batch['passengers'], batch['hour'], batch['weekday'], batch['month']
+        ) if table is not None else None
+        if cached is not None:
+            probabilities, top_3 = cached
+        else:
+            features = destination_features(
+                p_cluster, batch['passengers'], batch['hour'], batch['month'], batch['weekday']
+            )
+            block = models['dest_layout'].fill(features)
+            probabilities = inference.predict(models['dest_predict'], block).reshape(n, -1)
+            top_3 = np.argsort(probabilities, axis=1)[:, -3:][:, ::-1]
+        timer.mark('model_predict')
+
+        predictions = []
+        for i in range(n):
+            top_predictions = []
+            for idx in top_3[i]:
+                prob = float(probabilities[i, idx])
+                top_predictions.append({
+                    'cluster': int(idx),
+                    'name': models['cluster_centroids'][idx]['name'],
+                    'probability': round(prob * 100, 1),
+                    'confidence': get_confidence_label(prob)
+                })
+            predictions.append({
+                'pickup_cluster': int(p_cluster[i]),
+                'top_predictions': top_predictions
+            })
+        body = jsonify({'status': 'success', 'model_version': models.version, 'count': n, 'predictions': predictions})
+        timer.mark('response_serialization')
+        return body
+
+    except Exception as e:
+        logger.error("Error in predict_destination_batch: %s", e)
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+def parse_points(values, name):
+    """[{'lat', 'lon'}] or [[lat, lon]] -> (lat, lon) arrays"""
+    if not isinstance(values, list) or not values:
+        raise ValueError(f"'{name}' must be a non-empty list")
+    points = np.array([(p['lat'], p['lon']) if isinstance(p, dict) else p for p in values], dtype=np.float64)
+    if points.ndim != 2 or points.shape[1] != 2:
+        raise ValueError(f"'{name}' must hold {{lat, lon}} objects or [lat, lon] pairs")
+    invalid = ~((np.abs(points[:, 0]) <= 90) & (np.abs(points[:, 1]) <= 180))
+    if invalid.any():
+        raise ValueError(f"Invalid coordinates in '{name}' at index {int(np.argmax(invalid))}")
+    return points[:, 0], points[:, 1]
+
+@app.route('/api/duration_matrix', methods=['POST'])
+def duration_matrix():
+    """Predicted minutes from every origin to every destination at one departure time"""
+    models = pinned_models()
+    try:
+        timer = StageTimer(STAGE_SECONDS, 'duration_matrix')
+        data = request.json or {}
+        timer.mark('json_parse')
+        o_lat, o_lon = parse_points(data.get('origins'), 'origins')
+        d_lat, d_lon = parse_points(data.get('destinations'), 'destinations')
+        n, m = len(o_lat), len(d_lat)
+        if n * m > DURATION_MATRIX_MAX_CELLS:
+            raise ValueError(f"Matrix too large: {n} x {m} pairs (max {DURATION_MATRIX_MAX_CELLS})")
+        top_k = int(data.get('top_k', 0))
+        top_k_by = data.get('top_k_by', 'origin')
+        if top_k_by not in ('origin', 'destination'):
+            raise ValueError("'top_k_by' must be 'origin' or 'destination'")
+        passengers = int(data.get('passengers', 1))
+        hour, month, weekday = (int(v[0]) for v in parse_datetimes([data['datetime']]))
+        timer.mark('datetime_parse')
+
+        # One cluster lookup per distinct point; cabs and passengers often share spots
+        points, inverse = np.unique(np.column_stack([np.concatenate([o_lat, d_lat]), np.concatenate([o_lon, d_lon])]),
+                                    axis=0, return_inverse=True)
+        clusters = models['cluster_index'].predict(points)[inverse.ravel()]
+        o_cluster, d_cluster = clusters[:n], clusters[n:]
+        timer.mark('cluster_assignment')
+
+        # Whole origin rows per chunk, so no feature block exceeds DURATION_MATRIX_CHUNK pairs
+        rows_per_chunk = max(1, DURATION_MATRIX_CHUNK // m)
+        minutes = np.empty((n, m), dtype=np.int32)
+        distance_km = np.empty((n, m), dtype=np.float64) if data.get('include_distance') else None
+        for lo in range(0, n, rows_per_chunk):
+            hi = min(n, lo + rows_per_chunk)
+            features = pairwise_duration_features(o_lat[lo:hi], o_lon[lo:hi], o_cluster[lo:hi], d_lat, d_lon, d_cluster,
+                                                  hour, month, weekday, passengers)
+            log_dur = inference.predict(models['duration_predict'], models['duration_layout'].fill(features))
+            minutes[lo:hi] = np.maximum(1, np.round(np.expm1(log_dur), 0)).reshape(hi - lo, m)
+            if distance_km is not None:
+                distance_km[lo:hi] = np.round(features['distance_km'], 2).reshape(hi - lo, m)
+        timer.mark('model_predict')
+
+        response = {
+            'status': 'success',
+            'origins': n,
+            'destinations': m,
+            'duration_minutes': minutes.tolist()
+        }
+        if distance_km is not None:
+            response['distance_km'] = distance_km.tolist()
+        if top_k > 0:
+            # Per origin: the k closest destinations; per destination: the k closest origins
+            by_row = minutes if top_k_by == 'origin' else minutes.T
+            k = min(top_k, by_row.shape[1])
+            nearest = np.argpartition(by_row, k - 1, axis=1)[:, :k]
+            order = np.argsort(np.take_along_axis(by_row, nearest, axis=1), axis=1, kind='stable')
+            response['top_k'] = np.take_along_axis(nearest, order, axis=1).tolist()
+            response['top_k_by'] = top_k_by
+        body = jsonify(response)
+        timer.mark('response_serialization')
+        return body
+
+    except Exception as e:
+        logger.error("Error in duration_matrix: %s", e)
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+def departure_slots(data):
+    """Departure times from 'start' to 'end' (or start + 'window_minutes') every 'step_minutes'"""
+    start = datetime.strptime(data.get('start') or data['datetime'], '%Y-%m-%dT%H:%M')
+    step = int(data.get('step_minutes', 15))
+    if not 1 <= step <= 60:
+        raise ValueError("'step_minutes' must be between 1 and 60")
+    if data.get('end'):
+        end = datetime.strptime(data['end'], '%Y-%m-%dT%H:%M')
+    else:
+        end = start + pd.Timedelta(minutes=int(data.get('window_minutes', 180)))
+    if end < start:
+        raise ValueError("'end' is before 'start'")
+    n_slots = int((end - start).total_seconds() // 60 // step) + 1
+    if n_slots > DEPARTURE_SWEEP_MAX_SLOTS:
+        raise ValueError(f"Window too long: {n_slots} slots (max {DEPARTURE_SWEEP_MAX_SLOTS})")
+    return pd.date_range(start, periods=n_slots, freq=f'{step}min'), step
+
+@app.route('/api/departure_sweep', methods=['POST'])
+def departure_sweep():
+    """Predicted duration for every departure slot in a window, and the fastest slot"""
+    models = pinned_models()
+    try:
+        timer = StageTimer(STAGE_SECONDS, 'departure_sweep')
+        data = request.json or {}
+        timer.mark('json_parse')
+        p_lat = float(data.get('pickup_lat', 0))
+        p_lon = float(data.get('pickup_lon', 0))
+        d_lat = float(data.get('dropoff_lat', 0))
+        d_lon = float(data.get('dropoff_lon', 0))
+        passengers = int(data.get('passengers', 1))
+        if not (-90 <= p_lat <= 90) or not (-180 <= p_lon <= 180):
+            return jsonify({'status': 'error', 'message': 'Invalid pickup coordinates'}), 400
+        slots, step = departure_slots(data)
+        timer.mark('datetime_parse')
+
+        p_cluster = models['cluster_index'].assign(p_lat, p_lon)
+        d_cluster = models['cluster_index'].assign(d_lat, d_lon)
+        timer.mark('cluster_assignment')
+
+        # Geometry once; only the calendar features vary, and the model sees them at
+        # hour granularity, so each distinct (hour, weekday, month) is scored once
+        hour, weekday, month = slots.hour.to_numpy(), slots.weekday.to_numpy(), slots.month.to_numpy()
+        calendar, inverse = np.unique(np.column_stack([hour, weekday, month]), axis=0, return_inverse=True)
+        trip = duration_features(p_lat, p_lon, d_lat, d_lon, hour[0], month[0], weekday[0], passengers, p_cluster, d_cluster)
+        trip.update(time_features(calendar[:, 0], calendar[:, 2], calendar[:, 1]))
+        block = models['duration_layout'].fill(trip, n_rows=len(calendar))
+        timer.mark('feature_engineering')
+
+        log_dur = inference.predict(models['duration_predict'], block)
+        timer.mark('model_predict')
+        minutes = np.maximum(1, np.round(np.expm1(log_dur), 0)).astype(int)[inverse.ravel()]
+        departures = slots.strftime('%Y-%m-%dT%H:%M').tolist()
+        arrivals = (slots + pd.to_timedelta(minutes, unit='min')).strftime('%Y-%m-%dT%H:%M').tolist()
+        best = int(np.argmin(minutes))
+        summary = {
+            'status': 'success',
+            'slots': len(slots),
+            'step_minutes': step,
+            'distance_km': round(float(trip['distance_km']), 2),
+            'pickup_cluster': p_cluster,
+            'dropoff_cluster': d_cluster,
+            'best': {'departure': departures[best], 'arrival': arrivals[best], 'duration_minutes': int(minutes[best])},
+            'worst_minutes': int(minutes.max())
+        }
+
+        if data.get('stream') or request.accept_mimetypes.best == 'text/event-stream':
+            # Long windows: slots go out in batches as SSE events, the summary last
+            def events():
+                for lo in range(0, len(slots), DEPARTURE_SWEEP_EVENT_SLOTS):
+                    hi = lo + DEPARTURE_SWEEP_EVENT_SLOTS
+                    chunk = {'departures': departures[lo:hi], 'arrivals': arrivals[lo:hi],
+                             'duration_minutes': minutes[lo:hi].tolist()}
+                    yield f"event: slots\ndata: {json.dumps(chunk)}\n\n"
+                yield f"event: summary\ndata: {json.dumps(summary)}\n\n"
+            return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+        body = jsonify({**summary, 'departures': departures, 'arrivals': arrivals, 'duration_minutes': minutes.tolist()})
+        timer.mark('response_serialization')
+        return body
+
+    except Exception as e:
+        logger.error("Error in departure_sweep: %s", e)
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+@app.route('/api/batching', methods=['GET'])
+def get_batching_stats():
+    """Return micro-batching queue depth, batch-size and wait-time histograms"""
+    models = pinned_models()
+    batchers = [models[k] for k in ['duration_batcher', 'dest_batcher'] if k in models]
+    return jsonify({
+        'status': 'success',
+        'enabled': MICROBATCH,
+        'batchers': [b.stats() for b in batchers]
+    })
+
+@app.route('/api/model', methods=['GET'])
+def get_model_version():
+    """Active model version, available bundles and the outcome of the last reload"""
+    return jsonify({'status': 'success', **reloader.stats()})
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus text exposition of request, stage and micro-batching metrics"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/search', methods=['GET'])
 def search_location():
     """Search for locations in NYC area"""
@@ -517,26 +1266,34 @@ def search_location():
     
     if len(query) < 2:
         return jsonify([])
+    limit = max(1, min(limit, 50))
     
     try:
-        # Focus search on NYC area
-        url = f'https://nominatim.openstreetmap.org/search?format=json&q={query}&viewbox=-74.25,40.49,-73.70,40.91&bounded=1&limit={limit}'
-        headers = {'User-Agent': 'NYC-Taxi-App/1.0'}
-        response = requests.get(url, headers=headers, timeout=5)
-        data = response.json()
-        
-        results = []
-        for item in data[:limit]:
-            results.append({
-                'display_name': item['display_name'],
-                'lat': float(item['lat']),
-                'lon': float(item['lon'])
-            })
-        return jsonify(results)
+        return jsonify(place_search.search(query, limit))
+    except UpstreamError as e:
+        logger.warning("Search upstream error: %s", e)
+        return jsonify([])
     except Exception as e:
-        print(f"Search error: {e}")
+        logger.warning("Search error: %s", e)
         return jsonify([])
 
+@app.route('/api/reverse', methods=['GET'])
+def reverse_geocode():
+    """Name the place at a map click"""
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    if lat is None or lon is None or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return jsonify({'status': 'error', 'message': 'Missing or invalid coordinates'}), 400
+
+    try:
+        place = reverse_geocoder.reverse(lat, lon)
+    except UpstreamError as e:
+        logger.warning("Reverse geocoding upstream error: %s", e)
+        return jsonify({'status': 'error', 'message': str(e)}), 502
+    if place is None:
+        return jsonify({'status': 'error', 'message': 'No place found'}), 404
+    return jsonify({'status': 'success', **place})
+
 @app.route('/api/route', methods=['GET'])
 def get_route():
     """Get route geometry between two points"""
@@ -549,22 +1306,23 @@ def get_route():
         if None in [p_lat, p_lon, d_lat, d_lon]:
             return jsonify({'status': 'error', 'message': 'Missing coordinates'}), 400
         
-        url = f'https://router.project-osrm.org/route/v1/driving/{p_lon},{p_lat};{d_lon},{d_lat}?overview=full&geometries=geojson'
-        
-        response = requests.get(url, timeout=10)
-        data = response.json()
-        
-        if data.get('code') == 'Ok' and data.get('routes'):
-            route = data['routes'][0]
-            return jsonify({
-                'status': 'success',
-                'geometry': route['geometry'],
-                'distance': route['distance'],
-                'duration': route['duration']
-            })
+        route = router.route(p_lat, p_lon, d_lat, d_lon)
+        return jsonify({
+            'status': 'success',
+            'geometry': route['geometry'],
+            'distance': route['distance'],
+            'duration': route['duration']
+        })
         
+    except RouteNotFound:
         return jsonify({'status': 'error', 'message': 'No route found'}), 404
-        
+    except RouterBusy as e:
+        response = jsonify({'status': 'error', 'message': str(e)})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    except RoutingError as e:
+        logger.warning("Routing upstream error: %s", e)
+        return jsonify({'status': 'error', 'message': str(e)}), 502
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
@@ -584,8 +1342,19 @@ if __name__ == '__main__':
     print("   /test               - Cluster visualization")
     print("   /api/clusters       - Get clusters data")
     print("   /api/cluster_stats  - Get cluster statistics")
+    print("   /api/trips/completed - Ingest completed trips into the live stats")
+    print("   /api/demand_tiles   - Hour-of-week destination demand tiles")
     print("   /api/predict_duration   - Duration API")
     print("   /api/predict_destination - Destination API")
+    print("   /api/predict_duration/batch    - Batch duration API")
+    print("   /api/predict_destination/batch - Batch destination API")
+    print("   /api/duration_matrix           - Origin x destination durations")
+    print("   /api/departure_sweep           - Best departure time in a window")
+    print("   /api/reverse        - Place name for a map click")
+    print("   /api/model          - Active model version")
+    print("   /metrics            - Prometheus metrics")
+    print("="*50)
+    print("Development server; for production use: gunicorn -c gunicorn.conf.py app:app")
     print("="*50 + "\n")
     
     app.run(debug=True, port=5000)
\ No newline at end of file
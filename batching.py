@@ -0,0 +1,132 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from metrics import Histogram, format_labels, histogram_lines
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+WAIT_MS_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 25)
+
+class MicroBatcher:
+    """Coalesce concurrent single-row predictions into batched booster calls.
+
+    Callers submit one feature row and block until their result is ready.
+    A background thread collects queued rows and flushes them as one block
+    when either `max_batch_size` rows are waiting or the oldest row has
+    waited `max_wait_ms`.
+    """
+
+    def __init__(self, predict_fn, name, max_batch_size=64, max_wait_ms=2.0, timeout=5.0):
+        self.predict_fn = predict_fn
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.wait_ms = Histogram(WAIT_MS_BUCKETS)
+        self.flushes = {'size': 0, 'timeout': 0}
+        self.max_queue_depth = 0
+        self.errors = 0
+        self._start()
+
+    def _start(self):
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f'microbatch-{self.name}', daemon=True)
+        self._thread.start()
+
+    def restart(self):
+        """Start a fresh queue and flush thread in a forked child, where the parent's thread does not exist"""
+        self._lock = threading.Lock()
+        self._start()
+
+    def submit(self, row):
+        """Queue one feature row and wait for its prediction"""
+        future = Future()
+        self._queue.put((np.array(row, dtype=np.float64).ravel(), time.perf_counter(), future))
+        depth = self._queue.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+        return future.result(timeout=self.timeout)
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = item[1] + self.max_wait
+            reason = 'timeout'
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._flush(batch, reason)
+                    return
+                batch.append(item)
+            else:
+                reason = 'size'
+            self._flush(batch, reason)
+
+    def _flush(self, batch, reason):
+        started = time.perf_counter()
+        try:
+            results = self.predict_fn(np.vstack([row for row, _, _ in batch]))
+            for (_, _, future), result in zip(batch, results):
+                future.set_result(result)
+        except Exception as e:
+            self.errors += 1
+            for _, _, future in batch:
+                future.set_exception(e)
+        with self._lock:
+            self.flushes[reason] += 1
+            self.batch_sizes.observe(len(batch))
+            for _, enqueued, _ in batch:
+                self.wait_ms.observe((started - enqueued) * 1000)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000,
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self.max_queue_depth,
+                'flushes': dict(self.flushes),
+                'errors': self.errors,
+                'batch_size': self.batch_sizes.snapshot(),
+                'wait_ms': self.wait_ms.snapshot()
+            }
+
+def render_metrics(batchers):
+    """Prometheus exposition lines for a list of MicroBatchers"""
+    if not batchers:
+        return []
+    stats = [b.stats() for b in batchers]
+    lines = ['# HELP taxi_microbatch_queue_depth Rows waiting to be flushed',
+             '# TYPE taxi_microbatch_queue_depth gauge']
+    lines += [f'taxi_microbatch_queue_depth{format_labels({"model": s["name"]})} {s["queue_depth"]}' for s in stats]
+    lines += ['# HELP taxi_microbatch_flushes_total Batches flushed, by trigger',
+              '# TYPE taxi_microbatch_flushes_total counter']
+    for s in stats:
+        for reason, n in s['flushes'].items():
+            lines.append(f'taxi_microbatch_flushes_total{format_labels({"model": s["name"], "reason": reason})} {n}')
+    lines += ['# HELP taxi_microbatch_batch_size Rows per flushed batch',
+              '# TYPE taxi_microbatch_batch_size histogram']
+    for s in stats:
+        lines += histogram_lines('taxi_microbatch_batch_size', {'model': s['name']}, s['batch_size'])
+    lines += ['# HELP taxi_microbatch_wait_milliseconds Time a row waited in the queue before its flush',
+              '# TYPE taxi_microbatch_wait_milliseconds histogram']
+    for s in stats:
+        lines += histogram_lines('taxi_microbatch_wait_milliseconds', {'model': s['name']}, s['wait_ms'])
+    return lines
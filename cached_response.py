@@ -0,0 +1,95 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+from flask import Response
+
+class CachedJSONResponse:
+    """A JSON response body built once and served from memory.
+
+    The payload is encoded and gzip-compressed up front, with a strong ETag
+    per encoding, so serving it is a dict lookup plus an optional 304. When
+    `watch_path` is given, the file's mtime is checked at most once every
+    `check_interval` seconds and the body is rebuilt only when it changes.
+    A `version` callable is checked the same way, for payloads that change
+    without a file.
+    """
+
+    mimetype = 'application/json'
+
+    def __init__(self, build, watch_path=None, check_interval=1.0, cache_control='no-cache', version=None):
+        self.build = build
+        self.cache_control = cache_control
+        self.watch_path = watch_path
+        self.version = version
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._variants = None
+        self._stamp = None
+        self._checked_at = 0.0
+
+    def _current_mtime(self):
+        path = self.watch_path() if callable(self.watch_path) else self.watch_path
+        try:
+            return os.stat(path).st_mtime_ns if path else None
+        except OSError:
+            return None
+
+    def _current_stamp(self):
+        return self._current_mtime(), self.version() if self.version is not None else None
+
+    def serialize(self, payload):
+        return json.dumps(payload, separators=(',', ':'), sort_keys=True).encode('utf-8')
+
+    def _encode(self):
+        body = self.serialize(self.build())
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        return {
+            'identity': (body, digest),
+            'gzip': (gzip.compress(body, compresslevel=9, mtime=0), f'{digest}-gzip')
+        }
+
+    def invalidate(self):
+        with self._lock:
+            self._variants = None
+
+    def variants(self):
+        now = time.monotonic()
+        watched = self.watch_path is not None or self.version is not None
+        if self._variants is not None and (not watched or now - self._checked_at < self.check_interval):
+            return self._variants
+        with self._lock:
+            stamp = self._current_stamp() if watched else None
+            self._checked_at = now
+            if self._variants is None or stamp != self._stamp:
+                self._variants = self._encode()
+                self._stamp = stamp
+            return self._variants
+
+    def respond(self, request):
+        """Serve the cached body, honouring Accept-Encoding and If-None-Match"""
+        variants = self.variants()
+        encoding = 'gzip' if 'gzip' in request.accept_encodings else 'identity'
+        body, etag = variants[encoding]
+
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype=self.mimetype)
+            if encoding == 'gzip':
+                response.headers['Content-Encoding'] = 'gzip'
+        response.set_etag(etag)
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = self.cache_control
+        return response
+
+class CachedBinaryResponse(CachedJSONResponse):
+    """The same caching for a body that `build` returns as bytes"""
+
+    mimetype = 'application/octet-stream'
+
+    def serialize(self, payload):
+        return bytes(payload)
@@ -0,0 +1,153 @@
+import argparse
+import time
+
+import numpy as np
+
+# NYC bounding box used to filter trips in the training notebook
+NYC_BOUNDS = (40.5, 41.0, -74.5, -73.0)  # lat_min, lat_max, lon_min, lon_max
+CELL_DEG = 0.0005  # ~55 m in latitude
+AMBIGUOUS = -1
+
+class ClusterIndex:
+    """Nearest-centroid lookup backed by a precomputed raster over NYC.
+
+    Each raster cell stores the cluster that owns the whole cell. Voronoi
+    regions are convex, so a cell belongs to one cluster exactly when all
+    four of its corners do. Cells crossed by a boundary, and points outside
+    the box, fall back to an exact nearest-centroid search that mirrors
+    sklearn's KMeans.predict.
+    """
+
+    def __init__(self, centroids, bounds=NYC_BOUNDS, cell_deg=CELL_DEG, raster=None):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float64)
+        self.centroid_sq = (self.centroids ** 2).sum(axis=1)
+        self.lat_min, self.lat_max, self.lon_min, self.lon_max = bounds
+        self.cell_deg = cell_deg
+        self.n_rows = int(np.ceil((self.lat_max - self.lat_min) / cell_deg))
+        self.n_cols = int(np.ceil((self.lon_max - self.lon_min) / cell_deg))
+        # A raster saved by model_store.py export skips the build
+        if raster is not None and raster.shape != (self.n_rows, self.n_cols):
+            raise ValueError(f"Raster shape {raster.shape} does not match a {self.n_rows}x{self.n_cols} grid")
+        self.raster = raster if raster is not None else self._build_raster()
+
+    @classmethod
+    def from_kmeans(cls, kmeans, **kwargs):
+        return cls(kmeans.cluster_centers_, **kwargs)
+
+    def _nearest(self, points, margin=0.0):
+        """Exact nearest centroid; labels within `margin` of a tie are marked ambiguous"""
+        # Same distance form sklearn uses: ||c||^2 - 2 x.c (||x||^2 is constant per row)
+        dist = self.centroid_sq[None, :] - 2 * points @ self.centroids.T
+        labels = np.argmin(dist, axis=1)
+        if margin > 0:
+            best = dist[np.arange(len(points)), labels]
+            dist[np.arange(len(points)), labels] = np.inf
+            labels = np.where(dist.min(axis=1) - best > margin, labels, AMBIGUOUS)
+        return labels
+
+    def _build_raster(self):
+        lat_edges = self.lat_min + np.arange(self.n_rows + 1) * self.cell_deg
+        lon_edges = self.lon_min + np.arange(self.n_cols + 1) * self.cell_deg
+        raster = np.empty((self.n_rows, self.n_cols), dtype=np.int8)
+        corner_prev = None
+        for i, lat in enumerate(lat_edges):
+            corners = self._nearest(np.column_stack([np.full(len(lon_edges), lat), lon_edges]), margin=1e-9)
+            if corner_prev is not None:
+                row = corner_prev[:-1]
+                same = (row == corner_prev[1:]) & (row == corners[:-1]) & (row == corners[1:])
+                raster[i - 1] = np.where(same, row, AMBIGUOUS)
+            corner_prev = corners
+        return raster
+
+    def predict(self, points):
+        """Cluster labels for an (N, 2) array of [lat, lon], same as KMeans.predict"""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        rows = np.floor((points[:, 0] - self.lat_min) / self.cell_deg).astype(np.int64)
+        cols = np.floor((points[:, 1] - self.lon_min) / self.cell_deg).astype(np.int64)
+        inside = (rows >= 0) & (rows < self.n_rows) & (cols >= 0) & (cols < self.n_cols)
+
+        labels = np.full(len(points), AMBIGUOUS, dtype=np.int64)
+        labels[inside] = self.raster.ravel()[rows[inside] * self.n_cols + cols[inside]]
+        fallback = labels == AMBIGUOUS
+        if fallback.any():
+            labels[fallback] = self._nearest(points[fallback])
+        return labels
+
+    def assign(self, lat, lon):
+        """Cluster label for a single point"""
+        row = int((lat - self.lat_min) // self.cell_deg)
+        col = int((lon - self.lon_min) // self.cell_deg)
+        if 0 <= row < self.n_rows and 0 <= col < self.n_cols:
+            label = self.raster[row, col]
+            if label != AMBIGUOUS:
+                return int(label)
+        return int(self._nearest(np.array([[lat, lon]], dtype=np.float64))[0])
+
+# --- VERIFICATION & BENCHMARK ---
+def sample_points(n, pad=0.1, seed=42):
+    """Random points over the raster box, padded by `pad` degrees"""
+    rng = np.random.default_rng(seed)
+    lat_min, lat_max, lon_min, lon_max = NYC_BOUNDS
+    return np.column_stack([rng.uniform(lat_min - pad, lat_max + pad, n),
+                            rng.uniform(lon_min - pad, lon_max + pad, n)])
+
+def verify_index(index, kmeans, n=200000):
+    """Compare index labels with KMeans.predict for random and near-boundary points"""
+    points = sample_points(n)
+    # Midpoints between centroid pairs sit exactly on Voronoi boundaries
+    c = index.centroids
+    mid = ((c[:, None, :] + c[None, :, :]) / 2).reshape(-1, 2)
+    jitter = np.random.default_rng(0).normal(scale=1e-7, size=(20, *mid.shape))
+    points = np.vstack([points, mid, (mid[None] + jitter).reshape(-1, 2)])
+
+    expected = kmeans.predict(points)
+    mismatch = int(np.sum(index.predict(points) != expected))
+    single = sum(index.assign(lat, lon) != label for (lat, lon), label in zip(points[:2000], expected[:2000]))
+    print(f"Checked {len(points)} points: {mismatch} batch mismatches, {single} single-point mismatches")
+    if mismatch or single:
+        raise AssertionError("ClusterIndex labels differ from KMeans.predict")
+
+def bench(index, kmeans, repeat=2000):
+    points = sample_points(10000, pad=0.0)
+    lat, lon = 40.7580, -73.9855
+
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        kmeans.predict([[lat, lon]])
+    sk_single = (time.perf_counter() - t0) / repeat
+
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        index.assign(lat, lon)
+    idx_single = (time.perf_counter() - t0) / repeat
+
+    t0 = time.perf_counter()
+    kmeans.predict(points)
+    sk_batch = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    index.predict(points)
+    idx_batch = time.perf_counter() - t0
+
+    print(f"Single point : sklearn {sk_single * 1e6:8.1f} us | index {idx_single * 1e6:8.1f} us | {sk_single / idx_single:6.1f}x")
+    print(f"10k points   : sklearn {sk_batch * 1e3:8.2f} ms | index {idx_batch * 1e3:8.2f} ms | {sk_batch / idx_batch:6.1f}x")
+    ambiguous = float(np.mean(index.raster == AMBIGUOUS))
+    print(f"Raster {index.raster.shape}, {index.raster.nbytes / 1e6:.1f} MB, {ambiguous:.2%} boundary cells")
+
+if __name__ == '__main__':
+    import joblib
+
+    parser = argparse.ArgumentParser(description="Raster index for pickup/dropoff cluster assignment")
+    parser.add_argument('command', choices=['verify', 'bench'])
+    parser.add_argument('--model-path', default='models/')
+    args = parser.parse_args()
+
+    kmeans = joblib.load(args.model_path + 'kmeans_pickup.pkl')
+    t0 = time.perf_counter()
+    index = ClusterIndex.from_kmeans(kmeans)
+    print(f"Built index in {(time.perf_counter() - t0) * 1e3:.0f} ms")
+
+    if args.command == 'verify':
+        verify_index(index, kmeans)
+    else:
+        bench(index, kmeans)
@@ -0,0 +1,150 @@
+import argparse
+import json
+import os
+import re
+
+import joblib
+import numpy as np
+
+from destination_table import (
+    DestinationTable, MODEL_FILE, FEATURES_FILE, N_HOURS, N_WEEKDAYS, N_MONTHS, file_digest, score_grid
+)
+
+TILES_FILE = 'demand_tiles.npz'
+# Share of trips by passenger count (1-6) in the Kaggle train set
+PASSENGER_SHARES = np.array([0.709, 0.144, 0.041, 0.019, 0.054, 0.033])
+N_FRAMES = N_WEEKDAYS * N_HOURS
+# Probabilities are stored as uint8 (p * 255), ~0.002 resolution, enough for a heatmap
+SCALE = 255
+
+def passenger_shares(n_passengers):
+    shares = PASSENGER_SHARES[:n_passengers]
+    return shares / shares.sum()
+
+def pickup_weights(model_path, n_clusters):
+    """Each zone's share of pickups from cluster_stats.json ('avg_trips'), uniform if unavailable"""
+    weights = np.ones(n_clusters)
+    try:
+        with open(model_path + 'cluster_stats.json') as f:
+            stats = json.load(f)
+        for cluster, entry in stats.items():
+            if int(cluster) < n_clusters:
+                weights[int(cluster)] = float(re.sub(r'[^0-9.]', '', entry['avg_trips']))
+    except (OSError, ValueError, KeyError):
+        pass
+    return weights / weights.sum()
+
+def destination_probabilities(model_path):
+    """(cluster, passengers, hour, weekday, month, destination) probabilities, from the table when present"""
+    table = DestinationTable.load(model_path)
+    if table is not None:
+        print("Using the precomputed destination table (no model calls)")
+        return table.probabilities
+    booster = joblib.load(model_path + MODEL_FILE)
+    feature_names = list(joblib.load(model_path + FEATURES_FILE))
+    n_clusters = joblib.load(model_path + 'kmeans_pickup.pkl').n_clusters
+    print(f"Scoring destination model over {n_clusters} clusters...")
+    return score_grid(booster, feature_names, n_clusters)
+
+def build_tiles(model_path='models/'):
+    """Pack hour-of-week destination demand frames for every month into models/demand_tiles.npz.
+
+    transitions[month, frame, pickup, destination] is P(destination | pickup),
+    averaged over passenger counts; demand[month, frame, destination] weights
+    those rows by each zone's share of pickups. frame = weekday * 24 + hour.
+    """
+    probabilities = destination_probabilities(model_path)
+    n_clusters = probabilities.shape[0]
+    shares = passenger_shares(probabilities.shape[1])
+    # (cluster, pax, hour, weekday, month, dest) -> (month, weekday, hour, cluster, dest)
+    transitions = np.einsum('p,cphwmd->mwhcd', shares, probabilities)
+    transitions = transitions.reshape(N_MONTHS, N_FRAMES, n_clusters, n_clusters)
+    weights = pickup_weights(model_path, n_clusters)
+    demand = np.einsum('c,mfcd->mfd', weights, transitions)
+
+    out = model_path + TILES_FILE
+    np.savez_compressed(
+        out,
+        transitions=np.round(transitions * SCALE).astype(np.uint8),
+        demand=np.round(demand * SCALE).astype(np.uint8),
+        pickup_weights=weights.astype(np.float32),
+        model_digest=file_digest(model_path + MODEL_FILE) if os.path.exists(model_path + MODEL_FILE) else ''
+    )
+    print(f"Saved {out}: {N_MONTHS} months x {N_FRAMES} frames x {n_clusters} zones, "
+          f"{os.path.getsize(out) / 1e3:.1f} kB")
+    return out
+
+class DemandTiles:
+    """Quantized demand frames loaded from demand_tiles.npz"""
+
+    def __init__(self, transitions, demand, pickup_weights):
+        self.transitions = transitions
+        self.demand = demand
+        self.pickup_weights = pickup_weights
+        self.n_clusters = transitions.shape[-1]
+
+    @classmethod
+    def load(cls, model_path='models/'):
+        """Load the tiles, or return None if missing or built from a different model"""
+        path = model_path + TILES_FILE
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            source = model_path + MODEL_FILE
+            digest = str(data['model_digest'])
+            if digest and os.path.exists(source) and digest != file_digest(source):
+                print(f"WARNING: {path} was built from a different model, ignoring it")
+                return None
+            return cls(data['transitions'], data['demand'], data['pickup_weights'])
+
+    def month_bytes(self, month):
+        """One month as a flat uint8 body: every transitions frame, then every demand frame"""
+        return self.transitions[month - 1].tobytes() + self.demand[month - 1].tobytes()
+
+    def index(self):
+        """Layout of the per-month binary tiles, for clients"""
+        c = self.n_clusters
+        return {
+            'status': 'success',
+            'months': list(range(1, N_MONTHS + 1)),
+            'frames': N_FRAMES,
+            'frame': 'weekday * 24 + hour (weekday 0 = Monday)',
+            'clusters': c,
+            'dtype': 'uint8',
+            'scale': 1 / SCALE,
+            'layout': [
+                {'name': 'transitions', 'shape': [N_FRAMES, c, c], 'offset': 0},
+                {'name': 'demand', 'shape': [N_FRAMES, c], 'offset': N_FRAMES * c * c}
+            ],
+            'pickup_weights': [round(float(w), 4) for w in self.pickup_weights],
+            'url': '/api/demand_tiles/{month}'
+        }
+
+def verify_tiles(model_path='models/', samples=2000, seed=0):
+    """Check random frames against the destination table (or live model) they were built from"""
+    tiles = DemandTiles.load(model_path)
+    if tiles is None:
+        raise RuntimeError(f"No valid {TILES_FILE} in {model_path}")
+    probabilities = destination_probabilities(model_path)
+    shares = passenger_shares(probabilities.shape[1])
+    rng = np.random.default_rng(seed)
+    month = rng.integers(1, N_MONTHS + 1, samples)
+    weekday = rng.integers(0, N_WEEKDAYS, samples)
+    hour = rng.integers(0, N_HOURS, samples)
+    cluster = rng.integers(0, tiles.n_clusters, samples)
+    expected = np.einsum('p,npd->nd', shares, probabilities[cluster, :, hour, weekday, month - 1])
+    stored = tiles.transitions[month - 1, weekday * N_HOURS + hour, cluster] / SCALE
+    max_err = float(np.abs(stored - expected).max())
+    print(f"Checked {samples} frames: max |tile - model| = {max_err:.4f} (quantization step {1 / SCALE:.4f})")
+    if max_err > 0.5 / SCALE + 1e-6:
+        raise AssertionError("Tiles differ from the destination model")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Hour-of-week destination demand tiles for the cluster map")
+    parser.add_argument('command', choices=['build', 'verify'])
+    parser.add_argument('--model-path', default='models/')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_tiles(args.model_path)
+    verify_tiles(args.model_path)
@@ -0,0 +1,159 @@
+import argparse
+import hashlib
+import os
+
+import joblib
+import numpy as np
+
+from features import destination_features, destination_default, to_model_frame, apply_categories
+
+# --- GRID DEFINITION ---
+# Every destination feature is derived from these discrete inputs
+PASSENGER_RANGE = (1, 6)
+N_HOURS = 24
+N_WEEKDAYS = 7
+N_MONTHS = 12
+TABLE_FILE = 'destination_table.npz'
+MODEL_FILE = 'lgbm_destination_prediction.pkl'
+FEATURES_FILE = 'features_problem2_final.pkl'
+
+def file_digest(path):
+    """SHA-256 of a model file, used to detect a stale table"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def grid_axes(n_clusters):
+    """Index arrays for the full (cluster, passengers, hour, weekday, month) grid"""
+    p_min, p_max = PASSENGER_RANGE
+    shape = (n_clusters, p_max - p_min + 1, N_HOURS, N_WEEKDAYS, N_MONTHS)
+    cluster, pax, hour, weekday, month = np.indices(shape).reshape(len(shape), -1)
+    return shape, cluster, pax + p_min, hour, weekday, month + 1
+
+def score_grid(booster, feature_names, n_clusters, chunk_size=200000):
+    """Score the destination model over the whole input grid"""
+    shape, cluster, pax, hour, weekday, month = grid_axes(n_clusters)
+    chunks = []
+    for start in range(0, len(cluster), chunk_size):
+        sl = slice(start, start + chunk_size)
+        features = destination_features(cluster[sl], pax[sl], hour[sl], month[sl], weekday[sl])
+        df_in = apply_categories(to_model_frame(features, feature_names, default=destination_default), booster)
+        probs = np.asarray(booster.predict(df_in))
+        chunks.append(probs.reshape(len(df_in), -1))
+    probabilities = np.concatenate(chunks).reshape(shape + (-1,))
+    return probabilities
+
+def build_table(model_path='models/'):
+    """Build and save the destination probability table next to the model"""
+    booster = joblib.load(model_path + MODEL_FILE)
+    feature_names = list(joblib.load(model_path + FEATURES_FILE))
+    kmeans = joblib.load(model_path + 'kmeans_pickup.pkl')
+
+    print(f"Scoring destination model over {kmeans.n_clusters} clusters...")
+    probabilities = score_grid(booster, feature_names, kmeans.n_clusters)
+    top3 = np.argsort(probabilities, axis=-1)[..., -3:][..., ::-1]
+
+    out = model_path + TABLE_FILE
+    np.savez_compressed(
+        out,
+        probabilities=probabilities.astype(np.float32),
+        top3=top3.astype(np.uint8),
+        passenger_min=PASSENGER_RANGE[0],
+        feature_names=np.array(feature_names),
+        model_digest=file_digest(model_path + MODEL_FILE)
+    )
+    print(f"Saved {out}: {probabilities.shape}, {os.path.getsize(out) / 1e6:.1f} MB")
+    return out
+
+class DestinationTable:
+    """Precomputed destination probabilities indexed by discrete inputs"""
+
+    def __init__(self, probabilities, top3, passenger_min):
+        self.probabilities = probabilities
+        self.top3 = top3
+        self.passenger_min = passenger_min
+        self.n_passengers = probabilities.shape[1]
+
+    @classmethod
+    def load(cls, model_path='models/'):
+        """Load the table, or return None if it is missing or stale"""
+        path = model_path + TABLE_FILE
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            digest = str(data['model_digest'])
+            # Native-only deployments (see model_store.py) ship without the pickle
+            source = model_path + MODEL_FILE
+            if os.path.exists(source) and digest != file_digest(source):
+                print(f"WARNING: {path} was built from a different model, ignoring it")
+                return None
+            return cls(data['probabilities'], data['top3'], int(data['passenger_min']))
+
+    def covers(self, passengers):
+        """Whether the passenger counts fall inside the precomputed grid"""
+        offset = np.asarray(passengers) - self.passenger_min
+        return bool(np.all((offset >= 0) & (offset < self.n_passengers)))
+
+    def lookup(self, p_cluster, passengers, hour, weekday, month):
+        """Probabilities and top-3 clusters for one query, or None if outside the grid"""
+        if not self.covers(passengers) or not 0 <= p_cluster < len(self.probabilities):
+            return None
+        key = (p_cluster, passengers - self.passenger_min, hour, weekday, month - 1)
+        return self.probabilities[key], self.top3[key]
+
+    def lookup_batch(self, p_cluster, passengers, hour, weekday, month):
+        """Vectorized lookup for arrays of queries, or None if any is outside the grid"""
+        if not self.covers(passengers):
+            return None
+        key = (np.asarray(p_cluster), np.asarray(passengers) - self.passenger_min,
+               np.asarray(hour), np.asarray(weekday), np.asarray(month) - 1)
+        return self.probabilities[key], self.top3[key]
+
+def verify_table(model_path='models/', samples=5000, seed=42, atol=1e-6):
+    """Check random table entries against the live LightGBM model"""
+    booster = joblib.load(model_path + MODEL_FILE)
+    feature_names = list(joblib.load(model_path + FEATURES_FILE))
+    table = DestinationTable.load(model_path)
+    if table is None:
+        raise RuntimeError(f"No valid {TABLE_FILE} in {model_path}")
+
+    rng = np.random.default_rng(seed)
+    cluster = rng.integers(0, len(table.probabilities), samples)
+    pax = rng.integers(table.passenger_min, table.passenger_min + table.n_passengers, samples)
+    hour = rng.integers(0, N_HOURS, samples)
+    weekday = rng.integers(0, N_WEEKDAYS, samples)
+    month = rng.integers(1, N_MONTHS + 1, samples)
+
+    features = destination_features(cluster, pax, hour, month, weekday)
+    df_in = apply_categories(to_model_frame(features, feature_names, default=destination_default), booster)
+    live = np.asarray(booster.predict(df_in)).reshape(samples, -1)
+    live_top3 = np.argsort(live, axis=1)[:, -3:][:, ::-1]
+
+    probs, top3 = table.lookup_batch(cluster, pax, hour, weekday, month)
+    max_err = float(np.max(np.abs(probs - live)))
+    top3_mismatch = int(np.sum(np.any(top3 != live_top3, axis=1)))
+    print(f"Checked {samples} rows: max |p_table - p_live| = {max_err:.2e}, top-3 mismatches = {top3_mismatch}")
+
+    if max_err > atol:
+        raise AssertionError(f"Probability mismatch {max_err:.2e} exceeds tolerance {atol:.0e}")
+    # Near-ties can swap order once probabilities are stored as float32
+    sorted_live = np.sort(live, axis=1)[:, ::-1]
+    ties = np.any(np.abs(np.diff(sorted_live[:, :4], axis=1)) <= atol, axis=1)
+    if np.any(np.any(top3 != live_top3, axis=1) & ~ties):
+        raise AssertionError("Top-3 ranking differs from the live model")
+    return max_err
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Precomputed destination probability table")
+    parser.add_argument('command', choices=['build', 'verify'])
+    parser.add_argument('--model-path', default='models/')
+    parser.add_argument('--samples', type=int, default=5000)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_table(args.model_path)
+        verify_table(args.model_path, samples=args.samples)
+    else:
+        verify_table(args.model_path, samples=args.samples)
@@ -0,0 +1,239 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+# --- CONSTANTS ---
+EARTH_RADIUS_KM = 6371
+# Metres per degree of latitude, and the latitude used to size longitude cells in NYC
+METERS_PER_DEGREE = 111320.0
+REFERENCE_LAT = 40.75
+RUSH_HOURS = [7, 8, 9, 16, 17, 18, 19]
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M'
+
+# --- VECTORIZED MATH ---
+def haversine_np(lat1, lon1, lat2, lon2):
+    """Vectorized haversine distance in kilometers"""
+    lat1, lon1, lat2, lon2 = (np.asarray(v, dtype=np.float64) for v in (lat1, lon1, lat2, lon2))
+    dlat = np.radians(lat2 - lat1)
+    dlon = np.radians(lon2 - lon1)
+    a = np.sin(dlat / 2) ** 2 + np.cos(np.radians(lat1)) * np.cos(np.radians(lat2)) * np.sin(dlon / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return EARTH_RADIUS_KM * c
+
+def bearing_np(lat1, lon1, lat2, lon2):
+    """Vectorized bearing in degrees (0-360)"""
+    lat1, lon1, lat2, lon2 = (np.asarray(v, dtype=np.float64) for v in (lat1, lon1, lat2, lon2))
+    d_lon = np.radians(lon2 - lon1)
+    lat1 = np.radians(lat1)
+    lat2 = np.radians(lat2)
+    y = np.sin(d_lon) * np.cos(lat2)
+    x = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(d_lon)
+    return (np.degrees(np.arctan2(y, x)) + 360) % 360
+
+def manhattan_np(lat1, lon1, lat2, lon2):
+    """Vectorized manhattan distance in kilometers (1 degree ~ 111 km)"""
+    lat1, lon1, lat2, lon2 = (np.asarray(v, dtype=np.float64) for v in (lat1, lon1, lat2, lon2))
+    return (np.abs(lat2 - lat1) + np.abs(lon2 - lon1)) * 111
+
+# --- TIME FEATURES ---
+def parse_datetimes(values, format=DATETIME_FORMAT):
+    """Parse 'YYYY-MM-DDTHH:MM' strings (or `format`; None infers it) into hour, month and weekday arrays"""
+    dt = pd.to_datetime(pd.Series(values, dtype=object), format=format)
+    return (dt.dt.hour.to_numpy(dtype=np.int64),
+            dt.dt.month.to_numpy(dtype=np.int64),
+            dt.dt.weekday.to_numpy(dtype=np.int64))
+
+def time_features(hour, month, weekday):
+    """Calendar, rush hour and cyclical features (weekday: 0=Monday)"""
+    hour = np.asarray(hour, dtype=np.int64)
+    month = np.asarray(month, dtype=np.int64)
+    weekday = np.asarray(weekday, dtype=np.int64)
+    return {
+        'hour': hour,
+        'month': month,
+        'day_of_week_idx': weekday + 1,
+        'is_weekend': (weekday >= 5).astype(np.int64),
+        'is_rush_hour': np.isin(hour, RUSH_HOURS).astype(np.int64),
+        'hour_sin': np.sin(2 * np.pi * hour / 24),
+        'hour_cos': np.cos(2 * np.pi * hour / 24),
+        'month_sin': np.sin(2 * np.pi * month / 12),
+        'month_cos': np.cos(2 * np.pi * month / 12)
+    }
+
+# --- MODEL INPUTS ---
+def duration_features(p_lat, p_lon, d_lat, d_lon, hour, month, weekday, passengers, p_cluster, d_cluster):
+    """Feature columns for the duration model, one row per trip"""
+    dist_km = haversine_np(p_lat, p_lon, d_lat, d_lon)
+    features = {
+        'distance_km': dist_km,
+        'pickup_longitude': np.asarray(p_lon, dtype=np.float64),
+        'pickup_latitude': np.asarray(p_lat, dtype=np.float64),
+        'dropoff_longitude': np.asarray(d_lon, dtype=np.float64),
+        'dropoff_latitude': np.asarray(d_lat, dtype=np.float64),
+        'bearing': bearing_np(p_lat, p_lon, d_lat, d_lon),
+        'manhattan_distance': manhattan_np(p_lat, p_lon, d_lat, d_lon),
+        'log_distance': np.log1p(dist_km),
+        'passenger_count': np.asarray(passengers, dtype=np.int64),
+        'pickup_cluster': np.asarray(p_cluster, dtype=np.int64),
+        'dropoff_cluster': np.asarray(d_cluster, dtype=np.int64)
+    }
+    features.update(time_features(hour, month, weekday))
+    return features
+
+def pairwise_duration_features(o_lat, o_lon, o_cluster, d_lat, d_lon, d_cluster, hour, month, weekday, passengers):
+    """Duration features for every origin x destination pair, row-major (origin i, destination j -> i * m + j)"""
+    n, m = len(o_lat), len(d_lat)
+    rows = lambda a: np.repeat(np.asarray(a), m)
+    cols = lambda a: np.tile(np.asarray(a), n)
+    return duration_features(rows(o_lat), rows(o_lon), cols(d_lat), cols(d_lon), hour, month, weekday, passengers,
+                             rows(o_cluster), cols(d_cluster))
+
+def destination_features(p_cluster, passengers, hour, month, weekday):
+    """Feature columns for the destination model, one row per trip"""
+    features = {
+        'pickup_cluster': np.asarray(p_cluster, dtype=np.int64),
+        'passenger_count': np.asarray(passengers, dtype=np.int64)
+    }
+    features.update(time_features(hour, month, weekday))
+    features['day_of_week'] = features['day_of_week_idx']
+    return features
+
+def destination_default(feature):
+    """Fallback for a destination feature the request does not provide.
+
+    Returns either the name of a computed feature to copy or a constant.
+    """
+    if 'day' in feature:
+        return 'day_of_week'
+    if 'sin' in feature or 'cos' in feature:
+        return 0.0
+    return 0
+
+def to_model_frame(features, feature_names, default=None):
+    """Arrange feature columns in model order, filling missing ones"""
+    n_rows = len(next(iter(features.values())))
+    columns = {}
+    for feat in feature_names:
+        if feat in features:
+            columns[feat] = features[feat]
+        else:
+            value = default(feat) if default else 0
+            if isinstance(value, str):
+                value = features[value]
+            columns[feat] = np.broadcast_to(value, (n_rows,))
+    return pd.DataFrame(columns, columns=list(feature_names))
+
+def apply_categories(df, booster):
+    """Restore the pandas categories a LightGBM booster was trained with"""
+    pandas_categorical = getattr(booster, 'pandas_categorical', None)
+    if not pandas_categorical:
+        return df
+    cat_columns = [c for c in ['pickup_cluster'] if c in df.columns]
+    return df.assign(**{
+        col: pd.Categorical(df[col], categories=categories)
+        for col, categories in zip(cat_columns, pandas_categorical)
+    })
+
+# --- COMPILED FEATURE LAYOUT ---
+class FeatureLayout:
+    """Fixed column layout for a model's feature list, compiled once at load time.
+
+    Missing-feature defaults are resolved up front: each model column either
+    copies a computed feature or holds a constant stored in a template row.
+    Rows are written into a per-thread buffer that is reused across requests,
+    so the fast path does not build a DataFrame or allocate per call.
+    """
+
+    def __init__(self, feature_names, available, default=None, categories=None):
+        self.feature_names = list(feature_names)
+        self.index = {name: i for i, name in enumerate(self.feature_names)}
+        self.template = np.zeros(len(self.feature_names), dtype=np.float64)
+        self.sources = []
+        self.missing = []
+        for i, feat in enumerate(self.feature_names):
+            if feat in available:
+                self.sources.append((i, feat))
+                continue
+            self.missing.append(feat)
+            value = default(feat) if default else 0
+            if isinstance(value, str):
+                self.sources.append((i, value))
+            else:
+                self.template[i] = value
+        # Category value -> code lookup tables for LightGBM pandas categoricals;
+        # identity mappings (categories 0..n-1) need no encoding at all
+        self.codes = {}
+        for feat, cats in (categories or {}).items():
+            if feat not in self.index or list(cats) == list(range(len(cats))):
+                continue
+            lut = np.full(int(max(cats)) + 1, np.nan)
+            lut[np.asarray(cats, dtype=np.int64)] = np.arange(len(cats))
+            self.codes[self.index[feat]] = lut
+        self._local = threading.local()
+
+    def _buffer(self, n_rows):
+        buf = getattr(self._local, 'buf', None)
+        if buf is None or len(buf) < n_rows:
+            buf = np.empty((max(n_rows, 1), len(self.feature_names)), dtype=np.float64)
+            self._local.buf = buf
+        return buf[:n_rows]
+
+    def _encode(self, block):
+        for col, lut in self.codes.items():
+            values = block[:, col]
+            idx = np.clip(np.nan_to_num(values, nan=-1), -1, len(lut)).astype(np.int64)
+            valid = (idx >= 0) & (idx < len(lut)) & (idx == values)
+            block[:, col] = np.where(valid, lut[np.clip(idx, 0, len(lut) - 1)], np.nan)
+        return block
+
+    def fill_row(self, features):
+        """Write one row of scalar features into the reusable buffer, shape (1, k)"""
+        block = self._buffer(1)
+        block[0] = self.template
+        row = block[0]
+        for col, src in self.sources:
+            row[col] = features[src]
+        return self._encode(block) if self.codes else block
+
+    def fill(self, features, n_rows=None):
+        """Write column arrays of features into the reusable buffer, shape (n, k); scalars broadcast when n_rows is given"""
+        if n_rows is None:
+            n_rows = len(next(iter(features.values())))
+        block = self._buffer(n_rows)
+        block[:] = self.template
+        for col, src in self.sources:
+            block[:, col] = features[src]
+        return self._encode(block) if self.codes else block
+
+def booster_categories(booster, feature_names):
+    """Categories of the pandas categorical columns a LightGBM booster was trained with"""
+    pandas_categorical = getattr(booster, 'pandas_categorical', None)
+    if not pandas_categorical:
+        return {}
+    cat_columns = [c for c in ['pickup_cluster'] if c in feature_names]
+    return dict(zip(cat_columns, pandas_categorical))
+
+def xgb_fast_predict(model, missing=None):
+    """Predict function using XGBoost's inplace_predict on NumPy blocks"""
+    booster = model.get_booster() if hasattr(model, 'get_booster') else model
+    best = getattr(booster, 'best_iteration', None)
+    iteration_range = (0, best + 1) if best is not None else (0, 0)
+    if missing is None:
+        missing = getattr(model, 'missing', np.nan)
+
+    def predict(block):
+        return booster.inplace_predict(block, iteration_range=iteration_range,
+                                       missing=missing, validate_features=False)
+    return predict
+
+def lgb_fast_predict(booster):
+    """Predict function passing NumPy blocks straight to a LightGBM booster"""
+    def predict(block):
+        return booster.predict(block)
+    return predict
+
+# Names of every feature the builders above produce
+DURATION_FEATURE_NAMES = tuple(duration_features(0, 0, 0, 0, 0, 1, 0, 1, 0, 0))
+DESTINATION_FEATURE_NAMES = tuple(destination_features(0, 1, 0, 1, 0))
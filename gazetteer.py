@@ -0,0 +1,585 @@
+import argparse
+import csv
+import json
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import OrderedDict
+
+import numpy as np
+import requests
+
+from features import METERS_PER_DEGREE, REFERENCE_LAT
+
+# Same bounding box the Nominatim search was restricted to (lon_min, lat_min, lon_max, lat_max)
+NYC_VIEWBOX = (-74.25, 40.49, -73.70, 40.91)
+NYC_BOROUGHS = {'Manhattan', 'Brooklyn', 'Queens', 'Bronx', 'Staten Island'}
+GAZETTEER_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'nyc_gazetteer.csv')
+NOMINATIM_URL = 'https://nominatim.openstreetmap.org/search'
+NOMINATIM_REVERSE_URL = 'https://nominatim.openstreetmap.org/reverse'
+USER_AGENT = 'NYC-Taxi-App/1.0'
+
+# Fuzzy matches below this trigram similarity are dropped
+MIN_SIMILARITY = 0.3
+# Reverse geocoding: a click within NEAR_M of a place takes its name as is, one within
+# max_distance_m becomes "Near <place>", anything farther goes to the upstream
+NEAR_M = 150
+
+def normalize(text):
+    """Lowercase, strip accents and punctuation, collapse whitespace"""
+    text = unicodedata.normalize('NFKD', str(text))
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"['’.]", '', text.lower())
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', text).split())
+
+def trigrams(text):
+    """Character trigrams of a normalized string, padded per word"""
+    grams = set()
+    for word in text.split():
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+def display_name(name, area):
+    region = 'New York City' if area in NYC_BOROUGHS else 'New Jersey'
+    return f'{name}, {area}, {region}'
+
+class Gazetteer:
+    """In-memory place index answering typeahead queries without the network.
+
+    Every word of a place name (and its borough) goes into a sorted token list,
+    so each query word is resolved with a binary search over token prefixes
+    and the candidate places are the intersection across words. Queries that
+    match nothing by prefix fall back to trigram similarity, which absorbs
+    typos such as "tims sqare".
+    """
+
+    def __init__(self, places):
+        self.places = places
+        self.names = [normalize(p['name']) for p in places]
+        postings = {}
+        for i, place in enumerate(places):
+            for token in set(self.names[i].split()) | set(normalize(place['area']).split()):
+                postings.setdefault(token, []).append(i)
+        self.tokens = sorted(postings)
+        self.postings = [np.array(postings[t], dtype=np.int32) for t in self.tokens]
+        self.name_grams = [trigrams(n) for n in self.names]
+        gram_postings = {}
+        for i, grams in enumerate(self.name_grams):
+            for gram in grams:
+                gram_postings.setdefault(gram, []).append(i)
+        self.gram_postings = gram_postings
+        self.rank = np.array([p['rank'] for p in places], dtype=np.float64)
+
+    @classmethod
+    def from_csv(cls, path=GAZETTEER_FILE):
+        with open(path, newline='', encoding='utf-8') as f:
+            places = [{
+                'name': row['name'],
+                'kind': row['kind'],
+                'area': row['borough'],
+                'lat': float(row['lat']),
+                'lon': float(row['lon']),
+                'rank': float(row['rank'])
+            } for row in csv.DictReader(f)]
+        return cls(places)
+
+    def _prefix_matches(self, prefix):
+        lo = bisect_left(self.tokens, prefix)
+        hi = lo
+        while hi < len(self.tokens) and self.tokens[hi].startswith(prefix):
+            hi += 1
+        if hi == lo:
+            return np.empty(0, dtype=np.int32)
+        return np.unique(np.concatenate(self.postings[lo:hi]))
+
+    def _prefix_search(self, query):
+        words = query.split()
+        candidates = None
+        for word in words:
+            matches = self._prefix_matches(word)
+            candidates = matches if candidates is None else np.intersect1d(candidates, matches, assume_unique=True)
+            if len(candidates) == 0:
+                return []
+        scored = []
+        for i in candidates:
+            name = self.names[i]
+            name_words = set(name.split())
+            score = self.rank[i]
+            if name.startswith(query):
+                score += 50
+            score += 10 * sum(word in name_words for word in words)
+            score -= len(name_words)
+            scored.append((score, int(i)))
+        return scored
+
+    def _fuzzy_search(self, query):
+        grams = trigrams(query)
+        shared = {}
+        for gram in grams:
+            for i in self.gram_postings.get(gram, ()):
+                shared[i] = shared.get(i, 0) + 1
+        scored = []
+        for i, n in shared.items():
+            similarity = n / len(grams | self.name_grams[i])
+            if similarity >= MIN_SIMILARITY:
+                scored.append((similarity * 100 + self.rank[i] * 0.2, i))
+        return scored
+
+    def search(self, query, limit=10):
+        """Ranked places matching a free-text query, best first"""
+        query = normalize(query)
+        if not query:
+            return []
+        scored = self._prefix_search(query) or self._fuzzy_search(query)
+        scored.sort(key=lambda s: (-s[0], self.names[s[1]]))
+        return [self.result(i) for _, i in scored[:limit]]
+
+    def result(self, i):
+        place = self.places[i]
+        return {
+            'display_name': display_name(place['name'], place['area']),
+            'lat': place['lat'],
+            'lon': place['lon']
+        }
+
+class PlaceGrid:
+    """Uniform grid over the gazetteer's places for nearest-place lookups.
+
+    Coordinates are projected to metres around REFERENCE_LAT and bucketed into
+    square cells of `cell_m`. A query scans rings of cells outward from its
+    own and stops as soon as no unscanned cell can hold anything closer than
+    the best match, so a click costs a handful of dict lookups however many
+    places there are.
+    """
+
+    def __init__(self, places, cell_m=500.0):
+        self.cell_m = cell_m
+        self.lon_scale = METERS_PER_DEGREE * math.cos(math.radians(REFERENCE_LAT))
+        self.x = np.array([p['lon'] for p in places], dtype=np.float64) * self.lon_scale
+        self.y = np.array([p['lat'] for p in places], dtype=np.float64) * METERS_PER_DEGREE
+        cells = {}
+        for i, key in enumerate(zip(np.floor(self.x / cell_m).astype(int).tolist(),
+                                    np.floor(self.y / cell_m).astype(int).tolist())):
+            cells.setdefault(key, []).append(i)
+        self.cells = {key: np.array(ids, dtype=np.int32) for key, ids in cells.items()}
+
+    def _ring(self, cx, cy, r):
+        if r == 0:
+            yield cx, cy
+            return
+        for dx in range(-r, r + 1):
+            yield cx + dx, cy - r
+            yield cx + dx, cy + r
+        for dy in range(-r + 1, r):
+            yield cx - r, cy + dy
+            yield cx + r, cy + dy
+
+    def nearest(self, lat, lon, max_distance_m):
+        """(place index, distance in metres) of the closest place within max_distance_m, or None"""
+        x, y = lon * self.lon_scale, lat * METERS_PER_DEGREE
+        cx, cy = int(x // self.cell_m), int(y // self.cell_m)
+        best, best_d = None, max_distance_m
+        r = 0
+        while True:
+            for key in self._ring(cx, cy, r):
+                ids = self.cells.get(key)
+                if ids is None:
+                    continue
+                d = np.hypot(self.x[ids] - x, self.y[ids] - y)
+                k = int(np.argmin(d))
+                if d[k] <= best_d:
+                    best, best_d = int(ids[k]), float(d[k])
+            # Everything outside ring r is at least r * cell_m away
+            if r * self.cell_m >= best_d:
+                break
+            r += 1
+        return None if best is None else (best, best_d)
+
+class PlaceSearch:
+    """Gazetteer search with an LRU cache and an optional upstream geocoder.
+
+    The upstream (a Nominatim-compatible /search URL) is only asked when the
+    local index has no match, e.g. for street addresses. Results are cached by
+    normalized query; after an upstream failure it is skipped for
+    `retry_after` seconds so an offline server answers from the gazetteer
+    without waiting on a timeout for every keystroke.
+    """
+
+    def __init__(self, gazetteer, upstream_url=None, cache_size=4096, timeout=2.0, retry_after=30.0):
+        self.gazetteer = gazetteer
+        self.upstream_url = upstream_url
+        self.cache_size = cache_size
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._upstream_down_until = 0.0
+        self.counts = {'hit': 0, 'local': 0, 'upstream': 0, 'upstream_error': 0}
+
+    def _count(self, key):
+        with self._lock:
+            self.counts[key] += 1
+
+    def search(self, query, limit=10):
+        key = (normalize(query), limit)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.counts['hit'] += 1
+                return cached
+
+        results = self.gazetteer.search(query, limit)
+        cacheable = True
+        if results:
+            self._count('local')
+        elif self.upstream_url and time.monotonic() >= self._upstream_down_until:
+            try:
+                results = self._upstream(query, limit)
+                self._count('upstream')
+            except (requests.RequestException, ValueError, KeyError) as e:
+                self._upstream_down_until = time.monotonic() + self.retry_after
+                self._count('upstream_error')
+                cacheable = False
+                raise UpstreamError(str(e)) from e
+        else:
+            # Don't cache a miss while the upstream is backing off
+            cacheable = not self.upstream_url
+            self._count('local')
+
+        if cacheable:
+            with self._lock:
+                self._cache[key] = results
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return results
+
+    def _upstream(self, query, limit):
+        params = {
+            'format': 'json',
+            'q': query,
+            'viewbox': ','.join(str(v) for v in NYC_VIEWBOX),
+            'bounded': 1,
+            'limit': limit
+        }
+        response = self.session.get(self.upstream_url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return [{
+            'display_name': item['display_name'],
+            'lat': float(item['lat']),
+            'lon': float(item['lon'])
+        } for item in response.json()[:limit]]
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'cache_size': len(self._cache), 'cache_capacity': self.cache_size, **self.counts}
+
+class ReverseGeocoder:
+    """Names for map clicks from the gazetteer, with an LRU cache and an optional upstream.
+
+    Clicks are snapped to a `grid_m` grid and the cell centre is what gets
+    looked up, so every click in a cell shares one cache entry and one
+    answer. The nearest place within `max_distance_m` (found with a PlaceGrid)
+    names the click; farther clicks go to the upstream (a Nominatim-compatible
+    /reverse URL) when there is one, with the same back-off as PlaceSearch.
+    """
+
+    def __init__(self, gazetteer, upstream_url=None, grid_m=25.0, cache_size=16384, max_distance_m=2000.0,
+                 timeout=2.0, retry_after=30.0):
+        self.gazetteer = gazetteer
+        self.grid = PlaceGrid(gazetteer.places)
+        self.upstream_url = upstream_url
+        self.lat_step = grid_m / METERS_PER_DEGREE
+        self.lon_step = grid_m / (METERS_PER_DEGREE * math.cos(math.radians(REFERENCE_LAT)))
+        self.cache_size = cache_size
+        self.max_distance_m = max_distance_m
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._upstream_down_until = 0.0
+        self.counts = {'hit': 0, 'local': 0, 'upstream': 0, 'upstream_error': 0, 'miss': 0}
+
+    def _count(self, key):
+        with self._lock:
+            self.counts[key] += 1
+
+    def reverse(self, lat, lon):
+        """A Nominatim-like {'display_name', 'lat', 'lon', ...} for a point, or None if nothing is near"""
+        key = (round(lat / self.lat_step), round(lon / self.lon_step))
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.counts['hit'] += 1
+                return self._cache[key]
+
+        lat, lon = key[0] * self.lat_step, key[1] * self.lon_step
+        found = self.grid.nearest(lat, lon, self.max_distance_m)
+        cacheable = True
+        if found is not None:
+            result = self.local_result(*found)
+            self._count('local')
+        elif self.upstream_url and time.monotonic() >= self._upstream_down_until:
+            try:
+                result = self._upstream(lat, lon)
+                self._count('upstream')
+            except (requests.RequestException, ValueError, KeyError) as e:
+                self._upstream_down_until = time.monotonic() + self.retry_after
+                self._count('upstream_error')
+                raise UpstreamError(str(e)) from e
+        else:
+            result = None
+            cacheable = not self.upstream_url
+            self._count('miss')
+
+        if cacheable:
+            with self._lock:
+                self._cache[key] = result
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return result
+
+    def local_result(self, i, distance_m):
+        place = self.gazetteer.places[i]
+        name = display_name(place['name'], place['area'])
+        return {
+            'display_name': name if distance_m <= NEAR_M else f'Near {name}',
+            'name': place['name'],
+            'kind': place['kind'],
+            'lat': place['lat'],
+            'lon': place['lon'],
+            'distance_m': round(distance_m)
+        }
+
+    def _upstream(self, lat, lon):
+        params = {'format': 'json', 'lat': f'{lat:.6f}', 'lon': f'{lon:.6f}', 'zoom': 18}
+        response = self.session.get(self.upstream_url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        item = response.json()
+        if 'display_name' not in item:
+            return None
+        return {'display_name': item['display_name'], 'lat': float(item['lat']), 'lon': float(item['lon'])}
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'cache_size': len(self._cache), 'cache_capacity': self.cache_size, **self.counts}
+
+class UpstreamError(Exception):
+    """The upstream geocoder could not be reached or returned garbage"""
+
+def render_metrics(search):
+    """Prometheus exposition lines for a PlaceSearch"""
+    stats = search.stats()
+    lines = ['# HELP taxi_search_queries_total Place searches by how they were answered',
+             '# TYPE taxi_search_queries_total counter']
+    for source in ['hit', 'local', 'upstream', 'upstream_error']:
+        lines.append(f'taxi_search_queries_total{{source="{source}"}} {stats[source]}')
+    lines += ['# HELP taxi_search_cache_entries Cached search results',
+              '# TYPE taxi_search_cache_entries gauge',
+              f'taxi_search_cache_entries {stats["cache_size"]}']
+    return lines
+
+def render_reverse_metrics(geocoder):
+    """Prometheus exposition lines for a ReverseGeocoder"""
+    stats = geocoder.stats()
+    lines = ['# HELP taxi_reverse_lookups_total Reverse geocoding lookups by how they were answered',
+             '# TYPE taxi_reverse_lookups_total counter']
+    for source in ['hit', 'local', 'upstream', 'upstream_error', 'miss']:
+        lines.append(f'taxi_reverse_lookups_total{{source="{source}"}} {stats[source]}')
+    lines += ['# HELP taxi_reverse_cache_entries Cached reverse geocoding results',
+              '# TYPE taxi_reverse_cache_entries gauge',
+              f'taxi_reverse_cache_entries {stats["cache_size"]}']
+    return lines
+
+# --- CHECKS & BENCHMARK ---
+def start_stub_upstream(fail=False):
+    """Local Nominatim stand-in on an ephemeral port; returns (server, url, request log)"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlparse
+
+    seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            seen.append(query)
+            if fail:
+                self.send_response(503)
+                self.end_headers()
+                return
+            if urlparse(self.path).path == '/reverse':
+                body = json.dumps({
+                    'display_name': f"{query['lat'][0]}, {query['lon'][0]}, Stub Street, New York",
+                    'lat': query['lat'][0],
+                    'lon': query['lon'][0]
+                }).encode()
+            else:
+                body = json.dumps([{
+                    'display_name': f"{query['q'][0]}, Stub Street, New York",
+                    'lat': '40.7000',
+                    'lon': '-73.9000'
+                }]).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}/search', seen
+
+def verify(gazetteer):
+    """Check ranking, fuzzy matching, the bounding box and upstream fallback against a local stub"""
+    lon_min, lat_min, lon_max, lat_max = NYC_VIEWBOX
+    outside = [p['name'] for p in gazetteer.places
+               if not (lat_min <= p['lat'] <= lat_max and lon_min <= p['lon'] <= lon_max)]
+    assert not outside, f"Places outside the NYC viewbox: {outside}"
+
+    expectations = {
+        'times': 'Times Square', 'times sq': 'Times Square', 'Times Square': 'Times Square',
+        'jfk': 'John F. Kennedy', 'laguardia': 'LaGuardia', 'empire': 'Empire State',
+        'grand cent': 'Grand Central', 'brooklyn bri': 'Brooklyn Bridge', 'tims sqare': 'Times Square',
+        'metropolitan musem': 'Metropolitan Museum', 'williamsburg': 'Williamsburg'
+    }
+    for query, prefix in expectations.items():
+        top = gazetteer.search(query, 1)
+        assert top and top[0]['display_name'].startswith(prefix), f"{query!r} -> {top}"
+    print(f"Ranking: {len(expectations)} queries OK")
+
+    server, url, seen = start_stub_upstream()
+    try:
+        search = PlaceSearch(gazetteer, upstream_url=url)
+        assert search.search('Times Sq', 5)[0]['display_name'].startswith('Times Square')
+        assert not seen, "Local hits must not reach the upstream"
+        first = search.search('350 zzyzx road', 5)
+        again = search.search('350  Zzyzx Road', 5)
+        assert first == again and first[0]['lat'] == 40.7 and len(seen) == 1, "Upstream result not cached"
+        assert seen[0]['bounded'] == ['1'] and seen[0]['viewbox'] == ['-74.25,40.49,-73.7,40.91']
+    finally:
+        server.shutdown()
+    print(f"Upstream fallback: {len(seen)} upstream call for 2 identical misses, cached")
+
+    server, url, seen = start_stub_upstream(fail=True)
+    try:
+        search = PlaceSearch(gazetteer, upstream_url=url)
+        try:
+            search.search('350 zzyzx road', 5)
+            raise AssertionError("Upstream failure was not reported")
+        except UpstreamError:
+            pass
+        assert search.search('350 zzyzx road', 5) == [] and len(seen) == 1, "Upstream not skipped after failure"
+        assert search.search('penn st', 5), "Local search must keep working while the upstream is down"
+    finally:
+        server.shutdown()
+    print("Upstream failure: reported once, then skipped for retry_after")
+
+    verify_reverse(gazetteer)
+
+def verify_reverse(gazetteer, samples=5000, seed=0):
+    """Grid lookups against brute force, snapping, the LRU and the upstream for far clicks"""
+    grid = PlaceGrid(gazetteer.places)
+    rng = np.random.default_rng(seed)
+    lon_min, lat_min, lon_max, lat_max = NYC_VIEWBOX
+    lat = rng.uniform(lat_min - 0.05, lat_max + 0.05, samples)
+    lon = rng.uniform(lon_min - 0.05, lon_max + 0.05, samples)
+    for max_distance in [300.0, 2000.0]:
+        for a, b in zip(lat, lon):
+            d = np.hypot(grid.x - b * grid.lon_scale, grid.y - a * METERS_PER_DEGREE)
+            found = grid.nearest(a, b, max_distance)
+            if d.min() > max_distance:
+                assert found is None, (a, b)
+            else:
+                assert found is not None and abs(found[1] - d.min()) < 1e-6, (a, b)
+    print(f"Nearest place: {samples} random clicks x 2 radii match a brute-force scan")
+
+    geocoder = ReverseGeocoder(gazetteer)
+    top = geocoder.reverse(40.7580, -73.9855)
+    assert top['display_name'].startswith('Times Square') and top['distance_m'] <= 25
+    near = geocoder.reverse(40.7700, -73.9500)
+    assert near['display_name'].startswith('Near ') and near['distance_m'] > NEAR_M
+    assert geocoder.reverse(40.75801, -73.98551) == top and geocoder.stats()['hit'] == 1, "Same cell should hit the LRU"
+    assert geocoder.reverse(40.30, -74.60) is None, "Clicks far from every place have no local name"
+    print("Reverse: exact and 'Near' names, snapped clicks share a cache entry, far clicks get none")
+
+    server, url, seen = start_stub_upstream()
+    try:
+        geocoder = ReverseGeocoder(gazetteer, upstream_url=url.replace('/search', '/reverse'))
+        assert geocoder.reverse(40.7580, -73.9855)['display_name'].startswith('Times Square') and not seen
+        far = geocoder.reverse(40.30, -74.60)
+        assert 'Stub Street' in far['display_name'] and geocoder.reverse(40.30, -74.60) == far and len(seen) == 1
+    finally:
+        server.shutdown()
+    print("Reverse upstream: only far clicks reach it, once per cell")
+
+def bench(gazetteer, queries=None):
+    """Replay typeahead keystrokes (every prefix of each query) and report per-keystroke latency"""
+    queries = queries or ['times square', 'jfk airport', 'grand central', 'metropolitan museum of art',
+                          'brooklyn bridge park', 'madison square garden', 'penn station',
+                          'columbia university', 'yankee stadium', 'laguardia']
+    keystrokes = [q[:n] for q in queries for n in range(2, len(q) + 1)]
+    search = PlaceSearch(gazetteer)
+
+    for label in ['cold', 'cached']:
+        timings = []
+        for text in keystrokes:
+            t0 = time.perf_counter()
+            search.search(text, 10)
+            timings.append(time.perf_counter() - t0)
+        p50, p95, p99 = np.percentile(np.array(timings) * 1e6, [50, 95, 99])
+        print(f"{label:7s}: {len(keystrokes)} keystrokes | p50 {p50:7.1f} us | p95 {p95:7.1f} us | p99 {p99:7.1f} us")
+
+    # Map clicks over Manhattan and the airports, then the same clicks again
+    rng = np.random.default_rng(0)
+    clicks = np.column_stack([rng.uniform(40.64, 40.82, 2000), rng.uniform(-74.02, -73.78, 2000)])
+    geocoder = ReverseGeocoder(gazetteer)
+    for label in ['cold', 'cached']:
+        timings = []
+        for lat, lon in clicks:
+            t0 = time.perf_counter()
+            geocoder.reverse(lat, lon)
+            timings.append(time.perf_counter() - t0)
+        p50, p95, p99 = np.percentile(np.array(timings) * 1e6, [50, 95, 99])
+        print(f"reverse {label:7s}: {len(clicks)} clicks | p50 {p50:7.1f} us | p95 {p95:7.1f} us | p99 {p99:7.1f} us")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Offline NYC place search for /api/search")
+    parser.add_argument('command', choices=['verify', 'bench', 'query', 'reverse'])
+    parser.add_argument('text', nargs='?', default='', help="search text, or 'lat,lon' for reverse")
+    parser.add_argument('--gazetteer', default=GAZETTEER_FILE)
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    gazetteer = Gazetteer.from_csv(args.gazetteer)
+    print(f"Indexed {len(gazetteer.places)} places, {len(gazetteer.tokens)} tokens in {(time.perf_counter() - t0) * 1e3:.1f} ms")
+
+    if args.command == 'verify':
+        verify(gazetteer)
+    elif args.command == 'bench':
+        bench(gazetteer)
+    elif args.command == 'reverse':
+        lat, lon = (float(v) for v in args.text.split(','))
+        print(ReverseGeocoder(gazetteer).reverse(lat, lon))
+    else:
+        for result in gazetteer.search(args.text):
+            print(f"{result['lat']:.4f} {result['lon']:.4f}  {result['display_name']}")
@@ -0,0 +1,36 @@
+# Production serving: gunicorn -c gunicorn.conf.py app:app
+#
+# The app (and every model) is imported once in the master with preload_app,
+# then workers are forked from it and share the model memory copy-on-write.
+# Measure memory and throughput per worker count with `python serving.py`.
+import gc
+import multiprocessing
+import os
+
+workers = int(os.environ.get('WEB_WORKERS', multiprocessing.cpu_count()))
+# gthread: request threads per worker; model calls release the GIL
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 4))
+bind = os.environ.get('WEB_BIND', '0.0.0.0:5000')
+preload_app = True
+timeout = 30
+keepalive = 5
+
+# Split each worker's share of the cores between its inference threads, and keep
+# the boosters' own OpenMP pools at one thread. That avoids oversubscribing the
+# cores, and libgomp pools must not be created in the master before fork.
+os.environ.setdefault('INFERENCE_THREADS', str(max(1, multiprocessing.cpu_count() // workers)))
+os.environ.setdefault('OMP_NUM_THREADS', '1')
+# Lazy loading would load the models separately in every worker
+os.environ['MODEL_LOADING'] = 'parallel' if os.environ.get('MODEL_LOADING') == 'parallel' else 'eager'
+
+# Keep the garbage collector from writing to the master's objects: no collections
+# while the models load, and everything alive at fork time is frozen out of
+# later collections so workers don't touch (and copy) those pages.
+gc.disable()
+
+def when_ready(server):
+    gc.freeze()
+
+def post_fork(server, worker):
+    gc.enable()
@@ -0,0 +1,370 @@
+import argparse
+import atexit
+import mmap
+import multiprocessing
+import os
+import threading
+import time
+
+import numpy as np
+
+from cluster_index import NYC_BOUNDS
+from features import haversine_np
+from trip_stats import DURATION_RANGE_MIN, PASSENGER_RANGE, DISTANCE_RANGE_KM, SPEED_RANGE_KMH, format_stats, parse_stats
+
+N_HOURS = 24
+# Per zone and hour of day: trip count and the sums behind each mean
+FIELDS = ['trips', 'duration_sum', 'speed_sum', 'passenger_sum']
+# int64 slots ahead of the sums: event counters, a change counter and the last snapshot
+HEADER = ['accepted', 'rejected', 'version', 'snapshot_version', 'snapshot_ms']
+ACCEPTED, REJECTED, VERSION, SNAPSHOT_VERSION, SNAPSHOT_MS = range(len(HEADER))
+SNAPSHOT_FILE = 'data/live_stats.npz'
+# Per-trip means, blended with the offline file's by trip count
+MEANS = ['duration_min', 'speed_kmh', 'passengers']
+
+def trip_filter(pickup_lat, pickup_lon, dropoff_lat, dropoff_lon, minutes, passengers):
+    """The training pipeline's cleaning rules, so live numbers compare with the offline ones.
+
+    Returns the mask of trips that pass and every trip's average speed in km/h.
+    """
+    lat_min, lat_max, lon_min, lon_max = NYC_BOUNDS
+    minutes = np.asarray(minutes, dtype=np.float64)
+    passengers = np.asarray(passengers)
+    km = haversine_np(pickup_lat, pickup_lon, dropoff_lat, dropoff_lon)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed = km / (minutes / 60)
+    in_box = ((lat_min <= pickup_lat) & (pickup_lat <= lat_max) & (lat_min <= dropoff_lat) & (dropoff_lat <= lat_max) &
+              (lon_min <= pickup_lon) & (pickup_lon <= lon_max) & (lon_min <= dropoff_lon) & (dropoff_lon <= lon_max))
+    valid = (in_box & (minutes >= DURATION_RANGE_MIN[0]) & (minutes <= DURATION_RANGE_MIN[1]) &
+             (passengers >= PASSENGER_RANGE[0]) & (passengers <= PASSENGER_RANGE[1]) &
+             (km >= DISTANCE_RANGE_KM[0]) & (km <= DISTANCE_RANGE_KM[1]) &
+             (speed > SPEED_RANGE_KMH[0]) & (speed <= SPEED_RANGE_KMH[1]))
+    return valid, speed
+
+class LiveClusterStats:
+    """Running per-zone, per-hour trip aggregates fed by completed-trip events.
+
+    The sums live in one fixed-size block of anonymous shared memory, so an
+    event costs four additions, and gunicorn workers forked after the block is
+    created all update and read the same numbers. Means and the peak hour are
+    derived only when the stats are read. When `snapshot_path` is set, the
+    block is restored from it on start and written back every
+    `snapshot_interval` seconds if it changed, and once more at exit.
+    """
+
+    def __init__(self, n_clusters, snapshot_path=None, snapshot_interval=60.0):
+        self.n_clusters = n_clusters
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self._buffer = mmap.mmap(-1, 8 * (len(HEADER) + len(FIELDS) * n_clusters * N_HOURS))
+        self.header = np.frombuffer(self._buffer, dtype=np.int64, count=len(HEADER))
+        self.sums = np.frombuffer(self._buffer, dtype=np.float64, offset=8 * len(HEADER)).reshape(
+            len(FIELDS), n_clusters, N_HOURS)
+        # A process-shared semaphore: threads and forked workers serialize on the same lock
+        self._lock = multiprocessing.Lock()
+        self._thread_lock = threading.Lock()
+        self._pid = None
+        if snapshot_path:
+            self.restore()
+            atexit.register(self.snapshot)
+
+    def add(self, cluster, hour, minutes, speed, passengers):
+        """Count one completed trip that already passed trip_filter"""
+        with self._lock:
+            cell = self.sums[:, cluster, hour]
+            cell[0] += 1
+            cell[1] += minutes
+            cell[2] += speed
+            cell[3] += passengers
+            self.header[ACCEPTED] += 1
+            self.header[VERSION] += 1
+
+    def add_many(self, cluster, hour, minutes, speed, passengers, valid=None):
+        """Count a batch of trips in one pass; rows outside `valid` or the zone range are rejected.
+
+        Returns the number of trips accepted.
+        """
+        cluster = np.asarray(cluster, dtype=np.int64)
+        hour = np.asarray(hour, dtype=np.int64)
+        keep = (cluster >= 0) & (cluster < self.n_clusters) & (hour >= 0) & (hour < N_HOURS)
+        if valid is not None:
+            keep &= valid
+        cells = cluster[keep] * N_HOURS + hour[keep]
+        size = self.n_clusters * N_HOURS
+        delta = np.stack([
+            np.bincount(cells, minlength=size).astype(np.float64),
+            np.bincount(cells, weights=np.asarray(minutes, dtype=np.float64)[keep], minlength=size),
+            np.bincount(cells, weights=np.asarray(speed, dtype=np.float64)[keep], minlength=size),
+            np.bincount(cells, weights=np.asarray(passengers, dtype=np.float64)[keep], minlength=size)
+        ]).reshape(self.sums.shape)
+        accepted = len(cells)
+        with self._lock:
+            self.sums += delta
+            self.header[ACCEPTED] += accepted
+            self.header[REJECTED] += len(keep) - accepted
+            self.header[VERSION] += 1
+        return accepted
+
+    def reset(self):
+        with self._lock:
+            self.sums[:] = 0
+            self.header[:] = 0
+
+    def version(self):
+        """Changes on every ingestion call, in any worker"""
+        return int(self.header[VERSION])
+
+    def cluster_stats(self, min_trips=1):
+        """Entries for zones with at least `min_trips` trips: the panel strings plus the raw numbers"""
+        with self._lock:
+            sums = self.sums.copy()
+        trips, duration, speed, passengers = sums
+        total = trips.sum(axis=1)
+        stats = {}
+        for c in np.flatnonzero((total >= min_trips) & (total > 0)):
+            n = total[c]
+            peak_hour = int(np.argmax(trips[c]))
+            values = {
+                'trips': int(n),
+                'duration_min': float(duration[c].sum() / n),
+                'speed_kmh': float(speed[c].sum() / n),
+                'passengers': float(passengers[c].sum() / n),
+                'peak_hour': peak_hour
+            }
+            stats[int(c)] = {
+                **format_stats(n, values['duration_min'], values['speed_kmh'], values['passengers'], peak_hour),
+                **{k: round(v, 2) if isinstance(v, float) else v for k, v in values.items()},
+                'hourly_trips': trips[c].astype(np.int64).tolist(),
+                'source': 'live'
+            }
+        return stats
+
+    # --- SNAPSHOTS ---
+    def restore(self):
+        """Load the last snapshot if it matches this zone count; returns whether it did"""
+        try:
+            with np.load(self.snapshot_path) as data:
+                sums, header = data['sums'], data['header']
+        except (OSError, ValueError, KeyError):
+            return False
+        if sums.shape != self.sums.shape:
+            print(f"WARNING: {self.snapshot_path} has {sums.shape[1]} zones, not {self.n_clusters}; starting empty")
+            return False
+        with self._lock:
+            self.sums[:] = sums
+            self.header[:] = 0
+            for slot in [ACCEPTED, REJECTED, SNAPSHOT_MS]:
+                self.header[slot] = header[slot]
+        return True
+
+    def snapshot(self, force=False):
+        """Write the aggregates to snapshot_path if they changed since the last write by any worker"""
+        if not self.snapshot_path:
+            return False
+        with self._lock:
+            if not force and self.header[VERSION] == self.header[SNAPSHOT_VERSION]:
+                return False
+            sums, header = self.sums.copy(), self.header.copy()
+            self.header[SNAPSHOT_VERSION] = self.header[VERSION]
+            self.header[SNAPSHOT_MS] = header[SNAPSHOT_MS] = int(time.time() * 1000)
+        tmp = f'{self.snapshot_path}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path) or '.', exist_ok=True)
+            with open(tmp, 'wb') as f:
+                np.savez(f, sums=sums, header=header)
+            os.replace(tmp, self.snapshot_path)
+        except OSError as e:
+            # Leave the block marked as changed so the next tick retries
+            with self._lock:
+                self.header[SNAPSHOT_VERSION] = -1
+            print(f"WARNING: live stats snapshot failed: {e}")
+            return False
+        return True
+
+    def start(self):
+        """Start the snapshot thread in this process (again after a fork); cheap to call per request"""
+        if self._pid == os.getpid() or not self.snapshot_path or not self.snapshot_interval:
+            return
+        with self._thread_lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name='live-stats-snapshot', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.snapshot_interval)
+            self.snapshot()
+
+    def stats(self):
+        snapshot_ms = int(self.header[SNAPSHOT_MS])
+        return {
+            'accepted': int(self.header[ACCEPTED]),
+            'rejected': int(self.header[REJECTED]),
+            'snapshot_path': self.snapshot_path,
+            'snapshot_at': snapshot_ms / 1000 if snapshot_ms else None
+        }
+
+def blend_cluster_stats(offline, live):
+    """Offline cluster_stats.json entries combined zone by zone with LiveClusterStats.cluster_stats().
+
+    Where a zone has both, the panel strings show the total trip count and the
+    trip-weighted means, and each source's own numbers are kept under
+    'offline' and 'live'. The file keeps only its busiest hour, so the peak
+    hour comes from the source with more trips.
+    """
+    stats = {c: {**entry, 'source': 'offline'} for c, entry in offline.items()}
+    for c, entry in live.items():
+        try:
+            past = parse_stats(offline[c])
+        except (KeyError, ValueError, IndexError, AttributeError):
+            stats[c] = entry
+            continue
+        now = {k: v for k, v in entry.items() if k in past or k == 'hourly_trips'}
+        trips = past['trips'] + now['trips']
+        means = {k: (past[k] * past['trips'] + now[k] * now['trips']) / trips for k in MEANS}
+        peak_hour = max(past, now, key=lambda s: s['trips'])['peak_hour']
+        stats[c] = {
+            # Rounded first: format_stats truncates, and the file's minutes are already truncated
+            **format_stats(trips, round(means['duration_min']), means['speed_kmh'], means['passengers'], peak_hour),
+            'trips': trips,
+            **{k: round(v, 2) for k, v in means.items()},
+            'peak_hour': peak_hour,
+            'offline': past,
+            'live': now,
+            'source': 'blended'
+        }
+    return stats
+
+def render_metrics(live):
+    """Prometheus exposition lines for a LiveClusterStats"""
+    stats = live.stats()
+    lines = ['# HELP taxi_live_trips_total Completed-trip events by result',
+             '# TYPE taxi_live_trips_total counter']
+    for result in ['accepted', 'rejected']:
+        lines.append(f'taxi_live_trips_total{{result="{result}"}} {stats[result]}')
+    lines += ['# HELP taxi_live_stats_snapshot_timestamp_seconds When the live cluster stats were last written to disk',
+              '# TYPE taxi_live_stats_snapshot_timestamp_seconds gauge',
+              f'taxi_live_stats_snapshot_timestamp_seconds {stats["snapshot_at"] or 0:.3f}']
+    return lines
+
+# --- VERIFY & BENCH ---
+def random_events(n, n_clusters=10, seed=0):
+    """Column arrays for n synthetic trips that pass trip_filter"""
+    rng = np.random.default_rng(seed)
+    hour = rng.integers(0, N_HOURS, n)
+    minutes = rng.uniform(2, 60, n)
+    return {
+        'cluster': rng.integers(0, n_clusters, n),
+        'hour': hour,
+        'minutes': minutes,
+        'speed': rng.uniform(5, 40, n),
+        'passengers': rng.integers(1, 7, n)
+    }
+
+def verify(n=20000):
+    """Aggregates against a pandas groupby, the shared block across a fork, and a snapshot round trip"""
+    import tempfile
+    import pandas as pd
+
+    events = random_events(n)
+    live = LiveClusterStats(10)
+    half = n // 2
+    for i in range(half):
+        live.add(*(events[k][i].item() for k in ['cluster', 'hour', 'minutes', 'speed', 'passengers']))
+    live.add_many(**{k: v[half:] for k, v in events.items()})
+    stats = live.cluster_stats()
+
+    df = pd.DataFrame(events)
+    expected = df.groupby('cluster').agg(trips=('hour', 'size'), duration=('minutes', 'mean'),
+                                         speed=('speed', 'mean'), passengers=('passengers', 'mean'))
+    peak = df.groupby(['cluster', 'hour']).size().unstack(fill_value=0).idxmax(axis=1)
+    for c, row in expected.iterrows():
+        entry = stats[c]
+        assert entry['trips'] == row['trips'], f"zone {c}: {entry['trips']} trips, expected {row['trips']}"
+        assert abs(entry['duration_min'] - row['duration']) < 0.01 and abs(entry['speed_kmh'] - row['speed']) < 0.01
+        assert abs(entry['passengers'] - row['passengers']) < 0.01 and entry['peak_hour'] == peak[c]
+        assert entry == {**entry, **format_stats(row['trips'], row['duration'], row['speed'], row['passengers'], peak[c])}
+    print(f"{n} events ({half} single, {n - half} bulk): means, counts and peak hours match a pandas groupby")
+
+    valid, speed = trip_filter(np.array([40.75, 40.75, 0.0]), np.array([-73.99, -73.99, 0.0]),
+                               np.array([40.70, 40.75, 40.7]), np.array([-74.01, -73.99, -74.0]),
+                               np.array([12.0, 12.0, 12.0]), np.array([1, 1, 1]))
+    assert valid.tolist() == [True, False, False] and 25 < speed[0] < 35
+    assert live.add_many([0, 10, -1], [0, 0, 0], [5, 5, 5], [10, 10, 10], [1, 1, 1]) == 1
+    assert live.stats()['rejected'] == 2
+    print("Cleaning rules and out-of-range zones reject events")
+
+    offline = {0: format_stats(100000, 10, 20.0, 1.5, 8), 1: format_stats(500, 12, 15.0, 1.2, 18)}
+    blended = blend_cluster_stats(offline, {0: stats[0], 2: stats[2]})
+    n0 = stats[0]['trips']
+    assert blended[0]['avg_trips'] == f"{100000 + n0:,} trips" and blended[0]['source'] == 'blended'
+    assert abs(blended[0]['speed_kmh'] - (20.0 * 100000 + stats[0]['speed_kmh'] * n0) / (100000 + n0)) < 0.01
+    assert blended[0]['peak_hour'] == 8 and blended[0]['live']['trips'] == n0
+    assert blended[1] == {**offline[1], 'source': 'offline'} and blended[2] == stats[2]
+    print("Live trips blend into the offline figures by trip count")
+
+    before = live.stats()['accepted']
+    pid = os.fork()
+    if pid == 0:
+        live.add_many([3] * 100, [8] * 100, [10] * 100, [20] * 100, [2] * 100)
+        os._exit(0)
+    os.waitpid(pid, 0)
+    assert live.stats()['accepted'] == before + 100, "A forked worker's events should be visible in the parent"
+    print("Events from a forked worker land in the same block")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'live_stats.npz')
+        live.snapshot_path = path
+        assert live.snapshot() and not live.snapshot(), "An unchanged block should not be rewritten"
+        restored = LiveClusterStats(10, snapshot_path=path)
+        assert restored.cluster_stats() == live.cluster_stats()
+        assert restored.stats()['accepted'] == live.stats()['accepted']
+        assert not LiveClusterStats(12, snapshot_path=path).cluster_stats(), "A snapshot for another zone count is ignored"
+    print("Snapshot round trip restores the same stats")
+
+def bench(n=200000):
+    """Ingestion throughput: per-event adds, bulk adds and the HTTP endpoint"""
+    events = random_events(n)
+    live = LiveClusterStats(10)
+    rows = list(zip(events['cluster'].tolist(), events['hour'].tolist(), events['minutes'].tolist(),
+                    events['speed'].tolist(), events['passengers'].tolist()))
+    t0 = time.perf_counter()
+    for row in rows:
+        live.add(*row)
+    elapsed = time.perf_counter() - t0
+    print(f"add (one event)      : {n / elapsed:12,.0f} events/s | {elapsed / n * 1e6:6.2f} µs/event")
+    for batch in [100, 1000, 10000]:
+        t0 = time.perf_counter()
+        for i in range(0, n, batch):
+            live.add_many(**{k: v[i:i + batch] for k, v in events.items()})
+        elapsed = time.perf_counter() - t0
+        print(f"add_many (batch {batch:5d}): {n / elapsed:12,.0f} events/s | {elapsed / n * 1e6:6.2f} µs/event")
+
+    import app
+    from serving import sample_trips
+    trips = [{**t, 'trip_duration': 900} for t in sample_trips(1000)]
+    client = app.app.test_client()
+    # Keep benchmark trips out of the app's own aggregates and snapshot
+    previous, app.live_stats = app.live_stats, LiveClusterStats(live.n_clusters)
+    try:
+        for batch, repeat in [(1, 2000), (100, 100), (1000, 20)]:
+            t0 = time.perf_counter()
+            for i in range(repeat):
+                body = trips[i % len(trips)] if batch == 1 else {'trips': trips[:batch]}
+                client.post('/api/trips/completed', json=body)
+            elapsed = time.perf_counter() - t0
+            print(f"POST /api/trips/completed (batch {batch:4d}): {batch * repeat / elapsed:10,.0f} events/s | "
+                  f"{elapsed / repeat * 1e3:6.2f} ms/request")
+        print(f"Live stats: {app.live_stats.stats()}")
+    finally:
+        app.live_stats = previous
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Live per-zone trip statistics from completed-trip events")
+    parser.add_argument('command', choices=['verify', 'bench'])
+    args = parser.parse_args()
+
+    if args.command == 'verify':
+        verify()
+    else:
+        bench()
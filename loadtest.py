@@ -0,0 +1,366 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+
+from traffic_log import load_traffic
+
+# Committed artifacts a stub model directory is assembled from
+STUB_COPY_FILES = ['cluster_centroids.json', 'cluster_stats.json', 'features_problem1_final.pkl',
+                   'features_problem2_final.pkl', 'kmeans_pickup.pkl']
+SEARCH_TERMS = ['times square', 'jfk', 'laguardia', 'grand central', 'penn station', 'empire state',
+                'brooklyn bridge', 'central park', 'wall street', 'yankee stadium', 'williamsburg', 'soho']
+
+# --- TRAFFIC ---
+def api_rules():
+    """The app's /api/ URL rules, e.g. '/api/demand_tiles/<int:month>'"""
+    import app
+    return sorted({rule.rule for rule in app.app.url_map.iter_rules() if rule.rule.startswith('/api/')})
+
+def synthetic_traffic(n=2000, seed=0, batch_size=100, with_route=True, rules=None):
+    """A request mix over every /api/* endpoint, weighted towards the prediction calls.
+
+    Requests are keyed by URL rule ('endpoint'), so per-endpoint results group
+    e.g. every month of /api/demand_tiles/<int:month> together. With `rules`
+    (see api_rules), an /api/ rule that has no maker here raises ValueError,
+    so a new endpoint cannot drop out of the benchmark unnoticed.
+    """
+    rng = np.random.default_rng(seed)
+
+    def point():
+        return float(rng.uniform(40.63, 40.85)), float(rng.uniform(-74.02, -73.77))
+
+    def trip():
+        (p_lat, p_lon), (d_lat, d_lon) = point(), point()
+        return {
+            'pickup_lat': p_lat, 'pickup_lon': p_lon, 'dropoff_lat': d_lat, 'dropoff_lon': d_lon,
+            'datetime': f'2016-{int(rng.integers(1, 13)):02d}-{int(rng.integers(1, 29)):02d}T{int(rng.integers(0, 24)):02d}:{int(rng.integers(0, 60)):02d}',
+            'passengers': int(rng.integers(1, 7))
+        }
+
+    def completed_trip():
+        return {**trip(), 'trip_duration': int(rng.integers(180, 3600))}
+
+    def sweep():
+        (p_lat, p_lon), (d_lat, d_lon) = point(), point()
+        return {'pickup_lat': p_lat, 'pickup_lon': p_lon, 'dropoff_lat': d_lat, 'dropoff_lon': d_lon,
+                'start': trip()['datetime'], 'window_minutes': 180, 'step_minutes': 15}
+
+    makers = {
+        '/api/predict_duration': (30, lambda: {'method': 'POST', 'json': trip()}),
+        '/api/predict_destination': (25, lambda: {'method': 'POST', 'json': trip()}),
+        '/api/predict_duration/batch': (3, lambda: {'method': 'POST', 'json': {'trips': [trip() for _ in range(batch_size)]}}),
+        '/api/predict_destination/batch': (3, lambda: {'method': 'POST', 'json': {'trips': [trip() for _ in range(batch_size)]}}),
+        '/api/search': (20, lambda: {'method': 'GET', 'query': {
+            'q': SEARCH_TERMS[int(rng.integers(len(SEARCH_TERMS)))][:int(rng.integers(2, 8))]}}),
+        '/api/clusters': (8, lambda: {'method': 'GET'}),
+        '/api/cluster_stats': (6, lambda: {'method': 'GET'}),
+        '/api/batching': (1, lambda: {'method': 'GET'}),
+        '/api/duration_matrix': (2, lambda: {'method': 'POST', 'json': {
+            'origins': [point() for _ in range(10)], 'destinations': [point() for _ in range(10)],
+            'datetime': trip()['datetime']}}),
+        '/api/departure_sweep': (2, lambda: {'method': 'POST', 'json': sweep()}),
+        '/api/demand_tiles': (1, lambda: {'method': 'GET'}),
+        '/api/demand_tiles/<int:month>': (2, lambda: {'method': 'GET',
+                                                      'path': f'/api/demand_tiles/{int(rng.integers(1, 13))}'}),
+        '/api/model': (1, lambda: {'method': 'GET'}),
+        '/api/trips/completed': (4, lambda: {'method': 'POST', 'json': completed_trip()}),
+        '/api/reverse': (8, lambda: {'method': 'GET', 'query': dict(zip(['lat', 'lon'], point()))}),
+        '/api/route': (4, lambda: {'method': 'GET', 'query': dict(zip(
+            ['p_lat', 'p_lon', 'd_lat', 'd_lon'], (*point(), *point())))})
+    }
+    if rules is not None:
+        missing = sorted(set(rules) - set(makers))
+        if missing:
+            raise ValueError(f"No synthetic traffic for {', '.join(missing)}; add a maker to synthetic_traffic")
+        makers = {rule: makers[rule] for rule in rules}
+    if not with_route:
+        makers.pop('/api/route', None)
+    endpoints = list(makers)
+    weights = np.array([makers[e][0] for e in endpoints], dtype=np.float64)
+    picks = rng.choice(len(endpoints), size=n, p=weights / weights.sum())
+    # Every endpoint appears at least once
+    picks[:len(endpoints)] = np.arange(len(endpoints))
+    return [{'endpoint': endpoints[i], 'path': endpoints[i], **makers[endpoints[i]][1]()} for i in picks]
+
+# --- STUB MODELS ---
+def build_stub_models(out_dir, model_path='models/', n=20000, seed=0):
+    """Train small XGBoost/LightGBM models with the production feature lists on synthetic trips.
+
+    The committed artifacts (centroids, cluster stats, feature lists, KMeans)
+    are copied alongside, so the directory can be used as MODEL_PATH.
+    """
+    import joblib
+    import lightgbm as lgb
+    import pandas as pd
+    import xgboost as xgb
+    from cluster_index import ClusterIndex
+    from features import duration_features, destination_features, destination_default, to_model_frame
+
+    os.makedirs(out_dir, exist_ok=True)
+    for name in STUB_COPY_FILES:
+        shutil.copy(model_path + name, os.path.join(out_dir, name))
+
+    rng = np.random.default_rng(seed)
+    p_lat, d_lat = rng.uniform(40.63, 40.85, (2, n))
+    p_lon, d_lon = rng.uniform(-74.02, -73.77, (2, n))
+    hour, month, weekday = rng.integers(0, 24, n), rng.integers(1, 13, n), rng.integers(0, 7, n)
+    passengers = rng.integers(1, 7, n)
+    index = ClusterIndex.from_kmeans(joblib.load(model_path + 'kmeans_pickup.pkl'))
+    p_cluster = index.predict(np.column_stack([p_lat, p_lon]))
+    d_cluster = index.predict(np.column_stack([d_lat, d_lon]))
+
+    features = duration_features(p_lat, p_lon, d_lat, d_lon, hour, month, weekday, passengers, p_cluster, d_cluster)
+    feat_duration = joblib.load(model_path + 'features_problem1_final.pkl')
+    rush = np.isin(hour, [7, 8, 9, 16, 17, 18, 19])
+    minutes = 3 + features['distance_km'] * (2.2 + 0.8 * rush) + rng.normal(0, 1.5, n)
+    duration_model = xgb.XGBRegressor(n_estimators=60, max_depth=6, learning_rate=0.2)
+    duration_model.fit(to_model_frame(features, feat_duration), np.log1p(np.clip(minutes, 1, None)))
+    joblib.dump(duration_model, os.path.join(out_dir, 'xgb_problem1_final.pkl'))
+
+    feat_dest = joblib.load(model_path + 'features_problem2_final.pkl')
+    frame = to_model_frame(destination_features(p_cluster, passengers, hour, month, weekday), feat_dest, destination_default)
+    frame['pickup_cluster'] = pd.Categorical(frame['pickup_cluster'], categories=list(range(len(index.centroids))))
+    train = lgb.Dataset(frame, label=d_cluster, categorical_feature=['pickup_cluster'])
+    dest_model = lgb.train({'objective': 'multiclass', 'num_class': len(index.centroids), 'num_leaves': 15,
+                            'verbosity': -1}, train, num_boost_round=30)
+    joblib.dump(dest_model, os.path.join(out_dir, 'lgbm_destination_prediction.pkl'))
+    return out_dir
+
+# --- RUNNERS ---
+def in_process_sender():
+    """Send function that calls the Flask app through its test client, one client per thread"""
+    import app
+    local = threading.local()
+
+    def send(req):
+        client = getattr(local, 'client', None) or app.app.test_client()
+        local.client = client
+        response = client.open(req['path'], method=req.get('method', 'GET'),
+                               query_string=req.get('query'), json=req.get('json'))
+        response.get_data()
+        return response.status_code
+    return send
+
+def http_sender(base_url, timeout=30):
+    import requests
+    local = threading.local()
+
+    def send(req):
+        session = getattr(local, 'session', None) or requests.Session()
+        local.session = session
+        response = session.request(req.get('method', 'GET'), base_url + req['path'],
+                                   params=req.get('query'), json=req.get('json'), timeout=timeout)
+        return response.status_code
+    return send
+
+def start_local_server(port=0):
+    """Serve the app on a threaded local HTTP server; returns (server, base url)"""
+    from werkzeug.serving import make_server
+    import app
+    server = make_server('127.0.0.1', port, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+def replay(send, traffic, concurrency=1, warmup=0):
+    """Send every request once from `concurrency` threads; returns per-request samples and wall time"""
+    for req in traffic[:warmup]:
+        send(req)
+    samples = []
+    cursor = iter(traffic)
+    lock = threading.Lock()
+
+    def worker(_):
+        local = []
+        while True:
+            with lock:
+                req = next(cursor, None)
+            if req is None:
+                break
+            t0 = time.perf_counter()
+            try:
+                status = send(req)
+            except Exception:
+                status = 0
+            local.append((req.get('endpoint', req['path']), status, time.perf_counter() - t0))
+        return local
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for local in pool.map(worker, range(concurrency)):
+            samples.extend(local)
+    return samples, time.perf_counter() - started
+
+def summarize(samples, wall_seconds):
+    """Per-endpoint and overall throughput and latency percentiles (ms)"""
+    def stats(rows):
+        latency = np.array([s[2] for s in rows]) * 1000
+        p50, p95, p99 = np.percentile(latency, [50, 95, 99])
+        statuses = {}
+        for _, status, _ in rows:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        return {
+            'count': len(rows),
+            'throughput_rps': len(rows) / wall_seconds,
+            'errors': sum(status == 0 or status >= 500 for _, status, _ in rows),
+            'statuses': statuses,
+            'mean_ms': float(latency.mean()),
+            'p50_ms': float(p50), 'p95_ms': float(p95), 'p99_ms': float(p99), 'max_ms': float(latency.max())
+        }
+
+    endpoints = {}
+    for sample in samples:
+        endpoints.setdefault(sample[0], []).append(sample)
+    return {
+        'overall': stats(samples),
+        'endpoints': {path: stats(rows) for path, rows in sorted(endpoints.items())}
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def print_report(results):
+    print(f"{'endpoint':34s} {'count':>6s} {'req/s':>9s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} {'errors':>6s}")
+    rows = list(results['endpoints'].items()) + [('TOTAL', results['overall'])]
+    for path, s in rows:
+        print(f"{path:34s} {s['count']:6d} {s['throughput_rps']:9.1f} {s['p50_ms']:8.2f} {s['p95_ms']:8.2f} "
+              f"{s['p99_ms']:8.2f} {s['errors']:6d}")
+
+def compare(base, new, threshold=0.10):
+    """Print p50/p99/throughput changes per endpoint; returns the endpoints whose p99 regressed beyond threshold"""
+    regressions = []
+    for key in ['mode', 'concurrency', 'traffic', 'stub_models', 'cpus']:
+        if base['meta'].get(key) != new['meta'].get(key):
+            print(f"WARNING: runs differ in {key}: {base['meta'].get(key)!r} vs {new['meta'].get(key)!r}")
+    print(f"{'endpoint':34s} {'p50 ms':>18s} {'p99 ms':>18s} {'req/s':>20s}")
+    for path, s in new['endpoints'].items():
+        b = base['endpoints'].get(path)
+        if b is None:
+            print(f"{path:34s} (new endpoint)")
+            continue
+        change = s['p99_ms'] / b['p99_ms'] - 1 if b['p99_ms'] else 0.0
+        flag = '  REGRESSION' if change > threshold else ''
+        if flag:
+            regressions.append(path)
+        print(f"{path:34s} {b['p50_ms']:7.2f} -> {s['p50_ms']:7.2f} {b['p99_ms']:7.2f} -> {s['p99_ms']:7.2f} "
+              f"{b['throughput_rps']:8.1f} -> {s['throughput_rps']:8.1f} {change:+7.1%}{flag}")
+    return regressions
+
+def run(args):
+    stub_dir = osrm = None
+    if args.stub_models:
+        # Everything offline: stub boosters, a local OSRM stand-in, no Nominatim fallback and
+        # live cluster stats kept in memory
+        from routing import start_stub_osrm
+        stub_dir = tempfile.mkdtemp(prefix='taxi-stub-models-')
+        build_stub_models(stub_dir, args.model_path)
+        osrm, osrm_url, _ = start_stub_osrm()
+        os.environ.update({'MODEL_PATH': stub_dir + '/', 'ROUTE_UPSTREAM_URL': osrm_url, 'SEARCH_UPSTREAM_URL': '',
+                           'REVERSE_UPSTREAM_URL': '', 'LIVE_STATS_SNAPSHOT': ''})
+    if args.traffic:
+        traffic = load_traffic(args.traffic)
+    else:
+        traffic = synthetic_traffic(args.n, args.seed, args.batch_size, rules=api_rules())
+
+    server = None
+    try:
+        if args.mode == 'inprocess':
+            send = in_process_sender()
+        else:
+            url = args.url
+            if url is None:
+                server, url = start_local_server()
+            send = http_sender(url.rstrip('/'))
+        samples, wall = replay(send, traffic, args.concurrency, args.warmup)
+    finally:
+        if server is not None:
+            server.shutdown()
+        if osrm is not None:
+            osrm.shutdown()
+        if stub_dir is not None:
+            shutil.rmtree(stub_dir, ignore_errors=True)
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'mode': args.mode,
+            'url': args.url,
+            'concurrency': args.concurrency,
+            'requests': len(traffic),
+            'traffic': args.traffic or f'synthetic(n={args.n}, seed={args.seed}, batch_size={args.batch_size})',
+            'stub_models': args.stub_models,
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'wall_seconds': wall
+        },
+        **summarize(samples, wall)
+    }
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved {args.output}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay API traffic and report throughput and latency percentiles")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('run', help="replay traffic and report per-endpoint latency")
+    p.add_argument('--mode', choices=['inprocess', 'http'], default='inprocess')
+    p.add_argument('--url', default=None, help="server to load in http mode (default: start one locally)")
+    p.add_argument('--concurrency', type=int, default=1)
+    p.add_argument('--traffic', default=None, help="JSONL traffic file (default: synthetic)")
+    p.add_argument('--n', type=int, default=2000, help="synthetic requests")
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--batch-size', type=int, default=100, help="trips per synthetic batch request")
+    p.add_argument('--warmup', type=int, default=50, help="requests sent before timing starts")
+    p.add_argument('--stub-models', action='store_true', help="train throwaway models and stub the upstreams")
+    p.add_argument('--model-path', default='models/')
+    p.add_argument('--output', default=None, help="write results JSON here")
+
+    p = sub.add_parser('synthesize', help="write synthetic traffic as JSONL")
+    p.add_argument('out')
+    p.add_argument('--n', type=int, default=2000)
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--batch-size', type=int, default=100)
+
+    p = sub.add_parser('compare', help="compare two results files")
+    p.add_argument('base')
+    p.add_argument('new')
+    p.add_argument('--threshold', type=float, default=0.10, help="p99 increase counted as a regression")
+
+    p = sub.add_parser('stub-models', help="write stub models into a directory usable as MODEL_PATH")
+    p.add_argument('out')
+    p.add_argument('--model-path', default='models/')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    elif args.command == 'synthesize':
+        with open(args.out, 'w') as f:
+            for req in synthetic_traffic(args.n, args.seed, args.batch_size, rules=api_rules()):
+                f.write(json.dumps(req, separators=(',', ':')) + '\n')
+    elif args.command == 'compare':
+        with open(args.base) as f:
+            base = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        sys.exit(1 if compare(base, new, args.threshold) else 0)
+    else:
+        build_stub_models(args.out, args.model_path)
+        print(f"Stub models written to {args.out}; run with MODEL_PATH={args.out.rstrip('/')}/")
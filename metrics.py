@@ -0,0 +1,140 @@
+import threading
+import time
+
+# Request/stage latency buckets in seconds
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+class Histogram:
+    """Cumulative-bucket histogram with sum and count"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+            else:
+                self.counts[-1] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            cumulative, total = {}, 0
+            for bound, n in zip(self.buckets + ('+Inf',), self.counts):
+                total += n
+                cumulative[str(bound)] = total
+            return {'buckets': cumulative, 'sum': self.sum, 'count': self.count}
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels.items()) + '}'
+
+def histogram_lines(name, labels, snapshot):
+    """Exposition lines for one labeled Histogram snapshot"""
+    lines = []
+    for bound, count in snapshot['buckets'].items():
+        lines.append(f'{name}_bucket{format_labels({**labels, "le": bound})} {count}')
+    lines.append(f'{name}_sum{format_labels(labels)} {snapshot["sum"]}')
+    lines.append(f'{name}_count{format_labels(labels)} {snapshot["count"]}')
+    return lines
+
+class LabeledHistogram:
+    """Histogram family keyed by label values"""
+
+    def __init__(self, name, help_text, labelnames, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = buckets
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, Histogram(self.buckets))
+        return child
+
+    def observe(self, value, *values):
+        self.labels(*values).observe(value)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            children = sorted(self._children.items())
+        for values, child in children:
+            lines.extend(histogram_lines(self.name, dict(zip(self.labelnames, values)), child.snapshot()))
+        return lines
+
+class LabeledCounter:
+    """Counter family keyed by label values"""
+
+    def __init__(self, name, help_text, labelnames):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *values, amount=1):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for values, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{format_labels(dict(zip(self.labelnames, values)))} {value}')
+        return lines
+
+class Registry:
+    """Collection of metrics rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def histogram(self, name, help_text, labelnames, buckets=LATENCY_BUCKETS):
+        metric = LabeledHistogram(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames):
+        metric = LabeledCounter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collect):
+        """Register a callable returning extra exposition lines at scrape time"""
+        self._collectors.append(collect)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            lines.extend(collect())
+        return '\n'.join(lines) + '\n'
+
+class StageTimer:
+    """Record the time spent in consecutive stages of one request"""
+
+    def __init__(self, histogram, endpoint):
+        self.histogram = histogram
+        self.endpoint = endpoint
+        self.last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.histogram.observe(now - self.last, self.endpoint, stage)
+        self.last = now
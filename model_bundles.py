@@ -0,0 +1,269 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from demand_tiles import TILES_FILE
+from destination_table import TABLE_FILE
+from model_store import SOURCE_FILES, NATIVE_DIR, read_manifest
+
+BUNDLES_DIR = 'bundles/'
+CURRENT_FILE = 'CURRENT'
+BUNDLE_MANIFEST = 'bundle.json'
+CLUSTER_NAMES_FILE = 'cluster_names.json'
+# Copied into every bundle when present next to the models
+OPTIONAL_FILES = ['cluster_centroids.json', 'cluster_stats.json', TABLE_FILE, TILES_FILE, CLUSTER_NAMES_FILE]
+
+class BundleError(Exception):
+    """A bundle is missing, incomplete or failed validation"""
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+# --- BUNDLES ON DISK ---
+def bundle_path(bundles_dir, version):
+    return f'{bundles_dir}{version}/'
+
+def create_bundle(model_path='models/', bundles_dir=None, version=None, cluster_names=None):
+    """Copy the current model files into bundles/<version>/ with a manifest of their hashes.
+
+    The bundle is assembled under a temporary name and renamed into place, so
+    a watcher never sees a half-copied bundle.
+    """
+    bundles_dir = bundles_dir or model_path + BUNDLES_DIR
+    version = version or time.strftime('%Y%m%d-%H%M%S')
+    final = bundle_path(bundles_dir, version)
+    if os.path.exists(final):
+        raise BundleError(f"Bundle {version} already exists")
+    staging = final.rstrip('/') + '.tmp/'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    files = [f for f in SOURCE_FILES.values() if os.path.exists(model_path + f)]
+    files += [f for f in OPTIONAL_FILES if os.path.exists(model_path + f)]
+    if read_manifest(model_path) is not None:
+        files += [NATIVE_DIR + f for f in sorted(os.listdir(model_path + NATIVE_DIR))]
+        os.makedirs(staging + NATIVE_DIR)
+    for name in files:
+        # copy2 keeps mtimes, which the native manifest checks against the pickles
+        shutil.copy2(model_path + name, staging + name)
+    if cluster_names is not None:
+        with open(staging + CLUSTER_NAMES_FILE, 'w') as f:
+            json.dump(cluster_names, f, indent=2)
+        files.append(CLUSTER_NAMES_FILE)
+
+    manifest = {
+        'version': version,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'files': {name: file_sha256(staging + name) for name in sorted(set(files))}
+    }
+    with open(staging + BUNDLE_MANIFEST, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.rename(staging, final)
+    return version
+
+def verify_bundle(bundles_dir, version):
+    """The bundle's manifest, after checking every listed file against its hash"""
+    path = bundle_path(bundles_dir, version)
+    try:
+        with open(path + BUNDLE_MANIFEST) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        raise BundleError(f"Bundle {version} has no readable {BUNDLE_MANIFEST}: {e}") from e
+    for name, digest in manifest['files'].items():
+        if not os.path.exists(path + name) or file_sha256(path + name) != digest:
+            raise BundleError(f"Bundle {version}: {name} is missing or does not match its hash")
+    return manifest
+
+def read_current(bundles_dir):
+    """Version named in bundles/CURRENT, or None"""
+    try:
+        with open(bundles_dir + CURRENT_FILE) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+def activate(bundles_dir, version):
+    """Point bundles/CURRENT at a version; running servers pick it up on their next poll"""
+    verify_bundle(bundles_dir, version)
+    tmp = bundles_dir + CURRENT_FILE + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(version + '\n')
+    os.replace(tmp, bundles_dir + CURRENT_FILE)
+
+def list_bundles(bundles_dir):
+    if not os.path.isdir(bundles_dir):
+        return []
+    return sorted(d for d in os.listdir(bundles_dir)
+                  if os.path.exists(bundle_path(bundles_dir, d) + BUNDLE_MANIFEST))
+
+def cluster_names(model_path, default):
+    """Cluster names shipped with a bundle, falling back to `default`"""
+    try:
+        with open(model_path + CLUSTER_NAMES_FILE) as f:
+            return {int(k): v for k, v in json.load(f).items()}
+    except OSError:
+        return default
+
+# --- CANARY ---
+def validate_canary(new, old=None, max_drift=0.5):
+    """Reject implausible canary outputs from a freshly loaded model set.
+
+    `new` and `old` hold 'duration_minutes', 'probabilities' and 'clusters'
+    for the same canary trips. Besides sanity checks, the median
+    |log(new / old)| duration ratio must stay within max_drift.
+    """
+    minutes, probabilities = np.asarray(new['duration_minutes'], dtype=float), np.asarray(new['probabilities'])
+    if not np.all(np.isfinite(minutes)) or minutes.min() < 1 or minutes.max() > 24 * 60:
+        raise BundleError(f"Canary durations out of range ({minutes.min():.0f}-{minutes.max():.0f} min)")
+    if not np.all(np.isfinite(probabilities)) or np.abs(probabilities.sum(axis=1) - 1).max() > 1e-3:
+        raise BundleError("Canary destination probabilities do not sum to 1")
+    n_clusters = probabilities.shape[1]
+    if new['clusters'].min() < 0 or new['clusters'].max() >= n_clusters:
+        raise BundleError(f"Canary cluster ids outside the destination model's {n_clusters} classes")
+    if old is not None and max_drift is not None:
+        drift = float(np.median(np.abs(np.log(minutes / np.asarray(old['duration_minutes'], dtype=float)))))
+        if drift > max_drift:
+            raise BundleError(f"Canary durations moved too far from the active model (median |log ratio| {drift:.2f})")
+
+# --- HOT RELOAD ---
+class ModelReloader:
+    """Watch bundles/CURRENT and swap in new model versions without a restart.
+
+    A daemon thread polls the pointer every `interval` seconds. When it names
+    a new version, the thread verifies the bundle, builds and warms a fresh
+    model set with `load(version, path)`, runs `validate(models)` and only
+    then calls `swap(models)`. Serving threads never wait on any of this. A
+    version that fails is not retried until CURRENT changes again.
+    """
+
+    def __init__(self, bundles_dir, load, validate, swap, active_version=None, interval=5.0):
+        self.bundles_dir = bundles_dir
+        self.load = load
+        self.validate = validate
+        self.swap = swap
+        self.active_version = active_version
+        self.interval = interval
+        self.loaded_at = time.time()
+        self.last_error = None
+        self._failed_version = None
+        self._lock = threading.Lock()
+        self._pid = None
+        self.counts = {'success': 0, 'failed': 0, 'rejected': 0}
+
+    def start(self):
+        """Start the watcher in this process (again after a fork); cheap to call per request"""
+        if self._pid == os.getpid() or not self.interval:
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name='model-reloader', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.poll()
+
+    def poll(self):
+        version = read_current(self.bundles_dir)
+        if version and version != self.active_version and version != self._failed_version:
+            self.reload(version)
+
+    def reload(self, version):
+        """Load, validate and swap in one version; returns whether it went live"""
+        started = time.perf_counter()
+        try:
+            verify_bundle(self.bundles_dir, version)
+            models = self.load(version, bundle_path(self.bundles_dir, version))
+        except Exception as e:
+            return self._failed(version, 'failed', e)
+        try:
+            self.validate(models)
+        except Exception as e:
+            return self._failed(version, 'rejected', e)
+        self.swap(models)
+        self.active_version = version
+        self.loaded_at = time.time()
+        self.last_error = None
+        self.counts['success'] += 1
+        print(f"Model version {version} live after {time.perf_counter() - started:.2f}s")
+        return True
+
+    def _failed(self, version, result, error):
+        self._failed_version = version
+        self.last_error = f"{version}: {error}"
+        self.counts[result] += 1
+        print(f"WARNING: model version {version} {result}: {error}")
+        return False
+
+    def stats(self):
+        return {
+            'version': self.active_version,
+            'loaded_at': self.loaded_at,
+            'last_error': self.last_error,
+            'available': list_bundles(self.bundles_dir),
+            **self.counts
+        }
+
+def render_metrics(reloader):
+    """Prometheus exposition lines for a ModelReloader"""
+    lines = ['# HELP taxi_model_info Active model version',
+             '# TYPE taxi_model_info gauge',
+             f'taxi_model_info{{version="{reloader.active_version}"}} 1',
+             '# HELP taxi_model_loaded_timestamp_seconds When the active model version went live',
+             '# TYPE taxi_model_loaded_timestamp_seconds gauge',
+             f'taxi_model_loaded_timestamp_seconds {reloader.loaded_at:.3f}',
+             '# HELP taxi_model_reloads_total Model version reloads by result',
+             '# TYPE taxi_model_reloads_total counter']
+    for result in ['success', 'failed', 'rejected']:
+        lines.append(f'taxi_model_reloads_total{{result="{result}"}} {reloader.counts[result]}')
+    return lines
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Versioned model bundles for hot reload")
+    parser.add_argument('--model-path', default='models/')
+    parser.add_argument('--bundles-dir', default=None, help="default: <model-path>/bundles/")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('create', help="bundle the model files currently in --model-path")
+    p.add_argument('--version', default=None, help="default: a timestamp")
+    p.add_argument('--cluster-names', default=None, help="JSON file of {cluster id: {name, type, color, description}}")
+    p.add_argument('--activate', action='store_true', help="point CURRENT at the new bundle")
+    p = sub.add_parser('activate', help="point CURRENT at an existing bundle (rollouts and rollbacks)")
+    p.add_argument('version')
+    p = sub.add_parser('verify', help="check a bundle's files against its manifest")
+    p.add_argument('version')
+    sub.add_parser('list', help="list bundles and the active one")
+
+    args = parser.parse_args()
+    bundles_dir = args.bundles_dir or args.model_path + BUNDLES_DIR
+    if args.command == 'create':
+        names = None
+        if args.cluster_names:
+            with open(args.cluster_names) as f:
+                names = json.load(f)
+        version = create_bundle(args.model_path, bundles_dir, args.version, names)
+        print(f"Created bundle {version} in {bundles_dir}")
+        if args.activate:
+            activate(bundles_dir, version)
+            print(f"CURRENT -> {version}")
+    elif args.command == 'activate':
+        activate(bundles_dir, args.version)
+        print(f"CURRENT -> {args.version}")
+    elif args.command == 'verify':
+        manifest = verify_bundle(bundles_dir, args.version)
+        print(f"Bundle {args.version}: {len(manifest['files'])} files OK")
+    else:
+        current = read_current(bundles_dir)
+        for version in list_bundles(bundles_dir):
+            print(f"{'*' if version == current else ' '} {version}")
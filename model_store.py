@@ -0,0 +1,260 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from cluster_index import ClusterIndex, NYC_BOUNDS, CELL_DEG
+from tree_arrays import TreeArrays
+
+NATIVE_DIR = 'native/'
+MANIFEST_FILE = 'manifest.json'
+# Pickled artifacts written by the training notebook
+SOURCE_FILES = {
+    'duration': 'xgb_problem1_final.pkl',
+    'duration_features': 'features_problem1_final.pkl',
+    'destination': 'lgbm_destination_prediction.pkl',
+    'destination_features': 'features_problem2_final.pkl',
+    'kmeans': 'kmeans_pickup.pkl'
+}
+
+def file_stamp(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+# --- EXPORT ---
+def export_native(model_path='models/'):
+    """Write the pickled models in native formats plus a manifest under models/native/.
+
+    XGBoost goes to UBJSON, LightGBM to its model text (which keeps the pandas
+    categories), and the KMeans centroids and the precomputed cluster raster
+    to .npy files that load with mmap. Both ensembles are also flattened to
+    node arrays for the NumPy evaluator. Feature lists live in the manifest.
+    """
+    import joblib
+
+    out = model_path + NATIVE_DIR
+    os.makedirs(out, exist_ok=True)
+
+    xgb_model = joblib.load(model_path + SOURCE_FILES['duration'])
+    booster = xgb_model.get_booster() if hasattr(xgb_model, 'get_booster') else xgb_model
+    booster.save_model(out + 'duration.ubj')
+    missing = getattr(xgb_model, 'missing', np.nan)
+
+    lgb_booster = joblib.load(model_path + SOURCE_FILES['destination'])
+    lgb_booster.save_model(out + 'destination.txt')
+    TreeArrays.from_xgboost(booster, missing).save(out + 'duration_arrays.npz')
+    TreeArrays.from_lightgbm(lgb_booster).save(out + 'destination_arrays.npz')
+
+    centroids = np.ascontiguousarray(joblib.load(model_path + SOURCE_FILES['kmeans']).cluster_centers_, dtype=np.float64)
+    np.save(out + 'centroids.npy', centroids)
+    np.save(out + 'cluster_raster.npy', ClusterIndex(centroids).raster)
+
+    manifest = {
+        'duration': {
+            'file': 'duration.ubj',
+            'arrays': 'duration_arrays.npz',
+            'features': list(joblib.load(model_path + SOURCE_FILES['duration_features'])),
+            'missing': None if np.isnan(missing) else float(missing)
+        },
+        'destination': {
+            'file': 'destination.txt',
+            'arrays': 'destination_arrays.npz',
+            'features': list(joblib.load(model_path + SOURCE_FILES['destination_features']))
+        },
+        'clusters': {
+            'centroids': 'centroids.npy',
+            'raster': 'cluster_raster.npy',
+            'bounds': list(NYC_BOUNDS),
+            'cell_deg': CELL_DEG
+        },
+        'sources': {name: file_stamp(model_path + f) for name, f in SOURCE_FILES.items()}
+    }
+    with open(out + MANIFEST_FILE, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def read_manifest(model_path='models/'):
+    """The native manifest, or None if there is none or the pickles changed since the export"""
+    path = model_path + NATIVE_DIR + MANIFEST_FILE
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        manifest = json.load(f)
+    for name, stamp in manifest['sources'].items():
+        source = model_path + SOURCE_FILES[name]
+        # Native-only deployments ship without the pickles
+        if os.path.exists(source) and file_stamp(source) != stamp:
+            print(f"WARNING: {source} changed since the native export, ignoring {model_path + NATIVE_DIR}")
+            return None
+    return manifest
+
+# --- LOADERS ---
+# Each returns the model object and its feature list. Heavy libraries are
+# imported inside the loaders so lazily loaded groups also defer the import.
+def load_duration_model(model_path, manifest=None):
+    if manifest is None:
+        import joblib
+        return (joblib.load(model_path + SOURCE_FILES['duration']),
+                joblib.load(model_path + SOURCE_FILES['duration_features']))
+    import xgboost as xgb
+    booster = xgb.Booster()
+    booster.load_model(model_path + NATIVE_DIR + manifest['duration']['file'])
+    return booster, manifest['duration']['features']
+
+def duration_missing(manifest):
+    value = manifest['duration']['missing'] if manifest else None
+    return np.nan if value is None else value
+
+def load_destination_model(model_path, manifest=None):
+    if manifest is None:
+        import joblib
+        return (joblib.load(model_path + SOURCE_FILES['destination']),
+                joblib.load(model_path + SOURCE_FILES['destination_features']))
+    import lightgbm as lgb
+    booster = lgb.Booster(model_file=model_path + NATIVE_DIR + manifest['destination']['file'])
+    return booster, manifest['destination']['features']
+
+def load_tree_arrays(model_path, manifest, name):
+    """Flattened 'duration' or 'destination' ensemble for the NumPy evaluator; needs a native export"""
+    if manifest is None or 'arrays' not in manifest[name]:
+        raise FileNotFoundError(f"No tree arrays in {model_path + NATIVE_DIR}; run 'python model_store.py export'")
+    return TreeArrays.load(model_path + NATIVE_DIR + manifest[name]['arrays']), manifest[name]['features']
+
+def load_cluster_index(model_path, manifest=None):
+    if manifest is None:
+        import joblib
+        return ClusterIndex.from_kmeans(joblib.load(model_path + SOURCE_FILES['kmeans']))
+    clusters = manifest['clusters']
+    centroids = np.load(model_path + NATIVE_DIR + clusters['centroids'])
+    raster = None
+    if tuple(clusters['bounds']) == NYC_BOUNDS and clusters['cell_deg'] == CELL_DEG:
+        raster = np.load(model_path + NATIVE_DIR + clusters['raster'], mmap_mode='r')
+    return ClusterIndex(centroids, raster=raster)
+
+class LazyModels(dict):
+    """Model dict whose entries are filled in by group loaders.
+
+    Each group (e.g. the duration model with its feature layout and predict
+    function) declares the keys it provides. Looking up one of those keys
+    before the group is loaded runs its loader once, under a lock, and adds
+    all of its entries. `load_all` loads every group up front, optionally in
+    parallel threads (native model parsing releases the GIL). `version` and
+    `model_path` identify where the set was loaded from.
+    """
+
+    def __init__(self, version=None, model_path=None):
+        super().__init__()
+        self.version = version
+        self.model_path = model_path
+        self._loaders = {}
+        self._providers = {}
+        self._loaded = set()
+        self._lock = threading.RLock()
+        self.load_seconds = {}
+
+    def register(self, group, keys, loader):
+        self._loaders[group] = loader
+        for key in keys:
+            self._providers[key] = group
+
+    def load(self, group):
+        if group in self._loaded:
+            return
+        with self._lock:
+            if group in self._loaded:
+                return
+            started = time.perf_counter()
+            self.update(self._loaders[group]())
+            self.load_seconds[group] = time.perf_counter() - started
+            self._loaded.add(group)
+
+    def load_all(self, parallel=False):
+        if parallel:
+            # Loaders are independent; their entries are merged on this thread
+            with ThreadPoolExecutor(len(self._loaders)) as pool:
+                results = dict(zip(self._loaders, pool.map(self._run_loader, self._loaders)))
+            for group, (entries, seconds) in results.items():
+                self.update(entries)
+                self.load_seconds[group] = seconds
+                self._loaded.add(group)
+        else:
+            for group in self._loaders:
+                self.load(group)
+
+    def _run_loader(self, group):
+        started = time.perf_counter()
+        entries = self._loaders[group]()
+        return entries, time.perf_counter() - started
+
+    def __missing__(self, key):
+        group = self._providers.get(key)
+        if group is None or group in self._loaded:
+            raise KeyError(key)
+        self.load(group)
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        group = self._providers.get(key)
+        if group is not None and group not in self._loaded:
+            self.load(group)
+        return super().get(key, default)
+
+    def loaded_groups(self):
+        return sorted(self._loaded)
+
+# --- STARTUP BENCHMARK ---
+STARTUP_PROBE = """
+import time, json
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+client = app.app.test_client()
+r = client.post('/api/predict_duration', json={'pickup_lat': 40.758, 'pickup_lon': -73.9855,
+    'dropoff_lat': 40.7484, 'dropoff_lon': -73.9857, 'datetime': '2016-03-14T08:30', 'passengers': 1})
+assert r.status_code == 200, r.data
+t2 = time.perf_counter()
+print('STARTUP ' + json.dumps({'import': t1 - t0, 'first_request': t2 - t1}))
+"""
+
+def bench_startup(runs=3):
+    """Time `import app` and the first prediction in fresh interpreters for each loading mode"""
+    configs = [
+        ('joblib / eager', {'MODEL_FORMAT': 'joblib', 'MODEL_LOADING': 'eager'}),
+        ('native / eager', {'MODEL_FORMAT': 'native', 'MODEL_LOADING': 'eager'}),
+        ('native / parallel', {'MODEL_FORMAT': 'native', 'MODEL_LOADING': 'parallel'}),
+        ('native / lazy', {'MODEL_FORMAT': 'native', 'MODEL_LOADING': 'lazy'})
+    ]
+    here = os.path.dirname(os.path.abspath(__file__))
+    for label, env in configs:
+        samples = []
+        for _ in range(runs):
+            out = subprocess.run([sys.executable, '-c', STARTUP_PROBE], cwd=here, env={**os.environ, **env},
+                                 capture_output=True, text=True, check=True).stdout
+            samples.append(json.loads(out.split('STARTUP ', 1)[1]))
+        boot = statistics.median(s['import'] for s in samples)
+        first = statistics.median(s['first_request'] for s in samples)
+        print(f"{label:18s}: import app {boot * 1e3:7.0f} ms | first request {first * 1e3:6.1f} ms | total {(boot + first) * 1e3:7.0f} ms")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Native model export and startup benchmark")
+    parser.add_argument('command', choices=['export', 'bench'])
+    parser.add_argument('--model-path', default='models/')
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        t0 = time.perf_counter()
+        manifest = export_native(args.model_path)
+        out = args.model_path + NATIVE_DIR
+        for name in sorted(os.listdir(out)):
+            print(f"  {name:22s} {os.path.getsize(out + name) / 1e3:9.1f} KB")
+        print(f"Exported to {out} in {time.perf_counter() - t0:.1f}s")
+    else:
+        bench_startup(args.runs)
@@ -0,0 +1,245 @@
+import argparse
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from features import METERS_PER_DEGREE, REFERENCE_LAT
+
+class LocalBackend:
+    """In-process stand-in for a shared cache server, with the same interface as RedisBackend"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        with self._lock:
+            entries = [self._data.get(k) for k in keys]
+        return [value if value is not None and expires_at > now else None
+                for expires_at, value in (e or (0, None) for e in entries)]
+
+    def set_many(self, items, ttl):
+        expires_at = time.monotonic() + ttl
+        with self._lock:
+            for key, value in items.items():
+                self._data[key] = (expires_at, value)
+
+class RedisBackend:
+    """Predictions shared between workers and hosts through Redis (needs the `redis` package)"""
+
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url, socket_timeout=0.05, socket_connect_timeout=0.2)
+
+    def get_many(self, keys):
+        return [float(v) if v is not None else None for v in self.client.mget(keys)]
+
+    def set_many(self, items, ttl):
+        pipe = self.client.pipeline(transaction=False)
+        for key, value in items.items():
+            pipe.setex(key, int(ttl), repr(float(value)))
+        pipe.execute()
+
+def make_backend(spec):
+    """'' -> no shared tier, 'local' -> LocalBackend, redis://... -> RedisBackend"""
+    if not spec:
+        return None
+    if spec == 'local':
+        return LocalBackend()
+    return RedisBackend(spec)
+
+class PredictionCache:
+    """LRU of model outputs keyed on snapped trip inputs, with an optional shared tier.
+
+    Pickup and dropoff are snapped to a grid of `grid_m` metres, so repeated
+    trips between the same corners in the same hour bucket share one entry;
+    every trip in a cell gets the prediction of the first one seen there.
+    Lookups try the local LRU, then the shared backend (so workers can reuse
+    each other's results), and a backend failure only counts as a miss.
+    `namespace` prefixes shared keys and should change with the model;
+    `name` labels the metrics.
+    """
+
+    def __init__(self, grid_m=50.0, size=65536, backend=None, name='duration', namespace=None, shared_ttl=86400,
+                 retry_after=30.0):
+        self.name = name
+        self.grid_m = grid_m
+        self.lat_step = grid_m / METERS_PER_DEGREE
+        self.lon_step = grid_m / (METERS_PER_DEGREE * math.cos(math.radians(REFERENCE_LAT)))
+        self.size = size
+        self.backend = backend
+        self.namespace = namespace or name
+        self.shared_ttl = shared_ttl
+        self.retry_after = retry_after
+        self._backend_down_until = 0.0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.counts = {'hit': 0, 'shared_hit': 0, 'miss': 0, 'eviction': 0, 'shared_error': 0}
+
+    def key(self, p_lat, p_lon, d_lat, d_lon, hour, weekday, month, passengers):
+        return (round(p_lat / self.lat_step), round(p_lon / self.lon_step),
+                round(d_lat / self.lat_step), round(d_lon / self.lon_step),
+                int(hour), int(weekday), int(month), int(passengers))
+
+    def shared_key(self, key):
+        return f'{self.namespace}:' + ':'.join(map(str, key))
+
+    def get(self, key):
+        """Cached value for a key, or None (counted as a miss)"""
+        with self._lock:
+            value = self._cache.get(key)
+            if value is not None:
+                self._cache.move_to_end(key)
+                self.counts['hit'] += 1
+                return value
+        if self.backend is not None and time.monotonic() >= self._backend_down_until:
+            try:
+                value = self.backend.get_many([self.shared_key(key)])[0]
+            except Exception:
+                self._backend_failed()
+                value = None
+            if value is not None:
+                self._store(key, value)
+                self._count('shared_hit')
+                return value
+        self._count('miss')
+        return None
+
+    def put(self, key, value):
+        self._store(key, value)
+        if self.backend is not None and time.monotonic() >= self._backend_down_until:
+            try:
+                self.backend.set_many({self.shared_key(key): value}, self.shared_ttl)
+            except Exception:
+                self._backend_failed()
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def _store(self, key, value):
+        with self._lock:
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.size:
+                self._cache.popitem(last=False)
+                self.counts['eviction'] += 1
+
+    def _backend_failed(self):
+        # Skip the shared tier for a while rather than paying its timeout on every request
+        with self._lock:
+            self.counts['shared_error'] += 1
+            self._backend_down_until = time.monotonic() + self.retry_after
+
+    def _count(self, key):
+        with self._lock:
+            self.counts[key] += 1
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'cache_size': len(self._cache), 'cache_capacity': self.size, **self.counts}
+
+def render_metrics(cache):
+    """Prometheus exposition lines for a PredictionCache"""
+    stats = cache.stats()
+    lines = ['# HELP taxi_prediction_cache_lookups_total Prediction cache lookups by result',
+             '# TYPE taxi_prediction_cache_lookups_total counter']
+    for result in ['hit', 'shared_hit', 'miss']:
+        lines.append(f'taxi_prediction_cache_lookups_total{{cache="{cache.name}",result="{result}"}} {stats[result]}')
+    lines += ['# HELP taxi_prediction_cache_evictions_total Entries evicted from the local LRU',
+              '# TYPE taxi_prediction_cache_evictions_total counter',
+              f'taxi_prediction_cache_evictions_total{{cache="{cache.name}"}} {stats["eviction"]}',
+              '# HELP taxi_prediction_cache_shared_errors_total Failed calls to the shared cache backend',
+              '# TYPE taxi_prediction_cache_shared_errors_total counter',
+              f'taxi_prediction_cache_shared_errors_total{{cache="{cache.name}"}} {stats["shared_error"]}',
+              '# HELP taxi_prediction_cache_entries Entries in the local LRU',
+              '# TYPE taxi_prediction_cache_entries gauge',
+              f'taxi_prediction_cache_entries{{cache="{cache.name}"}} {stats["cache_size"]}']
+    return lines
+
+# --- CHECKS & BENCHMARK ---
+def verify():
+    """Check snapping, LRU eviction, counters and sharing through the local backend"""
+    cache = PredictionCache(grid_m=50, size=2)
+    base = cache.key(40.7580, -73.9855, 40.7484, -73.9857, 8, 0, 3, 1)
+    assert cache.key(40.75805, -73.98555, 40.74845, -73.98565, 8, 0, 3, 1) == base, "Points 6 m apart should share a cell"
+    assert cache.key(40.7590, -73.9855, 40.7484, -73.9857, 8, 0, 3, 1) != base, "Points 110 m apart should not"
+    assert cache.key(40.7580, -73.9855, 40.7484, -73.9857, 9, 0, 3, 1) != base, "Hour is part of the key"
+
+    calls = []
+    compute = lambda: calls.append(1) or 2.5
+    assert cache.get_or_compute(base, compute) == 2.5 and cache.get_or_compute(base, compute) == 2.5
+    assert len(calls) == 1
+    cache.put(('a',), 1.0)
+    cache.put(('b',), 2.0)
+    assert cache.get(base) is None, "Least recently used entry should have been evicted"
+    stats = cache.stats()
+    assert (stats['hit'], stats['miss'], stats['eviction'], stats['cache_size']) == (1, 2, 1, 2), stats
+    print("Local LRU: 50 m snapping, hit/miss/eviction counts OK")
+
+    shared = LocalBackend()
+    worker_a = PredictionCache(backend=shared)
+    worker_b = PredictionCache(backend=shared)
+    worker_a.put(base, 2.5)
+    assert worker_b.get(base) == 2.5 and worker_b.get(base) == 2.5
+    assert worker_b.stats()['shared_hit'] == 1 and worker_b.stats()['hit'] == 1
+    print("Shared backend: a value computed in one worker is a hit in another")
+
+    class Down:
+        def get_many(self, keys):
+            raise ConnectionError('down')
+        set_many = get_many
+
+    flaky = PredictionCache(backend=Down(), retry_after=60)
+    assert flaky.get_or_compute(base, lambda: 1.5) == 1.5 and flaky.get(base) == 1.5
+    assert flaky.stats()['shared_error'] == 1, "A failing backend should be skipped after the first error"
+    print("Backend failure: served from the model and the local LRU, backend skipped for retry_after")
+
+def bench(n=5000, distinct=500):
+    """Single-trip /api/predict_duration latency with and without the cache on repetitive traffic"""
+    import app
+    from serving import sample_trips
+
+    trips = sample_trips(distinct)
+    order = np.random.default_rng(1).integers(0, distinct, n)
+    client = app.app.test_client()
+
+    def run(label):
+        timings = []
+        for i in order:
+            t0 = time.perf_counter()
+            client.post('/api/predict_duration', json=trips[i])
+            timings.append(time.perf_counter() - t0)
+        p50, p99 = np.percentile(np.array(timings) * 1e3, [50, 99])
+        print(f"{label:10s}: p50 {p50:6.3f} ms | p99 {p99:6.3f} ms")
+
+    previous = app.duration_cache
+    try:
+        app.duration_cache = None
+        run('no cache')
+        app.duration_cache = PredictionCache()
+        run('cache')
+        print(f"Cache stats: {app.duration_cache.stats()}")
+    finally:
+        app.duration_cache = previous
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Prediction cache keyed on snapped trip inputs")
+    parser.add_argument('command', choices=['verify', 'bench'])
+    args = parser.parse_args()
+
+    if args.command == 'verify':
+        verify()
+    else:
+        bench()
@@ -0,0 +1,309 @@
+import argparse
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+OSRM_URL = 'https://router.project-osrm.org'
+USER_AGENT = 'NYC-Taxi-App/1.0'
+
+class RouteNotFound(Exception):
+    """OSRM answered but has no route between the two points"""
+
+class RouterBusy(Exception):
+    """All upstream slots are taken; the caller should retry later"""
+
+class RoutingError(Exception):
+    """The OSRM server could not be reached or returned garbage"""
+
+class RoutingClient:
+    """OSRM route lookups through a pooled session, a TTL cache and a concurrency cap.
+
+    Coordinates are rounded to `precision` decimals (4 ~ 11 m) before the
+    lookup, so repeated requests for the same street corner share one cache
+    entry. Identical lookups already in flight wait for the first one instead
+    of calling OSRM again. At most `max_concurrent` upstream calls run at
+    once; beyond that `route` raises RouterBusy immediately rather than
+    tying up a worker thread behind a slow server.
+    """
+
+    def __init__(self, base_url=OSRM_URL, cache_size=2048, ttl=3600.0, precision=4,
+                 max_concurrent=8, timeout=5.0):
+        self.base_url = base_url.rstrip('/')
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.precision = precision
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrent, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._cache = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.counts = {'hit': 0, 'coalesced': 0, 'upstream': 0, 'not_found': 0, 'busy': 0, 'error': 0}
+
+    def key(self, p_lat, p_lon, d_lat, d_lon):
+        return tuple(round(float(v), self.precision) for v in (p_lat, p_lon, d_lat, d_lon))
+
+    def _cached(self, key):
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at < time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return entry
+
+    def route(self, p_lat, p_lon, d_lat, d_lon):
+        """Route geometry, distance (m) and duration (s) between two points"""
+        key = self.key(p_lat, p_lon, d_lat, d_lon)
+        with self._lock:
+            entry = self._cached(key)
+            if entry is not None:
+                self.counts['hit'] += 1
+                return self._unwrap(entry[1])
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+            else:
+                self.counts['coalesced'] += 1
+
+        if not leader:
+            try:
+                return self._unwrap(future.result(timeout=self.timeout + 1))
+            except FutureTimeout:
+                self._count('error')
+                raise RoutingError('Timed out waiting for an identical routing request already in flight')
+
+        try:
+            result = self._fetch(key)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return self._unwrap(result)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def _unwrap(self, result):
+        if result is None:
+            raise RouteNotFound('No route found')
+        return result
+
+    def _fetch(self, key):
+        """Call OSRM for a quantized key; returns None for 'no route', which is cached too"""
+        if not self._slots.acquire(blocking=False):
+            self._count('busy')
+            raise RouterBusy(f'{self.max_concurrent} routing requests already in flight')
+        try:
+            p_lat, p_lon, d_lat, d_lon = key
+            url = f'{self.base_url}/route/v1/driving/{p_lon},{p_lat};{d_lon},{d_lat}'
+            response = self.session.get(url, params={'overview': 'full', 'geometries': 'geojson'},
+                                        timeout=self.timeout)
+            data = response.json()
+        except (requests.RequestException, ValueError) as e:
+            self._count('error')
+            raise RoutingError(str(e)) from e
+        finally:
+            self._slots.release()
+
+        if data.get('code') == 'Ok' and data.get('routes'):
+            route = data['routes'][0]
+            result = {'geometry': route['geometry'], 'distance': route['distance'], 'duration': route['duration']}
+            self._count('upstream')
+        elif data.get('code') in ('NoRoute', 'NoSegment'):
+            result = None
+            self._count('not_found')
+        else:
+            self._count('error')
+            raise RoutingError(data.get('message') or f"OSRM returned {data.get('code')!r}")
+
+        with self._lock:
+            self._cache[key] = (time.monotonic() + self.ttl, result)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def _count(self, key):
+        with self._lock:
+            self.counts[key] += 1
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'cache_size': len(self._cache),
+                'cache_capacity': self.cache_size,
+                'in_flight': len(self._inflight),
+                'max_concurrent': self.max_concurrent,
+                **self.counts
+            }
+
+def render_metrics(client):
+    """Prometheus exposition lines for a RoutingClient"""
+    stats = client.stats()
+    lines = ['# HELP taxi_route_lookups_total Route lookups by how they were answered',
+             '# TYPE taxi_route_lookups_total counter']
+    for source in ['hit', 'coalesced', 'upstream', 'not_found', 'busy', 'error']:
+        lines.append(f'taxi_route_lookups_total{{source="{source}"}} {stats[source]}')
+    lines += ['# HELP taxi_route_in_flight Distinct route lookups waiting on OSRM',
+              '# TYPE taxi_route_in_flight gauge',
+              f'taxi_route_in_flight {stats["in_flight"]}',
+              '# HELP taxi_route_cache_entries Cached routes',
+              '# TYPE taxi_route_cache_entries gauge',
+              f'taxi_route_cache_entries {stats["cache_size"]}']
+    return lines
+
+# --- CHECKS & BENCHMARK ---
+def start_stub_osrm(delay=0.0):
+    """Local OSRM stand-in on an ephemeral port; returns (server, base url, request log).
+
+    Routes whose start longitude is exactly 0 come back as NoRoute.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import urlsplit
+
+    seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            coords = urlsplit(self.path).path.rsplit('/', 1)[-1]
+            seen.append(coords)
+            time.sleep(delay)
+            (p_lon, p_lat), (d_lon, d_lat) = [map(float, c.split(',')) for c in coords.split(';')]
+            if p_lon == 0:
+                data = {'code': 'NoRoute', 'message': 'Impossible route between points'}
+            else:
+                data = {'code': 'Ok', 'routes': [{
+                    'geometry': {'type': 'LineString', 'coordinates': [[p_lon, p_lat], [d_lon, d_lat]]},
+                    'distance': 1234.5,
+                    'duration': 321.0
+                }]}
+            body = json.dumps(data).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}', seen
+
+def verify():
+    """Check caching, quantization, TTL, coalescing and fail-fast against a local stub OSRM"""
+    server, url, seen = start_stub_osrm()
+    try:
+        client = RoutingClient(url, ttl=0.2)
+        first = client.route(40.758, -73.9855, 40.7484, -73.9857)
+        assert first['geometry']['coordinates'][0] == [-73.9855, 40.758]
+        client.route(40.75801, -73.98552, 40.74838, -73.98571)
+        assert len(seen) == 1, "Nearby coordinates should share one cache entry"
+        time.sleep(0.25)
+        client.route(40.758, -73.9855, 40.7484, -73.9857)
+        assert len(seen) == 2, "Expired entry was not refreshed"
+        for _ in range(2):
+            try:
+                client.route(40.7, 0.0, 40.7, -73.9)
+                raise AssertionError("NoRoute not reported")
+            except RouteNotFound:
+                pass
+        assert len(seen) == 3, "NoRoute answers should be cached"
+    finally:
+        server.shutdown()
+    print("Cache: quantized keys, TTL expiry and NoRoute caching OK")
+
+    server, url, seen = start_stub_osrm(delay=0.2)
+    try:
+        client = RoutingClient(url, max_concurrent=2)
+        with ThreadPoolExecutor(16) as pool:
+            results = list(pool.map(lambda _: client.route(40.7, -73.9, 40.8, -73.95), range(16)))
+        assert len(seen) == 1 and all(r == results[0] for r in results), f"{len(seen)} upstream calls for 16 identical lookups"
+        print(f"Coalescing: 16 concurrent identical lookups -> {len(seen)} upstream call")
+
+        def timed(i):
+            t0 = time.perf_counter()
+            try:
+                client.route(40.6 + i / 100, -73.9, 40.8, -73.95)
+                return 'ok', time.perf_counter() - t0
+            except RouterBusy:
+                return 'busy', time.perf_counter() - t0
+
+        with ThreadPoolExecutor(6) as pool:
+            outcomes = list(pool.map(timed, range(6)))
+        busy = [t for status, t in outcomes if status == 'busy']
+        assert sum(status == 'ok' for status, _ in outcomes) == 2 and len(busy) == 4, outcomes
+        assert max(busy) < 0.1, "Saturated client must fail fast"
+        print(f"Concurrency cap: 2 served, 4 rejected in {max(busy) * 1e3:.1f} ms")
+    finally:
+        server.shutdown()
+
+    # A follower whose leader never finishes gives up with a RoutingError, not a bare TimeoutError
+    client = RoutingClient(url, timeout=0.05)
+    client._inflight[client.key(40.7, -73.9, 40.8, -73.95)] = Future()
+    try:
+        client.route(40.7, -73.9, 40.8, -73.95)
+        raise AssertionError("A stuck in-flight lookup was not reported")
+    except RoutingError:
+        pass
+    print("Coalescing timeout: reported as RoutingError (502)")
+
+def bench(n=300):
+    """Compare a fresh connection per call (the old behaviour) with the pooled, cached client"""
+    server, url, seen = start_stub_osrm()
+    rng = np.random.default_rng(0)
+    points = np.column_stack([rng.uniform(40.6, 40.85, n), rng.uniform(-74.02, -73.78, n),
+                              rng.uniform(40.6, 40.85, n), rng.uniform(-74.02, -73.78, n)])
+    try:
+        def run(label, fn):
+            timings = []
+            for p_lat, p_lon, d_lat, d_lon in points:
+                t0 = time.perf_counter()
+                fn(p_lat, p_lon, d_lat, d_lon)
+                timings.append(time.perf_counter() - t0)
+            p50, p99 = np.percentile(np.array(timings) * 1e3, [50, 99])
+            print(f"{label:18s}: p50 {p50:6.2f} ms | p99 {p99:6.2f} ms")
+
+        def fresh(p_lat, p_lon, d_lat, d_lon):
+            requests.get(f'{url}/route/v1/driving/{p_lon},{p_lat};{d_lon},{d_lat}?overview=full&geometries=geojson',
+                         timeout=10).json()
+
+        client = RoutingClient(url)
+        run('new connection', fresh)
+        run('pooled (miss)', client.route)
+        run('cached (hit)', client.route)
+    finally:
+        server.shutdown()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Pooled, cached OSRM client for /api/route")
+    parser.add_argument('command', choices=['verify', 'bench'])
+    args = parser.parse_args()
+
+    if args.command == 'verify':
+        verify()
+    else:
+        bench()
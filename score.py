@@ -0,0 +1,277 @@
+import argparse
+import os
+import resource
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from features import (
+    parse_datetimes, duration_features, destination_features, destination_default, FeatureLayout,
+    booster_categories, xgb_fast_predict, lgb_fast_predict, DURATION_FEATURE_NAMES, DESTINATION_FEATURE_NAMES
+)
+from destination_table import DestinationTable
+from model_store import read_manifest, load_duration_model, duration_missing, load_destination_model, load_cluster_index
+
+# Input columns, by the names used in the Kaggle train/test files and in the API
+COLUMN_ALIASES = {
+    'pickup_lat': ['pickup_latitude', 'pickup_lat'],
+    'pickup_lon': ['pickup_longitude', 'pickup_lon'],
+    'dropoff_lat': ['dropoff_latitude', 'dropoff_lat'],
+    'dropoff_lon': ['dropoff_longitude', 'dropoff_lon'],
+    'datetime': ['pickup_datetime', 'datetime'],
+    'passengers': ['passenger_count', 'passengers']
+}
+REQUIRED = {
+    'duration': ['pickup_lat', 'pickup_lon', 'dropoff_lat', 'dropoff_lon', 'datetime'],
+    'destination': ['pickup_lat', 'pickup_lon', 'datetime']
+}
+
+def resolve_columns(available):
+    """Map canonical input names to the columns present in a file"""
+    columns = {}
+    for name, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in available:
+                columns[name] = alias
+                break
+    return columns
+
+class TripScorer:
+    """The API's duration and destination prediction paths over DataFrame chunks"""
+
+    def __init__(self, model_path='models/', tasks=('duration', 'destination'), destination_mode='table'):
+        manifest = read_manifest(model_path)
+        self.tasks = tuple(tasks)
+        self.cluster_index = load_cluster_index(model_path, manifest)
+        if 'duration' in self.tasks:
+            model, feat_duration = load_duration_model(model_path, manifest)
+            self.duration_layout = FeatureLayout(feat_duration, DURATION_FEATURE_NAMES)
+            self.duration_predict = xgb_fast_predict(model, missing=duration_missing(manifest))
+        if 'destination' in self.tasks:
+            self.dest_table = DestinationTable.load(model_path) if destination_mode == 'table' else None
+            booster, feat_dest = load_destination_model(model_path, manifest)
+            self.dest_layout = FeatureLayout(
+                feat_dest, DESTINATION_FEATURE_NAMES, default=destination_default,
+                categories=booster_categories(booster, feat_dest)
+            )
+            self.dest_predict = lgb_fast_predict(booster)
+
+    def score(self, chunk, columns, id_column=None):
+        """Predictions for one chunk of trips, as a DataFrame with one row per input row"""
+        n = len(chunk)
+        p_lat = chunk[columns['pickup_lat']].to_numpy(dtype=np.float64)
+        p_lon = chunk[columns['pickup_lon']].to_numpy(dtype=np.float64)
+        passengers = (chunk[columns['passengers']].to_numpy(dtype=np.int64)
+                      if 'passengers' in columns else np.ones(n, dtype=np.int64))
+        hour, month, weekday = parse_datetimes(chunk[columns['datetime']], format=None)
+
+        out = {}
+        if id_column:
+            out[id_column] = chunk[id_column].to_numpy()
+
+        if 'duration' in self.tasks:
+            d_lat = chunk[columns['dropoff_lat']].to_numpy(dtype=np.float64)
+            d_lon = chunk[columns['dropoff_lon']].to_numpy(dtype=np.float64)
+            clusters = self.cluster_index.predict(np.column_stack([
+                np.concatenate([p_lat, d_lat]), np.concatenate([p_lon, d_lon])
+            ]))
+            p_cluster, d_cluster = clusters[:n], clusters[n:]
+            features = duration_features(p_lat, p_lon, d_lat, d_lon, hour, month, weekday, passengers, p_cluster, d_cluster)
+            log_dur = np.asarray(self.duration_predict(self.duration_layout.fill(features)))
+            out['pickup_cluster'] = p_cluster
+            out['dropoff_cluster'] = d_cluster
+            out['distance_km'] = np.round(features['distance_km'], 2)
+            out['duration_minutes'] = np.maximum(1, np.round(np.expm1(log_dur), 0)).astype(int)
+        else:
+            p_cluster = self.cluster_index.predict(np.column_stack([p_lat, p_lon]))
+            out['pickup_cluster'] = p_cluster
+
+        if 'destination' in self.tasks:
+            cached = self.dest_table.lookup_batch(
+                p_cluster, passengers, hour, weekday, month
+            ) if self.dest_table is not None else None
+            if cached is not None:
+                probabilities, top_3 = cached
+            else:
+                features = destination_features(p_cluster, passengers, hour, month, weekday)
+                probabilities = np.asarray(self.dest_predict(self.dest_layout.fill(features))).reshape(n, -1)
+                top_3 = np.argsort(probabilities, axis=1)[:, -3:][:, ::-1]
+            rows = np.arange(n)
+            for rank in range(3):
+                out[f'dest_top{rank + 1}'] = top_3[:, rank].astype(np.int64)
+                # float64 like the CSV values, so Parquet output matches it and the Spark 'double' schema
+                out[f'dest_top{rank + 1}_prob'] = np.round(probabilities[rows, top_3[:, rank]].astype(np.float64), 4)
+        return pd.DataFrame(out)
+
+# --- READERS & WRITERS ---
+def is_parquet(path):
+    return path.endswith(('.parquet', '.pq'))
+
+def read_chunks(path, chunk_size, usecols):
+    """Yield DataFrames of at most chunk_size rows, reading only the needed columns"""
+    if is_parquet(path):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=usecols):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size, usecols=usecols)
+
+def input_columns(path):
+    if is_parquet(path):
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).schema_arrow.names
+    return list(pd.read_csv(path, nrows=0).columns)
+
+def input_rows(path):
+    """Row count when it is cheap to know (Parquet metadata), else None"""
+    if is_parquet(path):
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).metadata.num_rows
+    return None
+
+class ChunkWriter:
+    """Append scored chunks to a CSV or Parquet file as they arrive"""
+
+    def __init__(self, path):
+        self.path = path
+        self._parquet = None
+        self._csv = None
+
+    def write(self, frame):
+        if is_parquet(self.path):
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self._parquet is None:
+                self._parquet = pq.ParquetWriter(self.path, table.schema)
+            self._parquet.write_table(table)
+        else:
+            if self._csv is None:
+                self._csv = open(self.path, 'w', newline='')
+                frame.to_csv(self._csv, index=False)
+            else:
+                frame.to_csv(self._csv, index=False, header=False)
+
+    def close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+        if self._csv is not None:
+            self._csv.close()
+
+# --- PROCESS POOL ---
+_worker_scorer = None
+
+def _init_worker(model_path, tasks, destination_mode):
+    global _worker_scorer
+    # One booster thread per process; the pool provides the parallelism
+    os.environ['OMP_NUM_THREADS'] = '1'
+    _worker_scorer = TripScorer(model_path, tasks, destination_mode)
+
+def _score_chunk(chunk, columns, id_column):
+    return _worker_scorer.score(chunk, columns, id_column)
+
+def score_file(input_path, output_path, model_path='models/', tasks=('duration', 'destination'),
+               chunk_size=100000, workers=None, destination_mode='table', id_column='id', progress_every=2.0):
+    """Stream input_path through the models into output_path; returns (rows, seconds)"""
+    available = input_columns(input_path)
+    columns = resolve_columns(available)
+    for task in tasks:
+        missing = [c for c in REQUIRED[task] if c not in columns]
+        if missing:
+            raise ValueError(f"{input_path} has no column for {missing} (needed for {task})")
+    id_column = id_column if id_column in available else None
+    usecols = sorted(set(columns.values()) | ({id_column} if id_column else set()))
+    total = input_rows(input_path)
+    workers = os.cpu_count() if workers is None else workers
+
+    writer = ChunkWriter(output_path)
+    started = last_report = time.perf_counter()
+    done = 0
+
+    def report(final=False):
+        elapsed = time.perf_counter() - started
+        of_total = f"/{total:,} ({done / total:.0%})" if total else ''
+        print(f"{'Done' if final else 'Scored'} {done:,}{of_total} rows in {elapsed:.1f}s | "
+              f"{done / max(elapsed, 1e-9):,.0f} rows/s", file=sys.stderr)
+
+    def collect(frame):
+        nonlocal done, last_report
+        writer.write(frame)
+        done += len(frame)
+        if time.perf_counter() - last_report >= progress_every:
+            last_report = time.perf_counter()
+            report()
+
+    try:
+        chunks = read_chunks(input_path, chunk_size, usecols)
+        if workers <= 1:
+            scorer = TripScorer(model_path, tasks, destination_mode)
+            for chunk in chunks:
+                collect(scorer.score(chunk, columns, id_column))
+        else:
+            # At most 2 chunks per worker in flight keeps memory bounded; results are written in input order
+            with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                     initargs=(model_path, tasks, destination_mode)) as pool:
+                pending = deque()
+                for chunk in chunks:
+                    pending.append(pool.submit(_score_chunk, chunk, columns, id_column))
+                    if len(pending) >= 2 * workers:
+                        collect(pending.popleft().result())
+                while pending:
+                    collect(pending.popleft().result())
+    finally:
+        writer.close()
+    report(final=True)
+    return done, time.perf_counter() - started
+
+def make_sample(path, n, seed=0):
+    """Write n synthetic trips in the Kaggle train.csv layout"""
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2016-01-01T00:00:00')
+    pickup = start + rng.integers(0, 182 * 24 * 3600, n).astype('timedelta64[s]')
+    frame = pd.DataFrame({
+        'id': [f'id{i:07d}' for i in range(n)],
+        'vendor_id': rng.integers(1, 3, n),
+        'pickup_datetime': pd.to_datetime(pickup).strftime('%Y-%m-%d %H:%M:%S'),
+        'passenger_count': rng.integers(1, 7, n),
+        'pickup_longitude': rng.uniform(-74.02, -73.77, n),
+        'pickup_latitude': rng.uniform(40.63, 40.85, n),
+        'dropoff_longitude': rng.uniform(-74.02, -73.77, n),
+        'dropoff_latitude': rng.uniform(40.63, 40.85, n),
+        'store_and_fwd_flag': 'N'
+    })
+    if is_parquet(path):
+        frame.to_parquet(path, index=False)
+    else:
+        frame.to_csv(path, index=False)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Score trip files (Kaggle CSV layout or Parquet) in bulk")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('score', help="score an input file into an output file")
+    p.add_argument('input', help=".csv or .parquet")
+    p.add_argument('output', help=".csv or .parquet")
+    p.add_argument('--predict', nargs='+', choices=['duration', 'destination'], default=['duration', 'destination'])
+    p.add_argument('--chunk-size', type=int, default=100000)
+    p.add_argument('--workers', type=int, default=None, help="processes (default: cores; 1 scores in-process)")
+    p.add_argument('--destination-mode', choices=['table', 'live'], default='table')
+    p.add_argument('--id-column', default='id')
+    p.add_argument('--model-path', default='models/')
+
+    p = sub.add_parser('sample', help="write synthetic trips in the Kaggle layout")
+    p.add_argument('output')
+    p.add_argument('--rows', type=int, default=1000000)
+
+    args = parser.parse_args()
+    if args.command == 'sample':
+        make_sample(args.output, args.rows)
+    else:
+        rows, seconds = score_file(args.input, args.output, args.model_path, args.predict, args.chunk_size,
+                                   args.workers, args.destination_mode, args.id_column)
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f"{rows:,} rows -> {args.output} ({rows / seconds:,.0f} rows/s, peak RSS {peak_mb:.0f} MB)", file=sys.stderr)
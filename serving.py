@@ -0,0 +1,152 @@
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+class InferencePool:
+    """Per-process thread pool that splits large feature blocks across cores.
+
+    XGBoost's inplace_predict and LightGBM's predict release the GIL, so
+    chunks of one block really run in parallel. The executor is created on
+    first use in each process, so a pool built before a pre-fork server
+    forks is never shared with (or inherited dead by) its workers.
+    """
+
+    def __init__(self, threads=None, min_chunk=2048):
+        self.threads = max(1, threads or os.cpu_count() or 1)
+        self.min_chunk = min_chunk
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def executor(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(self.threads, thread_name_prefix='inference')
+                    self._pid = os.getpid()
+        return self._executor
+
+    def predict(self, predict_fn, block):
+        """predict_fn(block), with blocks of at least 2 * min_chunk rows split across the pool"""
+        n_chunks = min(self.threads, len(block) // self.min_chunk)
+        if n_chunks < 2:
+            return np.asarray(predict_fn(block))
+        bounds = np.linspace(0, len(block), n_chunks + 1).astype(int)
+        chunks = [block[lo:hi] for lo, hi in zip(bounds[:-1], bounds[1:])]
+        return np.concatenate([np.asarray(r) for r in self.executor().map(predict_fn, chunks)])
+
+# --- MEASUREMENT ---
+def process_memory(pid):
+    """RSS and PSS in MB for one process (Linux). PSS splits shared pages between the processes mapping them"""
+    memory = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty'):
+                memory[key.lower()] = int(value.split()[0]) / 1024
+    return memory
+
+def child_pids(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return [int(p) for p in f.read().split()]
+
+def sample_trips(n, seed=0):
+    rng = np.random.default_rng(seed)
+    hours = rng.integers(0, 24, n)
+    return [{
+        'pickup_lat': float(rng.uniform(40.70, 40.80)), 'pickup_lon': float(rng.uniform(-74.01, -73.93)),
+        'dropoff_lat': float(rng.uniform(40.70, 40.80)), 'dropoff_lon': float(rng.uniform(-74.01, -73.93)),
+        'datetime': f'2016-03-{int(rng.integers(1, 29)):02d}T{int(h):02d}:15', 'passengers': int(rng.integers(1, 5))
+    } for h in hours]
+
+def drive_load(base_url, seconds, concurrency, batch_size=0):
+    """Hammer the duration endpoint from `concurrency` client threads; returns requests/s and trips/s"""
+    trips = sample_trips(max(batch_size, 256))
+    deadline = time.perf_counter() + seconds
+    local = threading.local()
+
+    def client(i):
+        session = getattr(local, 'session', None) or requests.Session()
+        local.session = session
+        done = errors = 0
+        while time.perf_counter() < deadline:
+            if batch_size:
+                r = session.post(f'{base_url}/api/predict_duration/batch', json={'trips': trips[:batch_size]})
+            else:
+                r = session.post(f'{base_url}/api/predict_duration', json=trips[(i + done) % len(trips)])
+            done += 1
+            errors += r.status_code != 200
+        return done, errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(client, range(concurrency)))
+    elapsed = time.perf_counter() - started
+    done = sum(d for d, _ in results)
+    return {'requests_per_s': done / elapsed, 'trips_per_s': done * max(batch_size, 1) / elapsed,
+            'errors': sum(e for _, e in results)}
+
+def wait_ready(base_url, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f'{base_url}/api/clusters', timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+    raise TimeoutError(f"{base_url} did not come up within {timeout}s")
+
+def scaling_bench(worker_counts, seconds=10, concurrency=None, batch_size=0, port=5055):
+    """Start gunicorn with each worker count, then report per-worker memory and throughput"""
+    base_url = f'http://127.0.0.1:{port}'
+    here = os.path.dirname(os.path.abspath(__file__))
+    rows = []
+    for workers in worker_counts:
+        env = {**os.environ, 'WEB_WORKERS': str(workers), 'WEB_BIND': f'127.0.0.1:{port}'}
+        server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+                                  cwd=here, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_ready(base_url)
+            load = drive_load(base_url, seconds, concurrency or 4 * workers, batch_size)
+            master = process_memory(server.pid)
+            worker_mem = [process_memory(pid) for pid in child_pids(server.pid)]
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait(timeout=30)
+        row = {
+            'workers': workers,
+            'master_rss_mb': round(master['rss'], 1),
+            'worker_rss_mb': round(float(np.mean([m['rss'] for m in worker_mem])), 1),
+            'worker_pss_mb': round(float(np.mean([m['pss'] for m in worker_mem])), 1),
+            'worker_private_mb': round(float(np.mean([m['private_clean'] + m['private_dirty'] for m in worker_mem])), 1),
+            'total_pss_mb': round(master['pss'] + sum(m['pss'] for m in worker_mem), 1),
+            **{k: round(v, 1) for k, v in load.items()}
+        }
+        rows.append(row)
+        print(f"{workers:2d} workers | RSS/worker {row['worker_rss_mb']:7.1f} MB | private/worker {row['worker_private_mb']:6.1f} MB "
+              f"| total PSS {row['total_pss_mb']:7.1f} MB | {row['requests_per_s']:8.1f} req/s | {row['trips_per_s']:9.1f} trips/s "
+              f"| {row['errors']} errors")
+    return rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure per-worker memory and throughput scaling under gunicorn")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--concurrency', type=int, default=None, help="client threads (default 4 per worker)")
+    parser.add_argument('--batch-size', type=int, default=0, help="trips per request; 0 hits the single-trip endpoint")
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    args = parser.parse_args()
+
+    results = scaling_bench(args.workers, args.seconds, args.concurrency, args.batch_size)
+    if args.json:
+        print(json.dumps(results, indent=2))
@@ -0,0 +1,201 @@
+import argparse
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from destination_table import TABLE_FILE
+from model_store import NATIVE_DIR, read_manifest
+from score import TripScorer, resolve_columns, COLUMN_ALIASES, REQUIRED
+
+# Output columns per task, as Spark DDL; pandas int64 columns map to bigint
+OUTPUT_SCHEMA = {
+    'duration': ['pickup_cluster bigint', 'dropoff_cluster bigint', 'distance_km double', 'duration_minutes bigint'],
+    'destination': ['dest_top1 bigint', 'dest_top1_prob double', 'dest_top2 bigint', 'dest_top2_prob double',
+                    'dest_top3 bigint', 'dest_top3_prob double']
+}
+PARTITION_COLUMN = 'pickup_date'
+# CSV types of the scorer's inputs, so reading a CSV needs no inference pass over the whole file.
+# Datetimes stay strings (the scorer parses both layouts), as does every column it does not read
+CSV_TYPES = {'pickup_lat': 'double', 'pickup_lon': 'double', 'dropoff_lat': 'double', 'dropoff_lon': 'double',
+             'passengers': 'int'}
+
+def local_session(app_name='NYCTaxi_Scoring', master='local[*]'):
+    """Spark session with Arrow transfers enabled, for local runs and tests"""
+    from pyspark.sql import SparkSession
+    return (SparkSession.builder
+            .master(master)
+            .appName(app_name)
+            .config('spark.sql.execution.arrow.pyspark.enabled', 'true')
+            .config('spark.sql.execution.arrow.maxRecordsPerBatch', 50000)
+            .config('spark.sql.session.timeZone', 'UTC')
+            .getOrCreate())
+
+def model_bundle(model_path='models/'):
+    """The native export plus the destination table as {relative path: bytes}, small enough to broadcast"""
+    if read_manifest(model_path) is None:
+        raise FileNotFoundError(f"No usable native export in {model_path}{NATIVE_DIR}; run 'python model_store.py export'")
+    bundle = {}
+    for name in os.listdir(model_path + NATIVE_DIR):
+        with open(model_path + NATIVE_DIR + name, 'rb') as f:
+            bundle[NATIVE_DIR + name] = f.read()
+    if os.path.exists(model_path + TABLE_FILE):
+        with open(model_path + TABLE_FILE, 'rb') as f:
+            bundle[TABLE_FILE] = f.read()
+    return bundle
+
+def bundle_digest(bundle):
+    """Content hash of a model bundle; the same models give the same key on every run"""
+    digest = hashlib.sha256()
+    for name in sorted(bundle):
+        digest.update(name.encode())
+        digest.update(bundle[name])
+    return digest.hexdigest()
+
+# One scorer per Python worker process, built from the broadcast on first use
+_scorers = {}
+
+def scorer_from_bundle(key, bundle, tasks, destination_mode):
+    scorer = _scorers.get(key)
+    if scorer is None:
+        # Kept on the scorer: removed when it is dropped, or when the worker exits
+        tmp = tempfile.TemporaryDirectory(prefix='taxi-models-')
+        model_dir = tmp.name + '/'
+        for name, data in bundle.items():
+            os.makedirs(os.path.dirname(model_dir + name), exist_ok=True)
+            with open(model_dir + name, 'wb') as f:
+                f.write(data)
+        scorer = _scorers[key] = TripScorer(model_dir, tasks, destination_mode)
+        scorer.model_dir = tmp
+    return scorer
+
+def partition_scorer(bundle_broadcast, columns, tasks, destination_mode='table', id_column=None):
+    """mapInPandas function: score each Arrow batch with the broadcast models and add the pickup date"""
+    key = (bundle_digest(bundle_broadcast.value), tuple(tasks), destination_mode)
+
+    def score_batches(batches):
+        scorer = scorer_from_bundle(key, bundle_broadcast.value, tasks, destination_mode)
+        for batch in batches:
+            out = scorer.score(batch, columns, id_column)
+            out[PARTITION_COLUMN] = pd.to_datetime(batch[columns['datetime']]).dt.date.to_numpy()
+            yield out
+    return score_batches
+
+def score_trips(df, bundle_broadcast, tasks=('duration', 'destination'), destination_mode='table', id_column='id'):
+    """Score a Spark DataFrame of trips (Kaggle or API column names) with mapInPandas"""
+    columns = resolve_columns(df.columns)
+    for task in tasks:
+        missing = [c for c in REQUIRED[task] if c not in columns]
+        if missing:
+            raise ValueError(f"DataFrame has no column for {missing} (needed for {task})")
+    id_column = id_column if id_column in df.columns else None
+
+    schema = []
+    if id_column:
+        schema.append(f'{id_column} {df.schema[id_column].dataType.simpleString()}')
+    schema += OUTPUT_SCHEMA['duration'] if 'duration' in tasks else ['pickup_cluster bigint']
+    if 'destination' in tasks:
+        schema += OUTPUT_SCHEMA['destination']
+    schema.append(f'{PARTITION_COLUMN} date')
+
+    selected = sorted(set(columns.values()) | ({id_column} if id_column else set()))
+    return df.select(*selected).mapInPandas(
+        partition_scorer(bundle_broadcast, columns, tasks, destination_mode, id_column), ', '.join(schema)
+    )
+
+def write_scored(scored, output_path, mode='overwrite'):
+    """Write scored trips as Parquet partitioned by pickup date"""
+    scored.write.mode(mode).partitionBy(PARTITION_COLUMN).parquet(output_path)
+
+def csv_schema(columns):
+    """DDL for a CSV header: the scorer's inputs typed by their Kaggle or API name, everything else string"""
+    types = {alias: t for name, t in CSV_TYPES.items() for alias in COLUMN_ALIASES[name]}
+    return ', '.join(f'`{c}` {types.get(c, "string")}' for c in columns)
+
+def read_trips(spark, path, schema=None):
+    """Parquet as is; CSV with `schema` (DDL), or one built from the header line"""
+    if path.endswith(('.parquet', '.pq')) or os.path.isdir(path):
+        return spark.read.parquet(path)
+    if schema is None:
+        schema = csv_schema(spark.read.csv(path, header=True).columns)
+    return spark.read.csv(path, header=True, schema=schema)
+
+def verify(spark, model_path='models/', rows=5000):
+    """Score a synthetic Kaggle-layout file in Spark and compare with the Flask batch endpoints.
+
+    The endpoints are served from a model set loaded from the same `model_path`,
+    not whichever models the app started with.
+    """
+    import app
+    from score import make_sample
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sample_path = os.path.join(tmp, 'trips.csv')
+        make_sample(sample_path, rows)
+        source = pd.read_csv(sample_path)
+        bundle = spark.sparkContext.broadcast(model_bundle(model_path))
+        scored = score_trips(read_trips(spark, sample_path).repartition(4), bundle,
+                             destination_mode=app.DESTINATION_MODE)
+        out_path = os.path.join(tmp, 'scored')
+        write_scored(scored, out_path)
+        result = spark.read.parquet(out_path).toPandas().set_index('id').loc[source['id']]
+
+    trips = [{
+        'pickup_lat': r.pickup_latitude, 'pickup_lon': r.pickup_longitude,
+        'dropoff_lat': r.dropoff_latitude, 'dropoff_lon': r.dropoff_longitude,
+        'datetime': r.pickup_datetime[:16].replace(' ', 'T'), 'passengers': int(r.passenger_count)
+    } for r in source.itertuples()]
+    client = app.app.test_client()
+    previous, app.models = app.models, app.load_models(model_path, 'verify', loading='eager', warm=False)
+    try:
+        duration = client.post('/api/predict_duration/batch', json={'trips': trips}).json['predictions']
+        destination = client.post('/api/predict_destination/batch', json={'trips': trips}).json['predictions']
+    finally:
+        app.models = previous
+
+    mismatches = {
+        'duration_minutes': int(np.sum(result['duration_minutes'].to_numpy() != [p['duration_minutes'] for p in duration])),
+        'clusters': int(np.sum((result['pickup_cluster'].to_numpy() != [p['pickup_cluster'] for p in duration]) |
+                               (result['dropoff_cluster'].to_numpy() != [p['dropoff_cluster'] for p in duration]))),
+        'distance_km': int(np.sum(np.abs(result['distance_km'].to_numpy() - [p['distance_km'] for p in duration]) > 1e-9)),
+        'dest_top3': int(np.sum(result[['dest_top1', 'dest_top2', 'dest_top3']].to_numpy() !=
+                                [[t['cluster'] for t in p['top_predictions']] for p in destination]))
+    }
+    dates = pd.to_datetime(source['pickup_datetime']).dt.date.to_numpy()
+    mismatches['pickup_date'] = int(np.sum(result[PARTITION_COLUMN].to_numpy() != dates))
+    print(f"Compared {rows} trips with the Flask batch endpoints: {mismatches}")
+    if any(mismatches.values()):
+        raise AssertionError("Spark scores differ from the Flask outputs")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Score trips in Spark with broadcast native models")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('score', help="score a CSV/Parquet trip dataset into date-partitioned Parquet")
+    p.add_argument('input')
+    p.add_argument('output')
+    p.add_argument('--predict', nargs='+', choices=['duration', 'destination'], default=['duration', 'destination'])
+    p.add_argument('--destination-mode', choices=['table', 'live'], default='table')
+    p.add_argument('--master', default='local[*]')
+    p.add_argument('--model-path', default='models/')
+    p.add_argument('--schema', default=None, help="CSV schema as Spark DDL (default: built from the header)")
+
+    p = sub.add_parser('verify', help="check parity with the Flask endpoints in local mode")
+    p.add_argument('--rows', type=int, default=5000)
+    p.add_argument('--master', default='local[*]')
+    p.add_argument('--model-path', default='models/')
+
+    args = parser.parse_args()
+    spark = local_session(master=args.master)
+    try:
+        if args.command == 'verify':
+            verify(spark, args.model_path, args.rows)
+        else:
+            bundle = spark.sparkContext.broadcast(model_bundle(args.model_path))
+            scored = score_trips(read_trips(spark, args.input, args.schema), bundle, args.predict, args.destination_mode)
+            write_scored(scored, args.output)
+            print(f"Scored trips written to {args.output}, partitioned by {PARTITION_COLUMN}")
+    finally:
+        spark.stop()
@@ -222,7 +222,7 @@ document.addEventListener('click', (e) => {
 });
 
 function reverseGeocode(lat, lng, inputId) {
-    fetch(`https://nominatim.openstreetmap.org/reverse?format=json&lat=${lat}&lon=${lng}&zoom=18`)
+    fetch(`/api/reverse?lat=${lat}&lon=${lng}`)
         .then(res => res.json())
         .then(data => {
             if (data.display_name) {
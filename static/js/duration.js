@@ -252,7 +252,7 @@ function selectSearchResult(item, inputElementId, markerFunction) {
 }
 
 function reverseGeocode(lat, lng, inputId) {
-    fetch(`https://nominatim.openstreetmap.org/reverse?format=json&lat=${lat}&lon=${lng}&zoom=18`)
+    fetch(`/api/reverse?lat=${lat}&lon=${lng}`)
         .then(res => res.json())
         .then(data => {
             if (data.display_name) {
@@ -276,14 +276,13 @@ function drawRoute() {
     const loadingDiv = document.getElementById('loading');
     if (loadingDiv) loadingDiv.classList.remove('hidden');
     
-    fetch(`https://router.project-osrm.org/route/v1/driving/${pickupLon},${pickupLat};${dropoffLon},${dropoffLat}?overview=full&geometries=geojson`)
+    fetch(`/api/route?p_lat=${pickupLat}&p_lon=${pickupLon}&d_lat=${dropoffLat}&d_lon=${dropoffLon}`)
         .then(res => res.json())
         .then(data => {
             if (loadingDiv) loadingDiv.classList.add('hidden');
             
-            if (data.routes && data.routes.length > 0) {
-                const route = data.routes[0];
-                const coords = route.geometry.coordinates.map(c => [c[1], c[0]]);
+            if (data.status === 'success') {
+                const coords = data.geometry.coordinates.map(c => [c[1], c[0]]);
                 
                 routeLayer = L.polyline(coords, {
                     color: '#3B82F6',
@@ -0,0 +1,245 @@
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import shutil
+import tempfile
+
+from flask import abort, send_file
+from werkzeug.security import safe_join
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = 'dist'
+MANIFEST_FILE = 'manifest.json'
+ASSET_EXTENSIONS = ('.js', '.css')
+HASH_LENGTH = 12
+# A fingerprinted name never changes content, so browsers keep it for a year without revalidating
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+# Preferred first; each variant is a sibling file with this suffix
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+logger = logging.getLogger('nyc_taxi')
+
+def file_sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def hashed_name(path, digest):
+    stem, ext = os.path.splitext(path)
+    return f'{stem}.{digest[:HASH_LENGTH]}{ext}'
+
+def brotli_compress(data):
+    """Brotli bytes, or None when the optional `brotli` package is not installed"""
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli.compress(data, quality=11)
+
+def source_files(static_dir):
+    """JS and CSS files under static/, relative to it, skipping the build output"""
+    found = []
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != os.path.join(static_dir, DIST_DIR))
+        found += [os.path.relpath(os.path.join(root, f), static_dir).replace(os.sep, '/')
+                  for f in sorted(files) if f.endswith(ASSET_EXTENSIONS)]
+    return found
+
+def read_manifest(static_dir):
+    try:
+        with open(os.path.join(static_dir, DIST_DIR, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def build_assets(static_dir=STATIC_DIR):
+    """Write content-hashed copies of the JS/CSS under static/ to static/dist/, with gzip and brotli variants.
+
+    static/dist/manifest.json maps each source path to its hashed name. Files
+    from the previous build are kept, so pages rendered before a deploy can
+    still load their assets; anything older is removed.
+    """
+    dist = os.path.join(static_dir, DIST_DIR)
+    previous = read_manifest(static_dir)
+    manifest = {}
+    has_brotli = True
+    for name in source_files(static_dir):
+        with open(os.path.join(static_dir, name), 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        target = hashed_name(name, digest)
+        path = os.path.join(dist, target)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        variants = {'identity': data, 'gzip': gzip.compress(data, compresslevel=9, mtime=0),
+                    'br': brotli_compress(data)}
+        has_brotli = variants['br'] is not None
+        for encoding, suffix in [('identity', '')] + ENCODINGS:
+            if variants[encoding] is not None:
+                with open(path + suffix, 'wb') as f:
+                    f.write(variants[encoding])
+        manifest[name] = {'path': target, 'sha256': digest,
+                          'bytes': {k: len(v) for k, v in variants.items() if v is not None}}
+
+    tmp = os.path.join(dist, MANIFEST_FILE + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, os.path.join(dist, MANIFEST_FILE))
+
+    keep = {e['path'] for e in list(manifest.values()) + list(previous.values())}
+    keep = {p + suffix for p in keep for suffix in [''] + [s for _, s in ENCODINGS]} | {MANIFEST_FILE}
+    for root, _, files in os.walk(dist):
+        for f in files:
+            rel = os.path.relpath(os.path.join(root, f), dist).replace(os.sep, '/')
+            if rel not in keep:
+                os.remove(os.path.join(root, f))
+    if not has_brotli:
+        print("WARNING: brotli is not installed, only gzip variants were written (pip install brotli)")
+    return manifest
+
+class StaticAssets:
+    """Fingerprinted URLs for templates, and precompressed delivery of the built files.
+
+    `url_path(name)` gives a source file's hashed name from the manifest. An
+    entry whose source has changed since the build (checked by mtime, then
+    hash) is dropped, so templates fall back to the plain /static/ URL instead
+    of pointing at stale code. `respond(request, path)` sends the brotli or
+    gzip variant the client accepts, with far-future caching.
+    """
+
+    def __init__(self, static_dir=STATIC_DIR):
+        self.static_dir = static_dir
+        self.dist_dir = os.path.join(static_dir, DIST_DIR)
+        self.entries = {}
+        self.served = set()
+        manifest = read_manifest(static_dir)
+        for name, entry in manifest.items():
+            self.entries[name] = {'path': entry['path'], 'sha256': entry['sha256'], 'mtime_ns': None}
+            self.served.add(entry['path'])
+
+    def url_path(self, name):
+        """The hashed name for a source file, or None when it is not built or out of date"""
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        try:
+            mtime_ns = os.stat(os.path.join(self.static_dir, name)).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        if mtime_ns != entry['mtime_ns']:
+            if mtime_ns is None or file_sha256(os.path.join(self.static_dir, name)) != entry['sha256']:
+                logger.warning("static/%s changed since the last asset build; serving it unhashed", name)
+                self.entries.pop(name, None)
+                return None
+            entry['mtime_ns'] = mtime_ns
+        return entry['path']
+
+    def respond(self, request, path):
+        if path not in self.served:
+            abort(404)
+        full = safe_join(self.dist_dir, path)
+        if full is None or not os.path.isfile(full):
+            abort(404)
+        encoding = None
+        for name, suffix in ENCODINGS:
+            if name in request.accept_encodings and os.path.isfile(full + suffix):
+                encoding, full = name, full + suffix
+                break
+        response = send_file(full, mimetype=mimetypes.guess_type(path)[0], conditional=True, max_age=31536000)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE
+        return response
+
+# --- VERIFY & BENCH ---
+def verify():
+    """Build into a copy of static/, then check hashes, variants, headers and the stale-source fallback"""
+    import app
+    with tempfile.TemporaryDirectory() as tmp:
+        static_dir = os.path.join(tmp, 'static')
+        shutil.copytree(STATIC_DIR, static_dir, ignore=shutil.ignore_patterns(DIST_DIR))
+        manifest = build_assets(static_dir)
+        assert set(manifest) == set(source_files(static_dir)) and manifest, "Every JS/CSS file should be built"
+        for name, entry in manifest.items():
+            with open(os.path.join(static_dir, name), 'rb') as f:
+                source = f.read()
+            assert hashlib.sha256(source).hexdigest()[:HASH_LENGTH] in entry['path']
+            path = os.path.join(static_dir, DIST_DIR, entry['path'])
+            with open(path + '.gz', 'rb') as f:
+                assert gzip.decompress(f.read()) == source
+            if os.path.exists(path + '.br'):
+                import brotli
+                with open(path + '.br', 'rb') as f:
+                    assert brotli.decompress(f.read()) == source
+        print(f"Built {len(manifest)} assets: hashed names match content, variants decompress to the source")
+
+        previous, app.static_assets = app.static_assets, StaticAssets(static_dir)
+        try:
+            client = app.app.test_client()
+            for page, name in [('/duration', 'js/duration.js'), ('/destination', 'css/destination.css')]:
+                url = f"/assets/{manifest[name]['path']}"
+                assert url in client.get(page).get_data(as_text=True), f"{page} should link {url}"
+                for accept, expected in [('br, gzip', 'br' if 'br' in manifest[name]['bytes'] else 'gzip'),
+                                         ('gzip', 'gzip'), ('', None)]:
+                    r = client.get(url, headers={'Accept-Encoding': accept})
+                    assert r.status_code == 200 and r.headers.get('Content-Encoding') == expected, (url, accept)
+                    assert r.headers['Cache-Control'] == IMMUTABLE_CACHE and r.headers['Vary'] == 'Accept-Encoding'
+                    assert len(r.data) == manifest[name]['bytes'][expected or 'identity']
+                    again = client.get(url, headers={'Accept-Encoding': accept, 'If-None-Match': r.headers['ETag']})
+                    assert again.status_code == 304
+            assert client.get('/assets/../app.py').status_code == 404
+            assert client.get('/assets/js/duration.js').status_code == 404, "Only built names are served"
+            print("Pages link hashed URLs; br/gzip/identity negotiated with immutable caching and 304s")
+
+            with open(os.path.join(static_dir, 'js', 'duration.js'), 'a') as f:
+                f.write('\n// edited\n')
+            assert '/static/js/duration.js' in client.get('/duration').get_data(as_text=True)
+            print("A source edited after the build falls back to its unhashed /static/ URL")
+        finally:
+            app.static_assets = previous
+
+def bench():
+    """Bytes per asset for each encoding, and the request cost of a first and a repeat load"""
+    import time
+    import app
+    manifest = read_manifest(STATIC_DIR) or build_assets(STATIC_DIR)
+    for name, entry in sorted(manifest.items()):
+        sizes = entry['bytes']
+        print(f"{name:22s}: {sizes['identity'] / 1e3:6.1f} kB | gzip {sizes['gzip'] / 1e3:5.1f} kB"
+              + (f" | br {sizes['br'] / 1e3:5.1f} kB" if 'br' in sizes else ''))
+
+    client = app.app.test_client()
+    previous, app.static_assets = app.static_assets, StaticAssets(STATIC_DIR)
+    try:
+        name = 'js/duration.js'
+        url = f"/assets/{manifest[name]['path']}"
+        etag = client.get(url, headers={'Accept-Encoding': 'br, gzip'}).headers['ETag']
+        cases = [('/static (before)', f'/static/{name}', {}),
+                 ('/assets br', url, {'Accept-Encoding': 'br, gzip'}),
+                 ('/assets 304', url, {'Accept-Encoding': 'br, gzip', 'If-None-Match': etag})]
+        for label, path, headers in cases:
+            t0 = time.perf_counter()
+            for _ in range(500):
+                r = client.get(path, headers=headers)
+            elapsed = (time.perf_counter() - t0) / 500
+            print(f"{label:18s}: {elapsed * 1e3:6.3f} ms/request | {len(r.data) / 1e3:6.1f} kB | "
+                  f"Cache-Control: {r.headers.get('Cache-Control')}")
+    finally:
+        app.static_assets = previous
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Content-hashed, precompressed static assets")
+    parser.add_argument('command', choices=['build', 'verify', 'bench'])
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        manifest = build_assets()
+        for name, entry in sorted(manifest.items()):
+            print(f"{name} -> {DIST_DIR}/{entry['path']}")
+    elif args.command == 'verify':
+        verify()
+    else:
+        bench()
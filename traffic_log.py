@@ -0,0 +1,25 @@
+import json
+import threading
+
+class TrafficRecorder:
+    """Append API requests to a JSONL file in the format `load_traffic` replays"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', buffering=1, encoding='utf-8')
+
+    def record(self, request):
+        entry = {'method': request.method, 'path': request.path}
+        if request.args:
+            entry['query'] = request.args.to_dict()
+        body = request.get_json(silent=True) if request.is_json else None
+        if body is not None:
+            entry['json'] = body
+        line = json.dumps(entry, separators=(',', ':'))
+        with self._lock:
+            self._file.write(line + '\n')
+
+def load_traffic(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
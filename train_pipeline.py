@@ -0,0 +1,524 @@
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from cluster_index import ClusterIndex, NYC_BOUNDS
+from features import (
+    haversine_np, duration_features, destination_features, DURATION_FEATURE_NAMES, DESTINATION_FEATURE_NAMES
+)
+from model_store import SOURCE_FILES, file_stamp
+from spark_scoring import PARTITION_COLUMN, local_session
+from trip_stats import DURATION_RANGE_MIN, PASSENGER_RANGE, DISTANCE_RANGE_KM, SPEED_RANGE_KMH, format_stats
+
+STAGES = ['raw', 'clean', 'clusters', 'features', 'train']
+
+# Kaggle train.csv, read with an explicit schema so Spark does not scan the file to infer one
+RAW_SCHEMA = ('id string, vendor_id int, pickup_datetime timestamp, dropoff_datetime timestamp, passenger_count int, '
+              'pickup_longitude double, pickup_latitude double, dropoff_longitude double, dropoff_latitude double, '
+              'store_and_fwd_flag string, trip_duration int')
+
+CLEAN_COLUMNS = ['id', 'pickup_datetime', 'passenger_count', 'pickup_latitude', 'pickup_longitude',
+                 'dropoff_latitude', 'dropoff_longitude', 'trip_duration_minutes', 'distance_km', 'avg_speed_kmh',
+                 PARTITION_COLUMN]
+
+# Every feature either model can use, computed with the same code the app serves with
+FEATURE_COLUMNS = list(DURATION_FEATURE_NAMES) + [c for c in DESTINATION_FEATURE_NAMES if c not in DURATION_FEATURE_NAMES]
+TARGET_COLUMNS = ['trip_duration_minutes', 'log_trip_duration', 'avg_speed_kmh']
+
+# Duration model: the notebook's candidate columns, tuned parameters and
+# feature selection (top 10 by importance, coordinates always kept)
+DURATION_CANDIDATES = ['distance_km', 'pickup_longitude', 'pickup_latitude', 'dropoff_longitude', 'dropoff_latitude',
+                       'bearing', 'manhattan_distance', 'log_distance', 'hour', 'month', 'is_weekend', 'is_rush_hour',
+                       'passenger_count', 'day_of_week_idx']
+PROTECTED_FEATURES = ['pickup_longitude', 'pickup_latitude', 'dropoff_longitude', 'dropoff_latitude']
+MAX_DURATION_FEATURES = 10
+XGB_PARAMS = {
+    'n_estimators': 500, 'max_depth': 6, 'learning_rate': 0.2, 'subsample': 0.8, 'colsample_bytree': 0.9,
+    'reg_alpha': 1, 'reg_lambda': 1, 'objective': 'reg:squarederror', 'n_jobs': -1, 'tree_method': 'hist',
+    'random_state': 42
+}
+DESTINATION_COLUMNS = ['pickup_cluster', 'passenger_count', 'hour', 'month', 'is_weekend', 'is_rush_hour',
+                       'hour_sin', 'hour_cos', 'month_sin', 'month_cos']
+LGB_PARAMS = {
+    'objective': 'multiclass', 'metric': 'multi_logloss', 'boosting_type': 'gbdt', 'learning_rate': 0.05,
+    'num_leaves': 31, 'max_depth': -1, 'feature_fraction': 0.8, 'bagging_fraction': 0.8, 'bagging_freq': 5,
+    'n_jobs': -1, 'verbose': -1, 'seed': 42
+}
+
+# --- CHECKPOINTS ---
+def path_stamp(path):
+    """Size and mtime of a file, or of every file under a directory"""
+    if os.path.isdir(path):
+        return sorted((os.path.relpath(os.path.join(root, f), path), file_stamp(os.path.join(root, f)))
+                      for root, _, files in os.walk(path) for f in files)
+    return file_stamp(path)
+
+class Checkpoints:
+    """Stage outputs under a work directory, each with a marker of what it was built from.
+
+    A stage's key hashes its parameters and the key of the stage before it,
+    so a rerun skips every stage whose key matches its marker and whose
+    outputs still exist, and rebuilds from the first one that changed.
+    Stages named in `force` always rebuild.
+    """
+
+    def __init__(self, work_dir, force=()):
+        self.work_dir = work_dir
+        self.force = set(force)
+        self.built = []
+        os.makedirs(work_dir, exist_ok=True)
+
+    def path(self, name):
+        return self.work_dir + name
+
+    def _marker_path(self, stage):
+        return self.work_dir + f'{stage}.done.json'
+
+    def run(self, stage, params, upstream, outputs, build):
+        """Build a stage unless its checkpoint is current; returns (key, info)"""
+        key = hashlib.sha256(json.dumps({'params': params, 'upstream': upstream}, sort_keys=True, default=str)
+                             .encode()).hexdigest()[:16]
+        try:
+            with open(self._marker_path(stage)) as f:
+                marker = json.load(f)
+        except (OSError, ValueError):
+            marker = {}
+        if stage not in self.force and marker.get('key') == key and all(os.path.exists(p) for p in outputs):
+            print(f"[{stage}] up to date {marker['info']}")
+            return key, marker['info']
+        started = time.perf_counter()
+        info = build() or {}
+        info['seconds'] = round(time.perf_counter() - started, 1)
+        with open(self._marker_path(stage), 'w') as f:
+            json.dump({'key': key, 'params': params, 'info': info, 'finished_at': time.strftime('%Y-%m-%dT%H:%M:%S')},
+                      f, indent=2, default=str)
+        self.built.append(stage)
+        print(f"[{stage}] built {info}")
+        return key, info
+
+# --- RAW & CLEAN ---
+def write_partitioned(df, path):
+    """Parquet partitioned by pickup date, one file per date"""
+    df.repartition(PARTITION_COLUMN).write.mode('overwrite').partitionBy(PARTITION_COLUMN).parquet(path)
+
+def read_raw(spark, source):
+    if source.endswith(('.parquet', '.pq')) or os.path.isdir(source):
+        return spark.read.parquet(source)
+    return spark.read.csv(source, header=True, schema=RAW_SCHEMA, timestampFormat='yyyy-MM-dd HH:mm:ss')
+
+def spark_haversine(lat1, lon1, lat2, lon2):
+    from pyspark.sql import functions as F
+    lat1, lon1, lat2, lon2 = F.radians(lat1), F.radians(lon1), F.radians(lat2), F.radians(lon2)
+    a = F.pow(F.sin((lat2 - lat1) / 2), 2) + F.cos(lat1) * F.cos(lat2) * F.pow(F.sin((lon2 - lon1) / 2), 2)
+    return 6371 * 2 * F.atan2(F.sqrt(a), F.sqrt(1 - a))
+
+def clean_trips(df):
+    """The notebook's filters: duplicates, nulls, duration, passengers, NYC box, distance and speed"""
+    from pyspark.sql import functions as F
+    lat_min, lat_max, lon_min, lon_max = NYC_BOUNDS
+    df = (df.dropDuplicates().na.drop()
+          .withColumn('trip_duration_minutes', F.col('trip_duration') / 60)
+          .filter(F.col('trip_duration_minutes').between(*DURATION_RANGE_MIN))
+          .filter(F.col('passenger_count').between(*PASSENGER_RANGE))
+          .filter(F.col('pickup_latitude').between(lat_min, lat_max) & F.col('dropoff_latitude').between(lat_min, lat_max) &
+                  F.col('pickup_longitude').between(lon_min, lon_max) & F.col('dropoff_longitude').between(lon_min, lon_max))
+          .filter(~((F.col('pickup_longitude') == F.col('dropoff_longitude')) &
+                    (F.col('pickup_latitude') == F.col('dropoff_latitude'))))
+          .withColumn('distance_km', spark_haversine('pickup_latitude', 'pickup_longitude',
+                                                     'dropoff_latitude', 'dropoff_longitude'))
+          .withColumn('avg_speed_kmh', F.col('distance_km') / (F.col('trip_duration_minutes') / 60))
+          .filter(F.col('distance_km').between(*DISTANCE_RANGE_KM))
+          .filter((F.col('avg_speed_kmh') > SPEED_RANGE_KMH[0]) & (F.col('avg_speed_kmh') <= SPEED_RANGE_KMH[1])))
+    return df.select(*CLEAN_COLUMNS)
+
+# --- MINI-BATCH KMEANS ---
+def coordinate_points(clean):
+    """Pickups and dropoffs as one (lat, lon) DataFrame, the points the clusters are fit on"""
+    from pyspark.sql import functions as F
+    return (clean.select(F.col('pickup_latitude').alias('lat'), F.col('pickup_longitude').alias('lon'))
+            .union(clean.select(F.col('dropoff_latitude').alias('lat'), F.col('dropoff_longitude').alias('lon'))))
+
+def cluster_sums(points, centers):
+    """Per-cluster point count, coordinate sums and squared distance for the nearest-center assignment.
+
+    The assignment is a SQL expression over the broadcast centers, so it runs
+    in the JVM with no Python UDF, and only k rows come back to the driver.
+    """
+    from pyspark.sql import functions as F
+    dists = F.array(*[(F.col('lat') - float(lat)) * (F.col('lat') - float(lat)) +
+                      (F.col('lon') - float(lon)) * (F.col('lon') - float(lon)) for lat, lon in centers])
+    # array_position through SQL: the Python function only takes a Column as the value from Spark 4.0
+    rows = (points.select('lat', 'lon', dists.alias('dists'))
+            .select('lat', 'lon', F.array_min('dists').alias('d2'),
+                    F.expr('array_position(dists, array_min(dists)) - 1').alias('cluster'))
+            .groupBy('cluster')
+            .agg(F.count('*').alias('n'), F.sum('lat').alias('lat'), F.sum('lon').alias('lon'), F.sum('d2').alias('d2'))
+            .collect())
+    n = np.zeros(len(centers))
+    sums = np.zeros((len(centers), 2))
+    cost = 0.0
+    for r in rows:
+        n[r['cluster']] = r['n']
+        sums[r['cluster']] = (r['lat'], r['lon'])
+        cost += r['d2']
+    return n, sums, cost
+
+def kmeans_plus_plus(points, k, rng):
+    """k-means++ seeding on a small in-memory sample"""
+    centers = [points[rng.integers(len(points))]]
+    d2 = ((points - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        centers.append(points[rng.choice(len(points), p=d2 / d2.sum())])
+        d2 = np.minimum(d2, ((points - centers[-1]) ** 2).sum(axis=1))
+    return np.array(centers)
+
+def fit_minibatch_kmeans(points, k, batch_size=100000, max_iter=100, tol=1e-5, init_size=20000, seed=42):
+    """Mini-batch KMeans over a Spark DataFrame of (lat, lon) points.
+
+    Each iteration assigns a fresh random batch to the current centers and
+    moves every center towards its batch mean with a per-center learning
+    rate (batch count / all points it has seen), as in Sculley's web-scale
+    k-means. Only the k-means++ seeds come from a driver-side sample; a last
+    pass over every point reports cluster sizes and the cost.
+    """
+    total = points.count()
+    rng = np.random.default_rng(seed)
+    seed_points = np.array(points.sample(fraction=min(1.0, 2 * init_size / total), seed=seed)
+                           .limit(init_size).collect(), dtype=np.float64)
+    centers = kmeans_plus_plus(seed_points, k, rng)
+    seen = np.zeros(k)
+    fraction = min(1.0, batch_size / total)
+    for iteration in range(1, max_iter + 1):
+        n, sums, _ = cluster_sums(points.sample(fraction=fraction, seed=seed + iteration), centers)
+        hit = n > 0
+        seen[hit] += n[hit]
+        step = (n[hit] / seen[hit])[:, None] * (sums[hit] / n[hit][:, None] - centers[hit])
+        centers[hit] += step
+        shift = float(np.abs(step).max()) if hit.any() else 0.0
+        if shift < tol:
+            break
+    sizes, _, cost = cluster_sums(points, centers)
+    return centers, {'points': int(total), 'iterations': iteration, 'last_shift_deg': shift, 'cost': float(cost),
+                     'sizes': sizes.astype(int).tolist()}
+
+# --- FEATURES ---
+def feature_schema():
+    sample = {**duration_features(0, 0, 0, 0, 0, 1, 0, 1, 0, 0), **destination_features(0, 1, 0, 1, 0)}
+    columns = [f"{name} {'bigint' if np.asarray(sample[name]).dtype.kind == 'i' else 'double'}"
+               for name in FEATURE_COLUMNS]
+    columns += [f'{name} double' for name in TARGET_COLUMNS]
+    return ', '.join(columns + [f'{PARTITION_COLUMN} date'])
+
+# One ClusterIndex per Python worker process; building its raster takes ~0.5 s
+_indexes = {}
+
+def feature_batches(centroids):
+    """mapInPandas function: cluster assignment and model features for cleaned trips"""
+    key = np.asarray(centroids, dtype=np.float64).tobytes()
+
+    def run(batches):
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = ClusterIndex(centroids)
+        for batch in batches:
+            n = len(batch)
+            p_lat, p_lon, d_lat, d_lon = (batch[c].to_numpy(dtype=np.float64) for c in
+                                          ('pickup_latitude', 'pickup_longitude', 'dropoff_latitude', 'dropoff_longitude'))
+            passengers = batch['passenger_count'].to_numpy(dtype=np.int64)
+            pickup = pd.to_datetime(batch['pickup_datetime'])
+            hour, month, weekday = (pickup.dt.hour.to_numpy(dtype=np.int64), pickup.dt.month.to_numpy(dtype=np.int64),
+                                    pickup.dt.weekday.to_numpy(dtype=np.int64))
+            clusters = index.predict(np.column_stack([np.concatenate([p_lat, d_lat]), np.concatenate([p_lon, d_lon])]))
+            features = duration_features(p_lat, p_lon, d_lat, d_lon, hour, month, weekday, passengers,
+                                         clusters[:n], clusters[n:])
+            features.update(destination_features(clusters[:n], passengers, hour, month, weekday))
+            out = pd.DataFrame({name: features[name] for name in FEATURE_COLUMNS})
+            minutes = batch['trip_duration_minutes'].to_numpy(dtype=np.float64)
+            out['trip_duration_minutes'] = minutes
+            out['log_trip_duration'] = np.log1p(minutes)
+            out['avg_speed_kmh'] = batch['avg_speed_kmh'].to_numpy(dtype=np.float64)
+            out[PARTITION_COLUMN] = batch[PARTITION_COLUMN].to_numpy()
+            yield out
+    return run
+
+def build_features(clean, centroids):
+    return clean.mapInPandas(feature_batches(centroids), feature_schema())
+
+# --- TRAINING ---
+def load_training_frame(df, columns, max_rows, seed=42):
+    """Only the needed columns, through Arrow, sampled down to max_rows"""
+    df = df.select(*columns)
+    total = df.count()
+    if max_rows and total > max_rows:
+        df = df.sample(fraction=max_rows / total, seed=seed)
+    return df.toPandas()
+
+def select_features(model, columns, max_features=MAX_DURATION_FEATURES, protected=PROTECTED_FEATURES):
+    """Top features by importance in their original order, plus any protected ones it left out"""
+    top = set(np.argsort(-model.feature_importances_, kind='mergesort')[:max_features])
+    selected = [c for i, c in enumerate(columns) if i in top]
+    return selected + [c for c in protected if c not in selected]
+
+def train_duration_model(frame, params=XGB_PARAMS, seed=42):
+    """XGBoost on log1p(minutes): fit on every candidate, keep the selected features, refit"""
+    import xgboost as xgb
+    from sklearn.model_selection import train_test_split
+
+    X, y = frame[DURATION_CANDIDATES], frame['log_trip_duration']
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=seed)
+    tuned = xgb.XGBRegressor(**params).fit(X_train, y_train)
+    features = select_features(tuned, DURATION_CANDIDATES)
+    model = xgb.XGBRegressor(**params).fit(X_train[features], y_train)
+    minutes, predicted = np.expm1(y_test.to_numpy()), np.expm1(model.predict(X_test[features]))
+    metrics = {'rmse_min': float(np.sqrt(np.mean((minutes - predicted) ** 2))),
+               'mae_min': float(np.mean(np.abs(minutes - predicted))),
+               'test_rows': len(y_test)}
+    return model, features, metrics
+
+def train_destination_model(frame, n_clusters, params=LGB_PARAMS, max_rounds=2000, seed=42):
+    """LightGBM multiclass over the dropoff clusters, with pickup_cluster as a pandas categorical"""
+    import lightgbm as lgb
+    from sklearn.model_selection import train_test_split
+
+    X = frame[DESTINATION_COLUMNS].copy()
+    X['pickup_cluster'] = pd.Categorical(X['pickup_cluster'], categories=range(n_clusters))
+    y = frame['dropoff_cluster'].astype(int)
+    stratify = y if y.value_counts().min() >= 2 else None
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=seed, stratify=stratify)
+    train = lgb.Dataset(X_train, y_train, categorical_feature='auto')
+    valid = lgb.Dataset(X_test, y_test, reference=train, categorical_feature='auto')
+    booster = lgb.train({**params, 'num_class': n_clusters}, train, num_boost_round=max_rounds,
+                        valid_sets=[train, valid],
+                        callbacks=[lgb.early_stopping(stopping_rounds=50, verbose=False), lgb.log_evaluation(period=100)])
+    probabilities = booster.predict(X_test)
+    top3 = np.argsort(probabilities, axis=1)[:, -3:]
+    metrics = {'top1': float(np.mean(np.argmax(probabilities, axis=1) == y_test.to_numpy())),
+               'top3': float(np.mean(np.any(top3 == y_test.to_numpy()[:, None], axis=1))),
+               'rounds': booster.best_iteration or booster.current_iteration(),
+               'test_rows': len(y_test)}
+    return booster, booster.feature_name(), metrics
+
+# --- ARTIFACTS ---
+def cluster_stats(features_df):
+    """cluster_stats.json content: trips, mean duration, speed and passengers, and the busiest hour per zone"""
+    from pyspark.sql import functions as F
+    basic = features_df.groupBy('pickup_cluster').agg(
+        F.count('*').alias('count'),
+        F.avg('trip_duration_minutes').alias('avg_duration'),
+        F.avg('avg_speed_kmh').alias('avg_speed'),
+        F.avg('passenger_count').alias('avg_passenger')
+    ).collect()
+    hourly = features_df.groupBy('pickup_cluster', 'hour').count().toPandas()
+    peak = hourly.loc[hourly.groupby('pickup_cluster')['count'].idxmax()].set_index('pickup_cluster')['hour']
+    stats = {}
+    for row in sorted(basic, key=lambda r: r['pickup_cluster']):
+        peak_h = int(peak.loc[row['pickup_cluster']])
+        stats[str(int(row['pickup_cluster']))] = format_stats(
+            row['count'], row['avg_duration'], row['avg_speed'], row['avg_passenger'], peak_h)
+    return stats
+
+def kmeans_model(centers):
+    """An sklearn KMeans carrying the fitted centers, the object app.py unpickles"""
+    from sklearn.cluster import KMeans
+    kmeans = KMeans(n_clusters=len(centers), n_init=1)
+    kmeans.cluster_centers_ = np.asarray(centers, dtype=np.float64)
+    kmeans.n_features_in_ = 2
+    kmeans._n_threads = 1
+    return kmeans
+
+def write_artifacts(model_path, centers, duration, destination, stats):
+    """Every file app.py loads from a model directory, named as the notebook saved them"""
+    os.makedirs(model_path, exist_ok=True)
+    kmeans = kmeans_model(centers)
+    joblib.dump(kmeans, model_path + SOURCE_FILES['kmeans'])
+    joblib.dump(kmeans, model_path + 'kmeans_dropoff.pkl')
+    joblib.dump(duration[0], model_path + SOURCE_FILES['duration'])
+    joblib.dump(duration[1], model_path + SOURCE_FILES['duration_features'])
+    joblib.dump(destination[0], model_path + SOURCE_FILES['destination'])
+    joblib.dump(destination[1], model_path + SOURCE_FILES['destination_features'])
+    centroids = [list(map(float, c)) for c in centers]
+    with open(model_path + 'cluster_centroids.json', 'w') as f:
+        json.dump({'pickup_clusters': centroids, 'dropoff_clusters': centroids}, f, indent=4)
+    with open(model_path + 'cluster_stats.json', 'w') as f:
+        json.dump(stats, f, indent=4)
+
+def artifact_paths(model_path):
+    return [model_path + f for f in SOURCE_FILES.values()] + [
+        model_path + f for f in ('kmeans_dropoff.pkl', 'cluster_centroids.json', 'cluster_stats.json')]
+
+# --- PIPELINE ---
+def run_pipeline(spark, source, work_dir='data/pipeline/', model_path='models/', n_clusters=10, kmeans_batch=100000,
+                 kmeans_iter=100, max_train_rows=2_000_000, xgb_params=XGB_PARAMS, max_rounds=2000, force=()):
+    """Raw CSV -> date-partitioned Parquet -> cleaned trips -> clusters -> features -> models/.
+
+    Every stage is checkpointed under work_dir, and each stage reads the
+    previous checkpoint from Parquet rather than recomputing its lineage.
+    Row counts come from the written Parquet once per stage. Returns the
+    names of the stages that were built (the rest were up to date).
+    """
+    ckpt = Checkpoints(work_dir, force)
+    raw_path, clean_path, features_path = ckpt.path('raw.parquet'), ckpt.path('clean.parquet'), ckpt.path('features.parquet')
+    centers_path = ckpt.path('centroids.json')
+
+    def build_raw():
+        from pyspark.sql import functions as F
+        df = read_raw(spark, source)
+        write_partitioned(df.withColumn(PARTITION_COLUMN, F.to_date('pickup_datetime')), raw_path)
+        return {'rows': spark.read.parquet(raw_path).count()}
+    key, _ = ckpt.run('raw', {'source': os.path.abspath(source), 'stamp': path_stamp(source)}, None, [raw_path], build_raw)
+
+    def build_clean():
+        write_partitioned(clean_trips(spark.read.parquet(raw_path)), clean_path)
+        return {'rows': spark.read.parquet(clean_path).count()}
+    key, _ = ckpt.run('clean', {'duration_min': DURATION_RANGE_MIN, 'passengers': PASSENGER_RANGE, 'bounds': NYC_BOUNDS,
+                                'distance_km': DISTANCE_RANGE_KM, 'speed_kmh': SPEED_RANGE_KMH},
+                      key, [clean_path], build_clean)
+
+    def build_clusters():
+        points = coordinate_points(spark.read.parquet(clean_path)).cache()
+        try:
+            centers, info = fit_minibatch_kmeans(points, n_clusters, kmeans_batch, kmeans_iter)
+        finally:
+            points.unpersist()
+        with open(centers_path, 'w') as f:
+            json.dump(centers.tolist(), f)
+        return info
+    key, _ = ckpt.run('clusters', {'k': n_clusters, 'batch': kmeans_batch, 'max_iter': kmeans_iter},
+                      key, [centers_path], build_clusters)
+    with open(centers_path) as f:
+        centers = np.array(json.load(f))
+
+    def build_features_stage():
+        write_partitioned(build_features(spark.read.parquet(clean_path), centers), features_path)
+        return {'rows': spark.read.parquet(features_path).count()}
+    key, _ = ckpt.run('features', {'columns': FEATURE_COLUMNS}, key, [features_path], build_features_stage)
+
+    def build_models():
+        features_df = spark.read.parquet(features_path)
+        frame = load_training_frame(features_df, sorted(set(DURATION_CANDIDATES + DESTINATION_COLUMNS) |
+                                                        {'log_trip_duration', 'dropoff_cluster'}), max_train_rows)
+        print(f"[train] {len(frame):,} rows on the driver")
+        duration = train_duration_model(frame, xgb_params)
+        print(f"[train] duration: features {duration[1]}, {duration[2]}")
+        destination = train_destination_model(frame, n_clusters, max_rounds=max_rounds)
+        print(f"[train] destination: {destination[2]}")
+        write_artifacts(model_path, centers, duration, destination, cluster_stats(features_df))
+        return {'rows': len(frame), 'duration': duration[2], 'destination': destination[2]}
+    ckpt.run('train', {'model_path': os.path.abspath(model_path), 'max_rows': max_train_rows, 'xgb': xgb_params,
+                       'max_rounds': max_rounds}, key, artifact_paths(model_path), build_models)
+    return ckpt.built
+
+# --- SYNTHETIC DATA & SMOKE TEST ---
+# Pickup/dropoff hotspots (lat, lon, spread in degrees) for synthetic trips
+HOTSPOTS = [(40.758, -73.985, 0.008), (40.748, -73.992, 0.008), (40.708, -74.010, 0.006), (40.641, -73.778, 0.004),
+            (40.777, -73.874, 0.003), (40.679, -73.944, 0.015), (40.784, -73.971, 0.010), (40.718, -73.958, 0.008),
+            (40.845, -73.865, 0.015), (40.728, -73.795, 0.015)]
+
+def make_training_sample(path, n, seed=0):
+    """Write n synthetic trips in the Kaggle train.csv layout, plus a few rows the cleaning should drop"""
+    rng = np.random.default_rng(seed)
+    spots = np.array(HOTSPOTS)
+    start = np.datetime64('2016-01-01T00:00:00')
+    pickup = start + rng.integers(0, 182 * 24 * 3600, n).astype('timedelta64[s]')
+    hour = pd.DatetimeIndex(pickup).hour.to_numpy()
+    origin = rng.integers(0, len(spots), n)
+    # Destinations depend on the origin and on commute hours, so the destination model has something to learn
+    preferences = rng.dirichlet(np.ones(len(spots)) * 0.5, (len(spots), 2))
+    commute = ((hour >= 7) & (hour <= 19)).astype(int)
+    destination = np.array([rng.choice(len(spots), p=preferences[o, c]) for o, c in zip(origin, commute)])
+    p_lat = spots[origin, 0] + rng.normal(0, 1, n) * spots[origin, 2]
+    p_lon = spots[origin, 1] + rng.normal(0, 1, n) * spots[origin, 2]
+    d_lat = spots[destination, 0] + rng.normal(0, 1, n) * spots[destination, 2]
+    d_lon = spots[destination, 1] + rng.normal(0, 1, n) * spots[destination, 2]
+    speed = np.where(np.isin(hour, [7, 8, 9, 16, 17, 18, 19]), 14.0, 24.0) * rng.lognormal(0, 0.2, n)
+    seconds = ((1.3 * haversine_np(p_lat, p_lon, d_lat, d_lon) / speed * 60 + 3) * 60).astype(int)
+    frame = pd.DataFrame({
+        'id': [f'id{i:07d}' for i in range(n)],
+        'vendor_id': rng.integers(1, 3, n),
+        'pickup_datetime': pd.to_datetime(pickup).strftime('%Y-%m-%d %H:%M:%S'),
+        'dropoff_datetime': pd.to_datetime(pickup + seconds.astype('timedelta64[s]')).strftime('%Y-%m-%d %H:%M:%S'),
+        'passenger_count': rng.choice(np.arange(1, 7), n, p=[0.709, 0.144, 0.041, 0.019, 0.054, 0.033]),
+        'pickup_longitude': p_lon, 'pickup_latitude': p_lat,
+        'dropoff_longitude': d_lon, 'dropoff_latitude': d_lat,
+        'store_and_fwd_flag': 'N',
+        'trip_duration': seconds
+    })
+    dirty = frame.sample(n=max(n // 100, 4), random_state=seed).copy()
+    quarter = len(dirty) // 4
+    dirty.iloc[:quarter, dirty.columns.get_loc('passenger_count')] = 0
+    dirty.iloc[quarter:2 * quarter, dirty.columns.get_loc('pickup_latitude')] = 0.0
+    dirty.iloc[2 * quarter:3 * quarter, dirty.columns.get_loc('trip_duration')] = 86400
+    for end in ('latitude', 'longitude'):
+        dirty.iloc[3 * quarter:, dirty.columns.get_loc(f'dropoff_{end}')] = dirty[f'pickup_{end}'].iloc[3 * quarter:]
+    pd.concat([frame, dirty.assign(id=dirty['id'] + 'x'), frame.head(quarter)]).to_csv(path, index=False)
+
+def smoke(spark, rows=20000):
+    """Run the whole pipeline on synthetic trips, rerun it from the checkpoints and load the result in the app"""
+    import app
+    from model_bundles import validate_canary
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'train.csv')
+        make_training_sample(source, rows)
+        work_dir, model_path = os.path.join(tmp, 'work') + '/', os.path.join(tmp, 'models') + '/'
+        settings = dict(kmeans_batch=5000, kmeans_iter=30, xgb_params={**XGB_PARAMS, 'n_estimators': 50},
+                        max_rounds=100)
+        built = run_pipeline(spark, source, work_dir, model_path, **settings)
+        assert built == STAGES, built
+        rebuilt = run_pipeline(spark, source, work_dir, model_path, **settings)
+        assert rebuilt == [], f"Checkpointed stages rebuilt on a rerun: {rebuilt}"
+        rebuilt = run_pipeline(spark, source, work_dir, model_path, **{**settings, 'max_rounds': 80})
+        assert rebuilt == ['train'], f"Changing a training setting should only rerun training: {rebuilt}"
+
+        models = app.load_models(model_path, version='smoke', loading='eager')
+        canary = app.score_canary(models)
+        validate_canary(canary)
+        print(f"Artifacts load in the app: {len(models['cluster_centroids'])} zones, canary durations "
+              f"{int(canary['duration_minutes'].min())}-{int(canary['duration_minutes'].max())} min")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Checkpointed Spark training pipeline that writes the app's model files")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('run', help="train from a Kaggle train.csv (or Parquet) into --model-path")
+    p.add_argument('input')
+    p.add_argument('--work-dir', default='data/pipeline/')
+    p.add_argument('--model-path', default='models/')
+    p.add_argument('--clusters', type=int, default=10)
+    p.add_argument('--kmeans-batch', type=int, default=100000, help="points per mini-batch")
+    p.add_argument('--kmeans-iter', type=int, default=100)
+    p.add_argument('--max-train-rows', type=int, default=2_000_000, help="rows brought to the driver for model fitting")
+    p.add_argument('--from', dest='from_stage', choices=STAGES, default=None, help="rebuild from this stage on")
+    p.add_argument('--master', default='local[*]')
+
+    p = sub.add_parser('sample', help="write a synthetic train.csv")
+    p.add_argument('output')
+    p.add_argument('--rows', type=int, default=100000)
+
+    p = sub.add_parser('smoke', help="end-to-end run on synthetic data in local mode")
+    p.add_argument('--rows', type=int, default=20000)
+    p.add_argument('--master', default='local[*]')
+
+    args = parser.parse_args()
+    if args.command == 'sample':
+        make_training_sample(args.output, args.rows)
+        print(f"Wrote {args.rows} synthetic trips to {args.output}")
+    else:
+        spark = local_session('NYCTaxi_Training', master=args.master)
+        try:
+            if args.command == 'smoke':
+                smoke(spark, args.rows)
+            else:
+                force = STAGES[STAGES.index(args.from_stage):] if args.from_stage else ()
+                run_pipeline(spark, args.input, args.work_dir, args.model_path, args.clusters, args.kmeans_batch,
+                             args.kmeans_iter, args.max_train_rows, force=force)
+                print(f"Models written to {args.model_path}; run 'python model_store.py export' to refresh models/native/")
+        finally:
+            spark.stop()
@@ -0,0 +1,410 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+# Objectives whose prediction is the raw margin, or a softmax over per-class margins
+IDENTITY_OBJECTIVES = {'reg:squarederror', 'reg:linear', 'reg:absoluteerror', 'reg:pseudohubererror',
+                       'regression', 'regression_l1', 'huber', 'fair', 'quantile'}
+SOFTMAX_OBJECTIVES = {'multi:softprob', 'multiclass'}
+
+class TreeArrays:
+    """A boosted tree ensemble flattened into contiguous node arrays.
+
+    Every tree's nodes sit in one set of arrays (feature, threshold, left and
+    right child, default direction, leaf value), and `roots` points at each
+    tree's first node. Leaves point back at themselves, so predict() walks all
+    trees for all rows in `depth` vectorized steps with no per-tree loop, and
+    needs neither XGBoost nor LightGBM at serve time. Trees are ordered deepest
+    first, so step d only touches the trees that still have splits left. Categorical splits become
+    numeric splits on extra columns holding set membership (0 = in the set),
+    computed once per block from `cat_feature` and `cat_sets`.
+    """
+
+    FIELDS = ['feature', 'threshold', 'left', 'right', 'default_left', 'nan_as_zero', 'zero_missing',
+              'value', 'roots', 'groups', 'tree_depth', 'base_score', 'cat_feature', 'cat_sets']
+
+    def __init__(self, feature, threshold, left, right, default_left, nan_as_zero, zero_missing, value, roots, groups,
+                 tree_depth, base_score, cat_feature, cat_sets, n_features, objective, strict=False, float32=False,
+                 missing=np.nan, pandas_categorical=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.default_left = default_left
+        self.nan_as_zero = nan_as_zero
+        self.zero_missing = zero_missing
+        self.value = value
+        self.roots = roots
+        self.groups = groups
+        self.tree_depth = tree_depth
+        self.base_score = base_score
+        self.cat_feature = cat_feature
+        self.cat_sets = cat_sets
+        self.n_features = int(n_features)
+        self.depth = int(tree_depth.max(initial=0))
+        # Trees still walking at each step (tree_depth is sorted, deepest first)
+        self.active = [int(np.sum(tree_depth > d)) for d in range(self.depth)]
+        self.objective = objective
+        # XGBoost splits on x < threshold in float32, LightGBM on x <= threshold in float64
+        self.strict = bool(strict)
+        self.float32 = bool(float32)
+        self.missing = float(missing)
+        self.pandas_categorical = pandas_categorical
+        self.n_groups = len(base_score)
+        # The walk runs on doubled node ids (2 * node, + 1 once it went left), so a step
+        # is one gather into `_children` and the per-node arrays are repeated to match
+        self._children = 2 * np.column_stack([right, left]).ravel().astype(np.intp)
+        self._roots = 2 * roots.astype(np.intp)
+        self._feature, self._threshold, self._value = (np.repeat(a, 2) for a in (feature.astype(np.intp), threshold, value))
+        self._default_left, self._nan_as_zero, self._zero_missing = (
+            np.repeat(a, 2) for a in (default_left, nan_as_zero, zero_missing)
+        )
+        # Summing leaves per output group is one matmul against a (trees, groups) one-hot
+        self.group_matrix = np.zeros((len(roots), self.n_groups))
+        self.group_matrix[np.arange(len(roots)), groups] = 1.0
+        self._any_zero_missing = bool(zero_missing.any())
+
+    # --- EXPORT ---
+    @classmethod
+    def from_xgboost(cls, model, missing=None):
+        """Flatten an XGBoost gbtree model (Booster or sklearn wrapper), honouring best_iteration"""
+        booster = model.get_booster() if hasattr(model, 'get_booster') else model
+        if missing is None:
+            missing = getattr(model, 'missing', np.nan)
+        learner = json.loads(booster.save_raw(raw_format='json'))['learner']
+        objective = learner['objective']['name']
+        gbm = learner['gradient_booster']
+        if gbm['name'] != 'gbtree':
+            raise ValueError(f"Only gbtree boosters can be flattened, not {gbm['name']}")
+        base_score = [float(v) for v in learner['learner_model_param']['base_score'].strip('[]').split(',')]
+        n_groups = max(int(learner['learner_model_param']['num_class']), 1)
+        trees, info = gbm['model']['trees'], gbm['model']['tree_info']
+        best = getattr(booster, 'best_iteration', None)
+        if best is not None:
+            per_round = n_groups * int(gbm['model']['gbtree_model_param']['num_parallel_tree'])
+            trees, info = trees[:(best + 1) * per_round], info[:(best + 1) * per_round]
+
+        nodes = []
+        for tree in trees:
+            if any(tree['split_type']):
+                raise ValueError("Categorical XGBoost splits are not supported")
+            offset = sum(len(t) for t in nodes)
+            flat = []
+            for i, (lc, rc) in enumerate(zip(tree['left_children'], tree['right_children'])):
+                if lc == -1:
+                    flat.append(_leaf(offset + i, tree['split_conditions'][i]))
+                else:
+                    threshold = float(np.float32(tree['split_conditions'][i]))
+                    flat.append((tree['split_indices'][i], threshold, offset + lc, offset + rc,
+                                 bool(tree['default_left'][i]), False, False, None, 0.0))
+            nodes.append(flat)
+        if objective in SOFTMAX_OBJECTIVES:
+            base_score = [0.0] * n_groups
+        elif len(base_score) != n_groups:
+            base_score = base_score[:1] * n_groups
+        n_features = int(learner['learner_model_param']['num_feature'])
+        return cls._build(nodes, info, base_score, _objective(objective), n_features,
+                          strict=True, float32=True, missing=missing)
+
+    @classmethod
+    def from_lightgbm(cls, booster):
+        """Flatten a LightGBM booster, honouring best_iteration and its pandas categoricals"""
+        dump = booster.dump_model()
+        objective = dump['objective'].split()[0]
+        n_groups = dump['num_class']
+        tree_info = dump['tree_info']
+        if booster.best_iteration > 0:
+            tree_info = tree_info[:booster.best_iteration * n_groups]
+        nodes = []
+        for tree in tree_info:
+            if tree.get('is_linear'):
+                raise ValueError("Linear LightGBM trees are not supported")
+            offset = sum(len(t) for t in nodes)
+            flat = []
+            _flatten_lightgbm(tree['tree_structure'], flat, offset)
+            nodes.append(flat)
+        groups = [i % n_groups for i in range(len(tree_info))]
+        return cls._build(nodes, groups, [0.0] * n_groups, _objective(objective), dump['max_feature_idx'] + 1,
+                          pandas_categorical=getattr(booster, 'pandas_categorical', None))
+
+    @classmethod
+    def _build(cls, nodes, groups, base_score, objective, n_features, **kwargs):
+        flat = [node for tree in nodes for node in tree]
+        # One membership column per distinct (feature, category set) among the categorical splits
+        sets = {}
+        for i, node in enumerate(flat):
+            if node[7] is not None:
+                column = n_features + sets.setdefault((node[0], frozenset(node[7])), len(sets))
+                flat[i] = (column, 0.5) + node[2:7] + (None, node[8])
+        n_categories = max([max(categories) + 1 for _, categories in sets] or [0])
+        cat_sets = np.zeros((len(sets), n_categories), dtype=bool)
+        for (_, categories), j in sets.items():
+            cat_sets[j, list(categories)] = True
+        roots = np.cumsum([0] + [len(t) for t in nodes[:-1]]).astype(np.int32)
+        left = np.array([n[2] for n in flat], dtype=np.int32)
+        right = np.array([n[3] for n in flat], dtype=np.int32)
+        tree_depth = np.array([_max_depth(left, right, roots[i:i + 1]) for i in range(len(roots))], dtype=np.int32)
+        order = np.argsort(-tree_depth, kind='stable')
+        return cls(
+            feature=np.array([n[0] for n in flat], dtype=np.int32),
+            threshold=np.array([n[1] for n in flat], dtype=np.float64),
+            left=left,
+            right=right,
+            default_left=np.array([n[4] for n in flat], dtype=bool),
+            nan_as_zero=np.array([n[5] for n in flat], dtype=bool),
+            zero_missing=np.array([n[6] for n in flat], dtype=bool),
+            value=np.array([n[8] for n in flat], dtype=np.float64),
+            roots=roots[order],
+            groups=np.asarray(groups, dtype=np.int32)[order],
+            tree_depth=tree_depth[order],
+            base_score=np.asarray(base_score, dtype=np.float64),
+            cat_feature=np.array([feature for feature, _ in sets], dtype=np.int32),
+            cat_sets=cat_sets,
+            n_features=n_features,
+            objective=objective,
+            **kwargs
+        )
+
+    # --- FILES ---
+    def save(self, path):
+        meta = {'n_features': self.n_features, 'objective': self.objective, 'strict': self.strict, 'float32': self.float32,
+                'missing': None if np.isnan(self.missing) else self.missing,
+                'pandas_categorical': self.pandas_categorical}
+        np.savez(path, meta=json.dumps(meta), **{f: getattr(self, f) for f in self.FIELDS})
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            arrays = {f: data[f] for f in cls.FIELDS}
+        missing = meta.pop('missing')
+        return cls(**arrays, **meta, missing=np.nan if missing is None else missing)
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def n_nodes(self):
+        return len(self.feature)
+
+    # --- EVALUATION ---
+    def _category_columns(self, X):
+        """0.0 where a row's category is in a split's set, 1.0 otherwise (NaN, negative and unseen codes go right)"""
+        values = X[:, self.cat_feature]
+        codes = np.where(np.isnan(values), -1, values).astype(np.int64)
+        valid = (codes >= 0) & (codes < self.cat_sets.shape[1])
+        inside = valid & self.cat_sets[np.arange(len(self.cat_feature)), np.where(valid, codes, 0)]
+        return np.where(inside, 0.0, 1.0)
+
+    def predict(self, block):
+        """Predictions for a (n, features) block: shape (n,) for one output, (n, groups) otherwise"""
+        X = np.asarray(block, dtype=np.float32 if self.float32 else np.float64)
+        if X.shape[1] != self.n_features:
+            raise ValueError(f"Expected {self.n_features} features, got {X.shape[1]}")
+        if not np.isnan(self.missing):
+            X = np.where(X == self.missing, np.nan, X)
+        X = X.astype(np.float64, copy=False)
+        if len(self.cat_feature):
+            X = np.hstack([X, self._category_columns(X)])
+        n, width = X.shape
+        flat = X.ravel()
+        has_nan = bool(np.isnan(flat).any())
+        row_offsets = np.arange(n, dtype=np.intp) * width if n > 1 else None
+        # (trees, rows), so the trees still walking are a contiguous prefix
+        nodes = np.repeat(self._roots[:, None], n, axis=1)
+        for active in self.active:
+            node = nodes[:active]
+            columns = self._feature.take(node)
+            x = flat.take(columns if row_offsets is None else row_offsets + columns)
+            threshold = self._threshold.take(node)
+            if has_nan and not self.strict:
+                # LightGBM compares NaN as 0.0 unless the split has its own missing direction
+                x = np.where(np.isnan(x) & self._nan_as_zero.take(node), 0.0, x)
+            go_left = x < threshold if self.strict else x <= threshold
+            if has_nan or self._any_zero_missing:
+                is_missing = np.isnan(x)
+                if self._any_zero_missing:
+                    is_missing |= self._zero_missing.take(node) & (x == 0.0)
+                go_left = np.where(is_missing, self._default_left.take(node), go_left)
+            nodes[:active] = self._children.take(node + go_left)
+        margin = (self.group_matrix.T @ self._value.take(nodes)).T + self.base_score
+        if self.objective == 'softmax':
+            exp = np.exp(margin - margin.max(axis=1, keepdims=True))
+            return exp / exp.sum(axis=1, keepdims=True)
+        return margin[:, 0] if self.n_groups == 1 else margin
+
+# Flattened node tuples: (feature, threshold, left, right, default_left, nan_as_zero,
+# zero_missing, categories, leaf value). Leaves point at themselves and always go left.
+def _leaf(index, value):
+    return (0, np.inf, index, index, True, False, False, None, float(value))
+
+def _flatten_lightgbm(node, flat, offset):
+    index = offset + len(flat)
+    if 'split_index' not in node:
+        flat.append(_leaf(index, node['leaf_value']))
+        return index
+    flat.append(None)
+    left = _flatten_lightgbm(node['left_child'], flat, offset)
+    right = _flatten_lightgbm(node['right_child'], flat, offset)
+    missing_type = node['missing_type']
+    if node['decision_type'] == '==':
+        categories = {int(c) for c in str(node['threshold']).split('||')}
+        flat[index - offset] = (node['split_feature'], np.nan, left, right, False, False, False, categories, 0.0)
+    else:
+        flat[index - offset] = (node['split_feature'], float(node['threshold']), left, right,
+                                bool(node['default_left']), missing_type == 'None', missing_type == 'Zero', None, 0.0)
+    return index
+
+def _max_depth(left, right, roots):
+    """Longest root-to-leaf path over all trees, in splits"""
+    depth, frontier = 0, roots
+    while True:
+        internal = frontier[left[frontier] != frontier]
+        if not len(internal):
+            return depth
+        depth += 1
+        frontier = np.concatenate([left[internal], right[internal]])
+
+def _objective(name):
+    if name in SOFTMAX_OBJECTIVES:
+        return 'softmax'
+    if name in IDENTITY_OBJECTIVES:
+        return 'identity'
+    raise ValueError(f"Objective {name} is not supported by the array evaluator")
+
+# --- CHECKS & BENCHMARK ---
+def sample_blocks(duration_features_list, dest_features_list, categories, n_clusters, n=5000, seed=0):
+    """Duration and destination feature blocks for random NYC trips, a few with missing or unseen values"""
+    from features import (
+        FeatureLayout, duration_features, destination_features, destination_default,
+        DURATION_FEATURE_NAMES, DESTINATION_FEATURE_NAMES
+    )
+    rng = np.random.default_rng(seed)
+    p_lat, d_lat = rng.uniform(40.60, 40.90, (2, n))
+    p_lon, d_lon = rng.uniform(-74.05, -73.75, (2, n))
+    hour, month, weekday = rng.integers(0, 24, n), rng.integers(1, 13, n), rng.integers(0, 7, n)
+    passengers = rng.integers(1, 7, n)
+    p_cluster, d_cluster = rng.integers(0, n_clusters, (2, n))
+    duration = FeatureLayout(duration_features_list, DURATION_FEATURE_NAMES).fill(
+        duration_features(p_lat, p_lon, d_lat, d_lon, hour, month, weekday, passengers, p_cluster, d_cluster)
+    ).copy()
+    # An unseen pickup cluster encodes to NaN, the path unknown categories take in the app
+    p_cluster[:20] = n_clusters + 5
+    destination = FeatureLayout(dest_features_list, DESTINATION_FEATURE_NAMES, default=destination_default,
+                                categories=categories).fill(
+        destination_features(p_cluster, passengers, hour, month, weekday)
+    ).copy()
+    duration[20:40, rng.integers(0, duration.shape[1], 20)] = np.nan
+    return duration, destination
+
+def load_reference(model_path='models/'):
+    """The original boosters and their predict functions, plus arrays (exported ones when present)"""
+    from features import booster_categories, xgb_fast_predict, lgb_fast_predict
+    from model_store import read_manifest, load_duration_model, duration_missing, load_destination_model, load_tree_arrays
+
+    manifest = read_manifest(model_path)
+    xgb_model, feat_duration = load_duration_model(model_path, manifest)
+    lgb_booster, feat_dest = load_destination_model(model_path, manifest)
+    missing = duration_missing(manifest) if manifest else getattr(xgb_model, 'missing', np.nan)
+    if manifest and 'arrays' in manifest['duration']:
+        print(f"Checking the exported arrays in {model_path}native/")
+        duration_arrays, _ = load_tree_arrays(model_path, manifest, 'duration')
+        dest_arrays, _ = load_tree_arrays(model_path, manifest, 'destination')
+    else:
+        print("No exported arrays, flattening the boosters in memory")
+        duration_arrays = TreeArrays.from_xgboost(xgb_model, missing)
+        dest_arrays = TreeArrays.from_lightgbm(lgb_booster)
+    return {
+        'duration': (xgb_fast_predict(xgb_model, missing=missing), duration_arrays, feat_duration),
+        'destination': (lgb_fast_predict(lgb_booster), dest_arrays, feat_dest,
+                        booster_categories(lgb_booster, feat_dest))
+    }
+
+def verify(model_path='models/', n=5000, atol=1e-4):
+    """Compare array predictions with the original boosters on random trips, within a tolerance"""
+    reference = load_reference(model_path)
+    booster_duration, duration_arrays, feat_duration = reference['duration']
+    booster_dest, dest_arrays, feat_dest, categories = reference['destination']
+    duration, destination = sample_blocks(feat_duration, feat_dest, categories, dest_arrays.n_groups, n)
+
+    expected, got = np.asarray(booster_duration(duration)), duration_arrays.predict(duration)
+    err = float(np.abs(expected - got).max())
+    minutes = int(np.sum(np.maximum(1, np.round(np.expm1(expected))) != np.maximum(1, np.round(np.expm1(got)))))
+    print(f"Duration: {duration_arrays.n_trees} trees, {duration_arrays.n_nodes} nodes, depth {duration_arrays.depth} | "
+          f"max |log1p diff| {err:.2e} | rounded minutes differing {minutes}/{n}")
+    if err > atol:
+        raise AssertionError(f"Duration predictions differ by more than {atol}")
+
+    expected, got = np.asarray(booster_dest(destination)).reshape(n, -1), dest_arrays.predict(destination)
+    err = float(np.abs(expected - got).max())
+    top3 = int(np.sum(np.any(np.argsort(-expected, axis=1)[:, :3] != np.argsort(-got, axis=1)[:, :3], axis=1)))
+    print(f"Destination: {dest_arrays.n_trees} trees, {dest_arrays.n_nodes} nodes, depth {dest_arrays.depth} | "
+          f"max |probability diff| {err:.2e} | top-3 differing {top3}/{n}")
+    if err > atol:
+        raise AssertionError(f"Destination probabilities differ by more than {atol}")
+
+    for name, arrays, block in [('duration', duration_arrays, duration[:1]), ('destination', dest_arrays, destination[:1])]:
+        path = os.path.join(os.environ.get('TMPDIR', '/tmp'), f'tree_arrays_{os.getpid()}.npz')
+        try:
+            arrays.save(path)
+            assert np.array_equal(TreeArrays.load(path).predict(block), arrays.predict(block)), name
+        finally:
+            os.remove(path)
+    print("Save/load round trip OK")
+
+# Run in a fresh interpreter per evaluator so RSS reflects only what that evaluator loads
+BENCH_PROBE = """
+import json, os, sys, time
+import numpy as np
+import app
+from serving import process_memory
+
+def timed(fn, block, repeat):
+    fn(block)
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(block)
+        timings.append(time.perf_counter() - t0)
+    return float(np.median(timings))
+
+models = app.models
+result = {}
+for name, layout, predict in [('duration', 'duration_layout', 'duration_predict'), ('destination', 'dest_layout', 'dest_predict')]:
+    block = np.ascontiguousarray(np.repeat(models[layout].template[None, :], 1000, axis=0))
+    result[name] = {'row': timed(models[predict], block[:1], 2000), 'batch': timed(models[predict], block, 50)}
+result['rss'] = process_memory(os.getpid())['rss']
+result['boosters_imported'] = [m for m in ('xgboost', 'lightgbm') if m in sys.modules]
+print('BENCH ' + json.dumps(result))
+"""
+
+def bench(model_path='models/'):
+    """Single-row and 1000-row model latency plus process RSS, boosters vs arrays"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = {**os.environ, 'MODEL_PATH': model_path, 'MODEL_FORMAT': 'native', 'DESTINATION_MODE': 'live',
+           'MODEL_RELOAD_INTERVAL': '0', 'MICROBATCH': '0'}
+    for evaluator in ['booster', 'arrays']:
+        out = subprocess.run([sys.executable, '-c', BENCH_PROBE], cwd=here, env={**env, 'MODEL_EVALUATOR': evaluator},
+                             capture_output=True, text=True, check=True).stdout
+        r = json.loads(out.split('BENCH ', 1)[1])
+        print(f"{evaluator:8s}: duration row {r['duration']['row'] * 1e6:6.0f} us, 1000 rows {r['duration']['batch'] * 1e3:6.2f} ms | "
+              f"destination row {r['destination']['row'] * 1e6:6.0f} us, 1000 rows {r['destination']['batch'] * 1e3:6.2f} ms | "
+              f"RSS {r['rss']:5.0f} MB (imports {', '.join(r['boosters_imported']) or 'no booster library'})")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Array-backed tree evaluator for the duration and destination models")
+    parser.add_argument('command', choices=['verify', 'bench'])
+    parser.add_argument('--model-path', default='models/')
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--atol', type=float, default=1e-4)
+    args = parser.parse_args()
+
+    if args.command == 'verify':
+        verify(args.model_path, args.rows, args.atol)
+    else:
+        bench(args.model_path)
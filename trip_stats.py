@@ -0,0 +1,27 @@
+# Cleaning thresholds from the training notebook, shared by the offline pipeline and the live aggregates
+DURATION_RANGE_MIN = (1, 120)
+PASSENGER_RANGE = (1, 6)
+DISTANCE_RANGE_KM = (0.5, 30)
+SPEED_RANGE_KMH = (0.5, 120)  # lower bound exclusive
+
+def format_stats(trips, duration, speed, passengers, peak_hour):
+    """One zone's entry in the cluster_stats.json format the stats panel shows"""
+    return {
+        'avg_trips': f"{int(trips):,} trips",
+        'avg_duration': f"{int(duration)} min",
+        'avg_speed': f"{speed:.1f} km/h",
+        'avg_pax': f"{passengers:.1f} org",
+        'peak_time': f"{peak_hour:02d}:00 - {peak_hour + 1:02d}:00"
+    }
+
+def parse_stats(entry):
+    """Numbers back out of a format_stats entry: trips, mean duration, speed and passengers, and the peak hour"""
+    def number(text):
+        return float(text.split()[0].replace(',', ''))
+    return {
+        'trips': int(number(entry['avg_trips'])),
+        'duration_min': number(entry['avg_duration']),
+        'speed_kmh': number(entry['avg_speed']),
+        'passengers': number(entry['avg_pax']),
+        'peak_hour': int(entry['peak_time'].split(':')[0])
+    }